@@ -0,0 +1,247 @@
+import codecs
+import csv
+import io
+import json
+import uuid
+from datetime import datetime
+
+from geo import resolve_location
+from pagination import stream_query
+
+IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_ROWS = 20000
+MAX_IMPORT_BYTES = 64 * 1024 * 1024  # request body cap for one import
+MAX_REPORTED_ERRORS = 200
+EXPORT_BATCH_SIZE = 200
+
+EVENT_STATUSES = ('upcoming', 'ongoing', 'completed', 'cancelled')
+
+IMPORT_COLUMNS = (
+    'event_id', 'title', 'description', 'date', 'place', 'image',
+    'admin_id', 'max_participants', 'status', 'latitude', 'longitude',
+)
+
+EXPORT_COLUMNS = (
+    'event_id', 'title', 'description', 'date', 'place', 'image', 'admin_id',
+    'max_participants', 'current_participants', 'waste_collected', 'status', 'created_at',
+    'latitude', 'longitude',
+)
+
+INSERT_EVENT = f'''
+    INSERT INTO events ({', '.join(IMPORT_COLUMNS)})
+    VALUES ({', '.join('?' for _ in IMPORT_COLUMNS)})
+'''
+
+
+class BulkImportError(Exception):
+    pass
+
+
+class _RollBack(Exception):
+    pass
+
+
+def bulk_format(content_type, requested=None):
+    fmt = (requested or '').lower()
+    if not fmt:
+        fmt = 'csv' if 'csv' in (content_type or '') else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError(f"Unsupported format '{fmt}', use csv or ndjson")
+    return fmt
+
+
+def read_records(stream, fmt):
+    """Yield (line, record or None, error) from a CSV or NDJSON byte stream."""
+    text = codecs.getreader('utf-8-sig')(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+    for line_no, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, 'Each line must be a JSON object'
+            continue
+        yield line_no, record, None
+
+
+def _int(value, field, default):
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be an integer')
+
+
+def validate_event(record):
+    """Turn an import record into an INSERT_EVENT row, or raise ValueError."""
+    def text(field):
+        value = record.get(field)
+        return value.strip() if isinstance(value, str) else value
+
+    missing = [f for f in ('title', 'date', 'place') if not text(f)]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+    try:
+        datetime.fromisoformat(text('date'))
+    except (TypeError, ValueError):
+        raise ValueError('date must be YYYY-MM-DD')
+
+    max_participants = _int(record.get('max_participants'), 'max_participants', 50)
+    if max_participants <= 0:
+        raise ValueError('max_participants must be positive')
+    status = text('status') or 'upcoming'
+    if status not in EVENT_STATUSES:
+        raise ValueError(f"status must be one of {', '.join(EVENT_STATUSES)}")
+
+    return (
+        text('event_id') or str(uuid.uuid4()),
+        text('title'),
+        text('description') or '',
+        text('date'),
+        text('place'),
+        text('image') or None,
+        _int(record.get('admin_id'), 'admin_id', 1),
+        max_participants,
+        status,
+        *resolve_location({**record, 'place': text('place')}),
+    )
+
+
+def import_events(pool, records, atomic=False, dry_run=False):
+    """Validate records and insert the valid ones in a single transaction.
+
+    The whole body is parsed and validated before the write lock is taken, so
+    a slow upload doesn't block other writers. Rows are then written with
+    executemany in batches of IMPORT_BATCH_SIZE under one commit. With
+    atomic=True any invalid row rolls the import back; otherwise invalid rows
+    are skipped and reported.
+    """
+    errors = []
+    valid = []
+    seen = set()
+    total = 0
+
+    def reject(line, message):
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'line': line, 'error': message})
+
+    for line, record, error in records:
+        total += 1
+        if total > MAX_IMPORT_ROWS:
+            raise BulkImportError(f'Imports are limited to {MAX_IMPORT_ROWS} rows')
+        if error is None:
+            try:
+                row = validate_event(record)
+                if row[0] in seen:
+                    raise ValueError(f'event_id {row[0]} appears more than once')
+                seen.add(row[0])
+                valid.append((line, row))
+                continue
+            except ValueError as e:
+                error = str(e)
+        reject(line, error)
+
+    imported = 0
+    rolled_back = False
+    try:
+        with pool.transaction() as conn:
+            for start in range(0, len(valid), IMPORT_BATCH_SIZE):
+                batch = valid[start:start + IMPORT_BATCH_SIZE]
+                ids = [row[0] for _, row in batch]
+                existing = {
+                    r[0] for r in conn.execute(
+                        f"SELECT event_id FROM events WHERE event_id IN ({','.join('?' for _ in ids)})", ids
+                    )
+                }
+                rows = []
+                for line, row in batch:
+                    if row[0] in existing:
+                        reject(line, f'event_id {row[0]} already exists')
+                    else:
+                        rows.append(row)
+                conn.executemany(INSERT_EVENT, rows)
+                imported += len(rows)
+
+            if dry_run or (atomic and total > imported):
+                raise _RollBack()
+    except _RollBack:
+        rolled_back = True
+
+    failed = total - imported
+    return {
+        'total': total,
+        'valid': imported,
+        'imported': 0 if rolled_back else imported,
+        'failed': failed,
+        'errors': errors,
+        'errors_truncated': failed > len(errors),
+        'rolled_back': rolled_back,
+    }
+
+
+def _participants(conn, event_ids):
+    by_event = {event_id: [] for event_id in event_ids}
+    rows = conn.execute(f'''
+        SELECT ep.event_id, ep.user_id, u.name, u.email, ep.joined_at
+        FROM event_participants ep
+        LEFT JOIN users u ON u.id = ep.user_id
+        WHERE ep.event_id IN ({','.join('?' for _ in event_ids)})
+        ORDER BY ep.event_id, ep.joined_at
+    ''', event_ids)
+    for row in rows:
+        by_event[row['event_id']].append({
+            'user_id': row['user_id'],
+            'name': row['name'],
+            'email': row['email'],
+            'joined_at': row['joined_at'],
+        })
+    return by_event
+
+
+def export_events(pool, fmt):
+    """Yield events with their participants as CSV or NDJSON, batch by batch.
+
+    CSV flattens participants into ';'-separated participant_ids and
+    participant_emails columns; NDJSON nests them as a list. The CSV columns
+    are a superset of what the importer reads, so an export can be re-imported.
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS + ('participant_count', 'participant_ids', 'participant_emails'))
+        yield buffer.getvalue()
+
+    with pool.connection() as conn:
+        cursor = stream_query(
+            conn, f"SELECT {', '.join(EXPORT_COLUMNS)} FROM events ORDER BY created_at, id"
+        )
+        while True:
+            events = cursor.fetchmany(EXPORT_BATCH_SIZE)
+            if not events:
+                break
+            participants = _participants(conn, [e['event_id'] for e in events])
+            if fmt == 'csv':
+                buffer.seek(0)
+                buffer.truncate()
+                for event in events:
+                    people = participants[event['event_id']]
+                    writer.writerow(tuple(event) + (
+                        len(people),
+                        ';'.join(str(p['user_id']) for p in people),
+                        ';'.join(p['email'] or '' for p in people),
+                    ))
+                yield buffer.getvalue()
+            else:
+                yield ''.join(
+                    json.dumps({**dict(event), 'participants': participants[event['event_id']]}, default=str) + '\n'
+                    for event in events
+                )
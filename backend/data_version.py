@@ -0,0 +1,58 @@
+# A single counter per database, bumped by triggers whenever the tables behind
+# the event listings and the dashboard change. Reads derive their ETag from it,
+# so a client that already has the current version gets a 304 without the
+# listing queries running.
+
+DATA_VERSION_TABLE = '''
+    CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version BIGINT NOT NULL DEFAULT 0
+    )
+'''
+
+# Listings also show the admin's name, which nothing changes after registration
+USERS_VERSIONED_TABLES = ('events', 'event_participants')
+EVENTS_VERSIONED_TABLES = ('events',)
+
+
+def data_version_schema(tables):
+    steps = [DATA_VERSION_TABLE, 'INSERT OR IGNORE INTO data_version (id) VALUES (1)']
+    for table in tables:
+        for op in ('INSERT', 'UPDATE', 'DELETE'):
+            steps.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_data_version_{op.lower()} AFTER {op} ON {table}
+            BEGIN
+                UPDATE data_version SET version = version + 1 WHERE id = 1;
+            END
+            ''')
+    return steps
+
+
+def server_data_version_schema(tables):
+    # Statement-level, so a bulk import bumps the counter once, not per row
+    steps = [
+        DATA_VERSION_TABLE,
+        'INSERT INTO data_version (id) VALUES (1) ON CONFLICT DO NOTHING',
+        '''
+        CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE data_version SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        ''',
+    ]
+    for table in tables:
+        steps += [
+            f'DROP TRIGGER IF EXISTS trg_{table}_data_version ON {table}',
+            f'''
+            CREATE TRIGGER trg_{table}_data_version
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()
+            ''',
+        ]
+    return steps
+
+
+def read_data_version(conn):
+    return conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
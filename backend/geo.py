@@ -0,0 +1,350 @@
+import csv
+import logging
+import math
+import os
+import re
+import threading
+
+try:
+    import numpy as np
+except ImportError:  # distances are refined in pure Python instead
+    np = None
+
+from search import fold
+
+logger = logging.getLogger(__name__)
+
+# A name,latitude,longitude CSV, or a GeoNames country dump (e.g. IN.txt) for wider coverage
+GAZETTEER_PATH = os.environ.get(
+    'GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gazetteer.csv')
+)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 500
+MAX_PLACE_WORDS = 5               # longest gazetteer name tried as one phrase
+
+WORD = re.compile(r'[^\W_]+')
+
+# Coordinates are filled in by the write paths (see resolve_location); the
+# R-tree mirrors them through triggers so nearby queries never scan events.
+GEO_SCHEMA = [
+    'ALTER TABLE events ADD COLUMN latitude REAL',
+    'ALTER TABLE events ADD COLUMN longitude REAL',
+    'CREATE VIRTUAL TABLE IF NOT EXISTS events_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_rtree_insert AFTER INSERT ON events
+    WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+    BEGIN
+        INSERT INTO events_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_rtree_update AFTER UPDATE OF latitude, longitude ON events
+    BEGIN
+        DELETE FROM events_rtree WHERE id = OLD.id;
+        INSERT INTO events_rtree
+        SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_rtree_delete AFTER DELETE ON events
+    BEGIN
+        DELETE FROM events_rtree WHERE id = OLD.id;
+    END
+    ''',
+    lambda conn: geocode_missing(conn),
+]
+
+# Server databases (PostgreSQL) prefilter the bounding box with a plain index
+SERVER_GEO_SCHEMA = [
+    'ALTER TABLE events ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION',
+    'ALTER TABLE events ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION',
+    'CREATE INDEX IF NOT EXISTS idx_events_location ON events (latitude, longitude)',
+    lambda conn: geocode_missing(conn),
+]
+
+
+class GeoError(ValueError):
+    pass
+
+
+def place_key(text):
+    return ' '.join(fold(word) for word in WORD.findall(text))
+
+
+class Gazetteer:
+    """Offline place-name lookup, loaded on first use."""
+
+    def __init__(self, path=GAZETTEER_PATH):
+        self.path = path
+        self._places = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        places = {}
+        population = {}
+
+        def add(name, lat, lon, rank=0):
+            key = place_key(name)
+            if key and rank >= population.get(key, -1):
+                places[key] = (lat, lon)
+                population[key] = rank
+            # "Juhu Beach" is also found as "Juhu"
+            short = re.sub(r' beach$', '', key)
+            if short != key and short not in places:
+                places[short] = (lat, lon)
+                population[short] = -1
+
+        try:
+            with open(self.path, encoding='utf-8', newline='') as f:
+                if self.path.endswith('.txt'):
+                    # GeoNames: name, asciiname, alternatenames, latitude, longitude ... population
+                    for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                        lat, lon, rank = float(row[4]), float(row[5]), int(row[14] or 0)
+                        for name in {row[1], row[2]}:
+                            add(name, lat, lon, rank)
+                else:
+                    for row in csv.DictReader(f):
+                        add(row['name'], float(row['latitude']), float(row['longitude']))
+        except OSError as e:
+            logger.error(f"Gazetteer {self.path} unavailable, events won't be located: {e}")
+        logger.info(f"Loaded {len(places)} gazetteer names from {self.path}")
+        return places
+
+    @property
+    def places(self):
+        with self._lock:
+            if self._places is None:
+                self._places = self._load()
+            return self._places
+
+    def locate(self, place):
+        """(latitude, longitude) for free-text place, or None.
+
+        Tries each comma-separated part, then the longest run of words in it
+        that names a known place, so "Juhu Beach, near Mumbai" finds Juhu
+        Beach before Mumbai.
+        """
+        if not place:
+            return None
+        places = self.places
+        for part in place.split(','):
+            words = place_key(part).split()
+            for size in range(min(len(words), MAX_PLACE_WORDS), 0, -1):
+                for start in range(len(words) - size + 1):
+                    found = places.get(' '.join(words[start:start + size]))
+                    if found:
+                        return found
+        return None
+
+
+gazetteer = Gazetteer()
+
+
+def _coordinate(value, name, bound):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise GeoError(f'{name} must be a number')
+    if not -bound <= number <= bound:
+        raise GeoError(f'{name} must be between -{bound} and {bound}')
+    return number
+
+
+def has_coordinates(data):
+    return data.get('latitude') not in (None, '') and data.get('longitude') not in (None, '')
+
+
+def resolve_location(data):
+    """(latitude, longitude) for an event payload: explicit coordinates, else its place."""
+    if has_coordinates(data):
+        return _coordinate(data['latitude'], 'latitude', 90), _coordinate(data['longitude'], 'longitude', 180)
+    return gazetteer.locate(data.get('place')) or (None, None)
+
+
+def geocode_missing(conn):
+    rows = conn.execute('SELECT id, place FROM events WHERE latitude IS NULL').fetchall()
+    located = []
+    for row in rows:
+        found = gazetteer.locate(row['place'])
+        if found:
+            located.append((*found, row['id']))
+    if located:
+        conn.executemany('UPDATE events SET latitude = ?, longitude = ? WHERE id = ?', located)
+    logger.info(f"Located {len(located)} of {len(rows)} events from the gazetteer")
+
+
+def bounding_box(lat, lon, radius_km):
+    """(min_lat, max_lat, min_lon, max_lon) enclosing the circle; whole longitudes near the poles/antimeridian."""
+    dlat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = dlat / math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if lon - dlon < -180 or lon + dlon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distances from (lat, lon) to each point, vectorised when numpy is available."""
+    if np is not None:
+        lats = np.radians(np.asarray(lats, dtype=float))
+        lons = np.radians(np.asarray(lons, dtype=float))
+        lat, lon = math.radians(lat), math.radians(lon)
+        a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    lat, lon = math.radians(lat), math.radians(lon)
+    distances = []
+    for plat, plon in zip(lats, lons):
+        plat, plon = math.radians(plat), math.radians(plon)
+        a = math.sin((plat - lat) / 2) ** 2 + math.cos(lat) * math.cos(plat) * math.sin((plon - lon) / 2) ** 2
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0))))
+    return distances
+
+
+def _candidates_sql(pool, status):
+    if pool.dialect == 'sqlite':
+        # R-tree coordinates are 32-bit floats rounded outwards: within a metre, fine for ranking
+        return f'''
+            SELECT r.id, r.min_lat AS latitude, r.min_lon AS longitude
+            FROM events_rtree r
+            {'JOIN events e ON e.id = r.id' if status else ''}
+            WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+            {'AND e.status = ?' if status else ''}
+        '''
+    return f'''
+        SELECT id, latitude, longitude FROM events
+        WHERE latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?
+        {'AND status = ?' if status else ''}
+    '''
+
+
+def nearby_events(pool, lat, lon, radius_km=DEFAULT_RADIUS_KM, limit=50, status=None):
+    """Events within radius_km of (lat, lon), nearest first.
+
+    The bounding box is answered by the R-tree (an index range on a server
+    database), only the candidates' ids and coordinates are read, and the
+    exact great-circle distances are computed in one vectorised pass. Full
+    rows are read just for the page. Returns (rows with distance_km, total
+    within the radius).
+    """
+    lat = _coordinate(lat, 'lat', 90)
+    lon = _coordinate(lon, 'lon', 180)
+    try:
+        radius_km = float(radius_km)
+    except (TypeError, ValueError):
+        raise GeoError('radius_km must be a number')
+    if not 0 < radius_km <= MAX_RADIUS_KM:
+        raise GeoError(f'radius_km must be greater than 0 and at most {MAX_RADIUS_KM}')
+
+    box = bounding_box(lat, lon, radius_km)
+    params = (*box, status) if status else box
+    with pool.connection() as conn:
+        candidates = conn.execute(_candidates_sql(pool, status), params).fetchall()
+        if not candidates:
+            return [], 0
+        ids, lats, lons = zip(*((row[0], row[1], row[2]) for row in candidates))
+        distances = haversine_km(lat, lon, lats, lons)
+
+        if np is not None:
+            inside = np.flatnonzero(distances <= radius_km)
+            nearest = inside[np.argsort(distances[inside], kind='stable')][:limit]
+            page = [(ids[i], float(distances[i])) for i in nearest]
+            total = len(inside)
+        else:
+            inside = sorted((d, i) for i, d in zip(ids, distances) if d <= radius_km)
+            page = [(i, d) for d, i in inside[:limit]]
+            total = len(inside)
+        if not page:
+            return [], total
+
+        rows = conn.execute(f'''
+            SELECT e.*, u.name AS admin_name FROM events e
+            LEFT JOIN users u ON u.id = e.admin_id
+            WHERE e.id IN ({','.join('?' for _ in page)})
+        ''', [event_id for event_id, _ in page]).fetchall()
+
+    by_id = {row['id']: row for row in rows}
+    results = []
+    for event_id, distance in page:
+        if event_id in by_id:
+            results.append({**dict(by_id[event_id]), 'distance_km': round(distance, 3)})
+    return results, total
+
+
+def benchmark(rows=300_000, queries=200, database=None):
+    """Seed events scattered along the coast and time nearby queries.
+
+    Compares the R-tree/bounding-box path with a haversine over every row,
+    which is what the events page does in the browser today.
+    """
+    import random
+    import tempfile
+    import time
+    import uuid
+
+    from db import create_pool
+    from migrations import SERVER_USERS_MIGRATIONS, USERS_MIGRATIONS, migrations_for, run_migrations
+
+    rng = random.Random(7)
+    anchors = list(gazetteer.places.items())
+    pool = create_pool(database or os.path.join(tempfile.mkdtemp(), 'geo.db'))
+    run_migrations(pool, migrations_for(pool, USERS_MIGRATIONS, SERVER_USERS_MIGRATIONS))
+
+    start = time.perf_counter()
+    for first in range(0, rows, 10_000):
+        seeded = []
+        for _ in range(min(10_000, rows - first)):
+            name, (lat, lon) = rng.choice(anchors)
+            seeded.append((
+                str(uuid.uuid4()), f'Cleanup near {name}', '2030-01-01', name, 1,
+                lat + rng.gauss(0, 0.3), lon + rng.gauss(0, 0.3),
+            ))
+        with pool.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO events (event_id, title, date, place, admin_id, latitude, longitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', seeded)
+    seed_seconds = time.perf_counter() - start
+
+    def timed(fn, n=queries):
+        latencies = []
+        for _ in range(n):
+            _, (lat, lon) = rng.choice(anchors)
+            t = time.perf_counter()
+            fn(lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05))
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        return {
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        }
+
+    report = {
+        'rows': rows, 'backend': pool.dialect, 'vectorised': np is not None,
+        'seed_rows_per_second': round(rows / seed_seconds),
+    }
+    for radius in (5, 25, 100):
+        report[f'nearby_{radius}km'] = timed(lambda lat, lon: nearby_events(pool, lat, lon, radius))
+
+    def scan_all(lat, lon):
+        with pool.connection() as conn:
+            everything = conn.execute('SELECT id, latitude, longitude FROM events').fetchall()
+        distances = haversine_km(lat, lon, [r[1] for r in everything], [r[2] for r in everything])
+        sorted(d for d in distances if d <= DEFAULT_RADIUS_KM)
+
+    report['full_scan_25km'] = timed(scan_all, min(queries, 5))
+    pool.close_all()
+    return report
+
+
+if __name__ == '__main__':
+    # python geo.py [rows] [queries] [database url]
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    args = [int(a) for a in sys.argv[1:3]]
+    print(benchmark(*args, database=sys.argv[3] if len(sys.argv) > 3 else None))
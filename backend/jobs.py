@@ -0,0 +1,338 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Match this to how many generations the local model server can run at once
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', 1))
+LLM_QUEUE_SIZE = int(os.environ.get('LLM_QUEUE_SIZE', 100))
+JOB_RETENTION = 24 * 3600  # finished jobs are kept this long for polling
+JOB_POLL_INTERVAL = 30     # idle workers top the queue up from the table this often
+JOB_PRUNE_INTERVAL = 3600  # workers delete jobs older than JOB_RETENTION this often
+# A running job belongs to the instance holding its lease; longer than any
+# generation (READ_TIMEOUTS plus retries), or a slow job is run twice
+JOB_LEASE = int(os.environ.get('LLM_JOB_LEASE', 1800))
+# Names this process in job leases, so a restart reclaims its own running
+# jobs at once. Give each process its own when several share a host.
+INSTANCE_ID = os.environ.get('INSTANCE_ID', socket.gethostname())
+
+JOBS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS llm_jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        result TEXT,
+        error TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_llm_jobs_status_created ON llm_jobs (status, created_at)',
+]
+
+# Workers claim a job (status 'running' plus a lease) before running it, so
+# app instances sharing one database never run the same job twice
+JOBS_LEASE_SCHEMA = [
+    'ALTER TABLE llm_jobs ADD COLUMN lease_owner TEXT',
+    'ALTER TABLE llm_jobs ADD COLUMN lease_until REAL',
+]
+
+SERVER_JOBS_LEASE_SCHEMA = [
+    'ALTER TABLE llm_jobs ADD COLUMN IF NOT EXISTS lease_owner TEXT',
+    'ALTER TABLE llm_jobs ADD COLUMN IF NOT EXISTS lease_until DOUBLE PRECISION',
+]
+
+FINISHED = ('succeeded', 'failed')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Bounded worker pool for slow LLM work, with job state persisted in SQLite.
+
+    submit() returns a job id straight away; a fixed number of worker threads
+    run the registered handler for each job kind. Jobs left queued or running
+    by a previous process are picked up again by recover(); any that don't fit
+    in the queue stay queued in the table and are added as room frees up.
+    A worker claims each job with a lease first, so several instances can
+    share the table: queued jobs go to whichever claims them, and a running
+    job is only retried once its owner's lease has expired.
+    """
+
+    def __init__(self, pool, handlers, concurrency=LLM_CONCURRENCY, max_queue=LLM_QUEUE_SIZE,
+                 instance=INSTANCE_ID):
+        self.pool = pool
+        self.instance = instance
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._done = {}
+        self._refilling = threading.Lock()
+        self._workers = []
+        self._running = 0
+        self._next_prune = 0.0
+        self._metrics = {
+            'submitted': 0, 'succeeded': 0, 'failed': 0, 'rejected': 0,
+            'total_wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'total_run_seconds': 0.0,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.concurrency):
+                worker = threading.Thread(target=self._work, name=f'llm-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def recover(self):
+        """Requeue jobs that were pending when the previous process stopped."""
+        with self.pool.connection() as conn:
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM llm_jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+            # Ours from before the restart, or abandoned; other instances' stay theirs
+            conn.execute('''
+                UPDATE llm_jobs SET status = 'queued', started_at = NULL, lease_owner = NULL, lease_until = NULL
+                WHERE status = 'running' AND (lease_owner = ? OR lease_owner IS NULL OR lease_until <= ?)
+            ''', (self.instance, time.time()))
+            conn.commit()
+        self.prune()
+        queued = self._refill()
+        if pending:
+            logger.info(f"Recovered {pending} pending LLM jobs, {queued} queued now, the rest as workers free up")
+        return pending
+
+    def prune(self):
+        """Delete jobs that finished more than JOB_RETENTION ago. Returns how many."""
+        self._next_prune = time.monotonic() + JOB_PRUNE_INTERVAL
+        with self.pool.connection() as conn:
+            removed = conn.execute(
+                'DELETE FROM llm_jobs WHERE finished_at < ?', (time.time() - JOB_RETENTION,)
+            ).rowcount
+            conn.commit()
+        if removed:
+            logger.info(f"Pruned {removed} finished LLM jobs")
+        return removed
+
+    def _refill(self):
+        """Queue jobs that are waiting in the table but not in this process, up to free capacity."""
+        if not self._refilling.acquire(blocking=False):
+            return 0
+        try:
+            free = self._queue.maxsize - self._queue.qsize() if self._queue.maxsize > 0 else LLM_QUEUE_SIZE
+            if free <= 0:
+                return 0
+            with self._lock:
+                tracked = len(self._done)
+            with self.pool.connection() as conn:
+                # Also running jobs whose instance died: their lease has run out
+                rows = conn.execute('''
+                    SELECT id, created_at FROM llm_jobs
+                    WHERE status = 'queued' OR (status = 'running' AND lease_until <= ?)
+                    ORDER BY created_at LIMIT ?
+                ''', (time.time(), free + tracked)).fetchall()
+            queued = 0
+            for row in rows:
+                if queued >= free:
+                    break
+                try:
+                    queued += self._enqueue(row['id'], row['created_at'])
+                except queue.Full:
+                    break
+            return queued
+        finally:
+            self._refilling.release()
+
+    def _enqueue(self, job_id, created_at):
+        """Returns False if the job is already queued or running here."""
+        with self._lock:
+            if job_id in self._done:
+                return False
+            self._done[job_id] = threading.Event()
+        try:
+            self._queue.put_nowait((job_id, created_at))
+        except queue.Full:
+            with self._lock:
+                self._done.pop(job_id, None)
+            raise
+        return True
+
+    def submit(self, kind, params):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self.start()
+        if self._queue.full():
+            with self._lock:
+                self._metrics['rejected'] += 1
+            raise QueueFull('LLM job queue is full, try again later')
+
+        job_id = str(uuid.uuid4())
+        created_at = time.time()
+        with self.pool.connection() as conn:
+            conn.execute(
+                'INSERT INTO llm_jobs (id, kind, params, created_at) VALUES (?, ?, ?, ?)',
+                (job_id, kind, json.dumps(params), created_at)
+            )
+            conn.commit()
+        try:
+            self._enqueue(job_id, created_at)
+        except queue.Full:
+            self._finish(job_id, 'failed', error='LLM job queue is full')
+            with self._lock:
+                self._metrics['rejected'] += 1
+            raise QueueFull('LLM job queue is full, try again later')
+        with self._lock:
+            self._metrics['submitted'] += 1
+        return job_id
+
+    def _work(self):
+        while True:
+            try:
+                job_id, created_at = self._queue.get(timeout=JOB_POLL_INTERVAL)
+            except queue.Empty:
+                self._housekeep()
+                continue
+            started = time.time()
+            with self._lock:
+                self._running += 1
+                wait = started - created_at
+                self._metrics['total_wait_seconds'] += wait
+                self._metrics['max_wait_seconds'] = max(self._metrics['max_wait_seconds'], wait)
+            try:
+                self._run(job_id, started)
+            except Exception as e:
+                logger.error(f"LLM job {job_id} crashed: {e}")
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._metrics['total_run_seconds'] += time.time() - started
+                self._queue.task_done()
+            self._housekeep(top_up=self._queue.empty())
+
+    def _housekeep(self, top_up=True):
+        # Between jobs too, so a queue that never drains still prunes
+        if time.monotonic() >= self._next_prune:
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"Pruning finished LLM jobs failed: {e}")
+        if top_up:
+            try:
+                self._refill()
+            except Exception as e:
+                logger.error(f"Refilling the LLM job queue failed: {e}")
+
+    def _run(self, job_id, started):
+        with self.pool.transaction() as conn:
+            claimed = conn.execute('''
+                UPDATE llm_jobs SET status = 'running', started_at = ?, lease_owner = ?, lease_until = ?
+                WHERE id = ? AND (status = 'queued' OR (status = 'running' AND lease_until <= ?))
+            ''', (started, self.instance, started + JOB_LEASE, job_id, started)).rowcount
+            row = conn.execute(
+                'SELECT kind, params FROM llm_jobs WHERE id = ?', (job_id,)
+            ).fetchone() if claimed else None
+        if not row:
+            # Gone, finished, or claimed by another instance; waiters poll the table
+            with self._lock:
+                done = self._done.pop(job_id, None)
+            if done:
+                done.set()
+            return
+        try:
+            result = self.handlers[row['kind']](**json.loads(row['params']))
+        except Exception as e:
+            logger.error(f"LLM job {job_id} ({row['kind']}) failed: {e}")
+            self._finish(job_id, 'failed', error=str(e))
+            return
+        self._finish(job_id, 'succeeded', result=result)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self.pool.connection() as conn:
+            conn.execute(
+                '''
+                UPDATE llm_jobs SET status = ?, result = ?, error = ?, finished_at = ?,
+                    lease_owner = NULL, lease_until = NULL
+                WHERE id = ?
+                ''',
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            conn.commit()
+        with self._lock:
+            self._metrics[status] += 1
+            done = self._done.pop(job_id, None)
+        if done:
+            done.set()
+
+    def get(self, job_id):
+        with self.pool.connection() as conn:
+            row = conn.execute('SELECT * FROM llm_jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+        job = {
+            'id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+        }
+        if row['status'] == 'succeeded':
+            job['result'] = json.loads(row['result'])
+        elif row['status'] == 'failed':
+            job['error'] = row['error']
+        elif row['status'] == 'queued':
+            job['position'] = self.position(row['created_at'])
+        return job
+
+    def position(self, created_at):
+        with self.pool.connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM llm_jobs WHERE status = 'queued' AND created_at < ?",
+                (created_at,)
+            ).fetchone()[0]
+
+    def wait(self, job_id, timeout):
+        """Block until the job finishes or timeout passes, then return its state."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            done = self._done.get(job_id)
+        if done:
+            done.wait(timeout)
+
+        # Job owned by another process (or already finished): poll the table
+        while True:
+            job = self.get(job_id)
+            if not job or job['status'] in FINISHED or time.monotonic() >= deadline:
+                return job
+            time.sleep(0.5)
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+            running = self._running
+        finished = m['succeeded'] + m['failed']
+        return {
+            'concurrency': self.concurrency,
+            'queue_depth': self._queue.qsize(),
+            'running': running,
+            'submitted': m['submitted'],
+            'succeeded': m['succeeded'],
+            'failed': m['failed'],
+            'rejected': m['rejected'],
+            'avg_wait_seconds': round(m['total_wait_seconds'] / finished, 3) if finished else 0.0,
+            'max_wait_seconds': round(m['max_wait_seconds'], 3),
+            'avg_run_seconds': round(m['total_run_seconds'] / finished, 3) if finished else 0.0,
+        }
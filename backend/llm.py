@@ -0,0 +1,217 @@
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import observe_llm
+
+logger = logging.getLogger(__name__)
+
+LM_STUDIO_BASE_URL = "http://127.0.0.1:1234"
+
+CONNECT_TIMEOUT = 3.05
+# Read timeouts per operation, a quiz can take minutes on a local model
+READ_TIMEOUTS = {
+    'models': 10,
+    'event_template': 120,
+    'event': 30,
+    'quiz': 600,
+}
+DEFAULT_READ_TIMEOUT = 60
+
+MAX_RETRIES = 2
+RETRY_BASE_DELAY = 0.5
+RETRY_STATUSES = {429, 502, 503, 504}
+POOL_MAXSIZE = 16
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMClient:
+    """Shared HTTP client for the OpenAI-compatible LM Studio API.
+
+    One pooled keep-alive session serves every call. Connection failures and
+    retryable statuses are retried a bounded number of times with jittered
+    backoff; read timeouts are not, since the server may still be generating.
+    """
+
+    def __init__(self, base_url=LM_STUDIO_BASE_URL, max_retries=MAX_RETRIES):
+        self.chat_endpoint = f"{base_url}/v1/chat/completions"
+        self.models_endpoint = f"{base_url}/v1/models"
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._in_flight = 0
+        self._last_finished = 0.0
+
+    def timeout(self, operation):
+        return (CONNECT_TIMEOUT, READ_TIMEOUTS.get(operation, DEFAULT_READ_TIMEOUT))
+
+    @contextmanager
+    def _active(self):
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._last_finished = time.monotonic()
+
+    def is_idle(self, grace=2.0):
+        """True when no generation is running and none finished in the last `grace` seconds."""
+        with self._lock:
+            return self._in_flight == 0 and time.monotonic() - self._last_finished >= grace
+
+    def _record(self, operation, elapsed, ok, usage=None, retries=0, first_token=None):
+        observe_llm(operation, elapsed, ok, usage, first_token)
+        with self._lock:
+            m = self._metrics.setdefault(operation, {
+                'calls': 0, 'errors': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                'last_seconds': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0,
+                'streams': 0, 'first_token_seconds': 0.0,
+            })
+            m['calls'] += 1
+            m['retries'] += retries
+            m['total_seconds'] += elapsed
+            m['last_seconds'] = elapsed
+            m['max_seconds'] = max(m['max_seconds'], elapsed)
+            if not ok:
+                m['errors'] += 1
+            if usage:
+                m['prompt_tokens'] += usage.get('prompt_tokens', 0) or 0
+                m['completion_tokens'] += usage.get('completion_tokens', 0) or 0
+            if first_token is not None:
+                m['streams'] += 1
+                m['first_token_seconds'] += first_token
+
+    def request(self, method, url, operation, **kwargs):
+        """Send a request with retries; returns the response or raises LLMError."""
+        kwargs.setdefault('timeout', self.timeout(operation))
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response, attempt
+                response.close()
+            except requests.exceptions.ConnectionError as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"Error connecting to LM Studio: {e}")
+            except requests.exceptions.RequestException as e:
+                raise LLMError(f"LM Studio request failed: {e}")
+            delay = RETRY_BASE_DELAY * 2 ** attempt
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            attempt += 1
+
+    def chat(self, operation, messages, model='local-model', temperature=0.7, max_tokens=500, **extra):
+        """Run a chat completion and return the assistant message text."""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": False,
+            **extra,
+        }
+        start = time.perf_counter()
+        retries = 0
+        try:
+            with self._active():
+                response, retries = self.request('POST', self.chat_endpoint, operation, json=payload)
+                if response.status_code != 200:
+                    raise LLMError(f"LM Studio error: {response.status_code} - {response.text}")
+                result = response.json()
+            content = result['choices'][0]['message']['content']
+        except (LLMError, ValueError, KeyError, IndexError) as e:
+            self._record(operation, time.perf_counter() - start, False, retries=retries)
+            if isinstance(e, LLMError):
+                raise
+            raise LLMError(f"Malformed LM Studio response: {e}")
+
+        elapsed = time.perf_counter() - start
+        self._record(operation, elapsed, True, result.get('usage'), retries)
+        logger.info(f"LLM {operation} call took {elapsed:.2f}s")
+        return content
+
+    def chat_stream(self, operation, messages, model='local-model', temperature=0.7, max_tokens=500, **extra):
+        """Run a streaming chat completion, yielding content deltas as they arrive."""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            **extra,
+        }
+        start = time.perf_counter()
+        first_token = None
+        usage = None
+        retries = 0
+        try:
+            response, retries = self.request('POST', self.chat_endpoint, operation, json=payload, stream=True)
+            if response.status_code != 200:
+                raise LLMError(f"LM Studio error: {response.status_code} - {response.text}")
+            response.encoding = 'utf-8'
+            with self._active(), response:
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        break
+                    chunk = json.loads(data)
+                    usage = chunk.get('usage') or usage
+                    choices = chunk.get('choices') or [{}]
+                    delta = (choices[0].get('delta') or {}).get('content')
+                    if delta:
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        yield delta
+        except (LLMError, ValueError, KeyError, requests.exceptions.RequestException) as e:
+            self._record(operation, time.perf_counter() - start, False, retries=retries)
+            if isinstance(e, LLMError):
+                raise
+            raise LLMError(f"LM Studio stream failed: {e}")
+
+        elapsed = time.perf_counter() - start
+        self._record(operation, elapsed, True, usage, retries, first_token or elapsed)
+        logger.info(f"LLM {operation} stream took {elapsed:.2f}s")
+
+    def list_models(self):
+        start = time.perf_counter()
+        try:
+            response, retries = self.request('GET', self.models_endpoint, 'models')
+            if response.status_code != 200:
+                raise LLMError(f"Failed to get models: {response.status_code}")
+            models = response.json().get('data', [])
+        except (LLMError, ValueError) as e:
+            self._record('models', time.perf_counter() - start, False)
+            raise LLMError(str(e))
+        self._record('models', time.perf_counter() - start, True, retries=retries)
+        return models
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for operation, m in self._metrics.items():
+                stats[operation] = {
+                    **m,
+                    'avg_seconds': round(m['total_seconds'] / m['calls'], 3) if m['calls'] else 0.0,
+                    'avg_first_token_seconds': (
+                        round(m['first_token_seconds'] / m['streams'], 3) if m['streams'] else None
+                    ),
+                }
+            return stats
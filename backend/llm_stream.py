@@ -0,0 +1,89 @@
+import json
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JSONStreamScanner:
+    """Incrementally scans streamed model output for complete JSON values.
+
+    The model may wrap its answer in prose or markdown, so text before the
+    first '[' or '{' is ignored. Two views are offered over the same scan:
+    complete objects inside a top-level array (quiz questions) and complete
+    members of a top-level object (event fields).
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.root = None          # '[' or '{' once the top-level value has started
+        self.item_start = None    # start of the value/member currently being read
+        self.done = False
+
+    def _scan(self):
+        """Yield (start, end) spans of complete depth-1 items."""
+        buf = self.buffer
+        while self.pos < len(buf) and not self.done:
+            ch = buf[self.pos]
+            i = self.pos
+            self.pos += 1
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+
+            if self.root is None:
+                if ch in '[{':
+                    self.root = ch
+                    self.depth = 1
+                    self.item_start = i + 1
+                continue
+
+            if ch == '"':
+                self.in_string = True
+            elif ch in '[{':
+                self.depth += 1
+            elif ch in ']}':
+                self.depth -= 1
+                if self.depth == 0:
+                    if buf[self.item_start:i].strip():
+                        yield self.item_start, i
+                    self.done = True
+            elif ch == ',' and self.depth == 1:
+                yield self.item_start, i
+                self.item_start = i + 1
+
+    def feed_array_items(self, text):
+        """Feed a chunk and return the array elements it completed."""
+        self.buffer += text
+        items = []
+        for start, end in self._scan():
+            if self.root != '[':
+                continue
+            try:
+                items.append(json.loads(self.buffer[start:end]))
+            except ValueError:
+                continue
+        return items
+
+    def feed_object_members(self, text):
+        """Feed a chunk and return the (key, value) members it completed."""
+        self.buffer += text
+        members = []
+        for start, end in self._scan():
+            if self.root != '{':
+                continue
+            try:
+                members.extend(json.loads('{' + self.buffer[start:end] + '}').items())
+            except ValueError:
+                continue
+        return members
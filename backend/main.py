@@ -1,23 +1,64 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, abort, g, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-import requests
 import json
 import logging
 import sqlite3
-import hashlib
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 import re
 import logging
-import speech_recognition as sr
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.exceptions import RequestEntityTooLarge
+import mimetypes
 import uuid
 import datetime
 import secrets
 import os
+import time
+import hashlib
+from urllib.parse import urlencode
+from db import users_pool, events_pool, pool_stats
+from migrations import (
+    run_migrations, check_query_plans, migrations_for, USERS_MIGRATIONS, EVENTS_MIGRATIONS,
+    SERVER_USERS_MIGRATIONS, SERVER_EVENTS_MIGRATIONS, EVENTS_HOT_QUERIES
+)
+from data_version import read_data_version
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, METRICS_ENABLED
+from metrics import registry as metrics_registry, observe_request, upload_size
+from profiling import (
+    PROFILE_FORMAT_HEADER, PROFILE_HEADER, ProfileStore, ProfilingError, RequestProfiler
+)
+from stats import read_dashboard_stats, reconcile as reconcile_stats, start_reconcile_job
+from pagination import (
+    PaginationError, build_event_listing, fetch_page, parse_limit,
+    stream_json_rows, stream_ndjson_rows
+)
+from quiz_cache import QuizCache, quiz_cache_key, normalize_context
+from model_registry import ModelRegistry
+from llm import LLMClient, LLMError
+from llm_stream import JSONStreamScanner, sse_event
+from jobs import JobQueue, QueueFull, FINISHED as JOB_FINISHED
+from singleflight import SingleFlight
+from quiz_pool import QuizPool
+from passwords import PasswordHasher
+from user_cache import UserCache
+from outbox import Outbox
+from participation import (
+    EventFull, EventNotFound, event_availability, join_event, leave_event, promote_waitlist
+)
+from search import SearchError, search_events
+from geo import DEFAULT_RADIUS_KM, GeoError, has_coordinates, nearby_events, resolve_location
+from bulk import MAX_IMPORT_BYTES, BulkImportError, bulk_format, export_events, import_events, read_records
+from speech import (
+    MAX_AUDIO_BYTES, SAMPLE_RATE, SAMPLE_WIDTH, SEGMENT_SECONDS, SpeechError, SpeechUnavailable,
+    Transcriber, TranscriptSessions, is_pcm, pcm_rate
+)
+from uploads import (
+    MAX_UPLOAD_BYTES, UPLOAD_ACCEL_PREFIX, UPLOAD_MAX_AGE, UPLOAD_SENDFILE,
+    DerivativeWorker, UploadError, UploadTooLarge,
+    derivative_urls, resolve_upload, store_upload, upload_etag
+)
 
 app = Flask(__name__)
 CORS(app) 
@@ -27,118 +68,139 @@ UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Body size cap for JSON and form routes; endpoints that take files or bulk
+# data get their own in BODY_LIMITS
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_REQUEST_BYTES', 2 * 1024 * 1024))
+app.config['USE_X_SENDFILE'] = UPLOAD_SENDFILE == 'x-sendfile'
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Resized thumb/card/full copies of uploaded images, built off the request path
+image_derivatives = DerivativeWorker(UPLOAD_FOLDER)
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# LM Studio API configuration
-LM_STUDIO_BASE_URL = "http://127.0.0.1:1234"
-CHAT_ENDPOINT = f"{LM_STUDIO_BASE_URL}/v1/chat/completions"
-MODELS_ENDPOINT = f"{LM_STUDIO_BASE_URL}/v1/models"
+# Per-route latency and status counts for GET /metrics. Labelled by the URL
+# rule rather than the path, so /api/user/1 and /api/user/2 share a series.
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    if not METRICS_ENABLED or 'request_started' not in g:
+        return response
+    started = g.request_started
+    method = request.method
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    status = response.status_code
+    # Streamed bodies are still being generated here; stop the clock once sent
+    response.call_on_close(lambda: observe_request(method, route, status, time.perf_counter() - started))
+    return response
+
+# On-demand profiling: requests with the X-Profile token, or a sampled share of
+# chosen routes, run under a profiler; see /api/admin/profiling
+request_profiler = RequestProfiler(ProfileStore())
+
+@app.before_request
+def start_request_profile():
+    rule = request.url_rule.rule if request.url_rule else 'unmatched'
+    fmt = request_profiler.choose(
+        rule, request.path, request.headers.get(PROFILE_HEADER), request.headers.get(PROFILE_FORMAT_HEADER)
+    )
+    if fmt:
+        g.profile = request_profiler.start(request.method, rule, fmt)
+
+@app.after_request
+def finish_request_profile(response):
+    session = g.pop('profile', None)
+    if session is not None:
+        response.headers['X-Profile-Name'] = session.name
+        # Like the metrics clock, keep profiling until a streamed body is sent
+        response.call_on_close(lambda: request_profiler.finish(session))
+    return response
+
+@app.teardown_request
+def abandon_request_profile(exc):
+    # Only still set if after_request never ran for this request
+    session = g.pop('profile', None)
+    if session is not None:
+        request_profiler.finish(session)
+
+# endpoint -> (max body bytes, what the 413 message calls it). The upload cap
+# leaves room for the multipart envelope around the file itself.
+BODY_LIMITS = {
+    'upload_file': (MAX_UPLOAD_BYTES + 64 * 1024, 'File'),
+    'import_events_admin': (MAX_IMPORT_BYTES, 'Import'),
+    'transcribe_audio': (MAX_AUDIO_BYTES, 'Audio'),
+    'append_transcript_chunk': (MAX_AUDIO_BYTES, 'Audio'),
+}
+SPEECH_ENDPOINTS = ('transcribe_audio', 'append_transcript_chunk')
+
+@app.before_request
+def apply_body_limit():
+    # Registered after the timer and profiler so rejected requests are still measured
+    limit = BODY_LIMITS.get(request.endpoint)
+    if limit:
+        request.max_content_length = limit[0]
+    # Refuse a declared oversize body before the view's own error handling sees it
+    if request.content_length is not None and request.content_length > request.max_content_length:
+        abort(413)
+
+# LM Studio API client, see llm.py for endpoints and timeouts
+llm_client = LLMClient()
+model_registry = ModelRegistry(llm_client.list_models)
+
+quiz_cache = QuizCache(users_pool)
+
+# Identical generations already in flight are shared instead of re-run
+quiz_flight = SingleFlight()
+event_flight = SingleFlight()
 
 def generate_event_template(prompt):
-    payload = {
-        "model": "your-model-id",  # Replace with your LM Studio model ID
-        "messages": [
+    return llm_client.chat(
+        'event_template',
+        [
             {"role": "system", "content": "You are an event organizer assistant that creates templates for community cleanup events."},
             {"role": "user", "content": f"Create a detailed event template for this cleanup drive prompt: {prompt}"}
         ],
-        "temperature": 0.5,
-        "max_tokens": 600
-    }
-
-    response = requests.post(CHAT_ENDPOINT, json=payload)
-    if response.status_code == 200:
-        result = response.json()
-        return result['choices'][0]['message']['content']
-    else:
-        raise Exception(f"LM Studio error: {response.status_code}")
+        model=model_registry.default_model_id(),
+        temperature=0.5,
+        max_tokens=600
+    )
 
 def init_db():
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            phone TEXT NOT NULL,
-            password_hash TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Password reset tokens table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS password_reset_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            token TEXT NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            used BOOLEAN DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Events table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_id TEXT UNIQUE NOT NULL,
-            title TEXT NOT NULL,
-            description TEXT,
-            date TEXT NOT NULL,
-            place TEXT NOT NULL,
-            image TEXT,
-            admin_id INTEGER NOT NULL,
-            max_participants INTEGER DEFAULT 50,
-            current_participants INTEGER DEFAULT 0,
-            waste_collected REAL DEFAULT 0.0,
-            status TEXT DEFAULT 'upcoming',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (admin_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Event participants table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS event_participants (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            event_id TEXT NOT NULL,
-            user_id INTEGER NOT NULL,
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (event_id) REFERENCES events (event_id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    run_migrations(users_pool, migrations_for(users_pool, USERS_MIGRATIONS, SERVER_USERS_MIGRATIONS))
+    run_migrations(events_pool, migrations_for(events_pool, EVENTS_MIGRATIONS, SERVER_EVENTS_MIGRATIONS))
+    check_query_plans(users_pool)
+    check_query_plans(events_pool, EVENTS_HOT_QUERIES)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def get_db_connection():
-    conn = sqlite3.connect('users.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    return users_pool.connection()
+
+# Profile reads go through this; anything that writes users must invalidate it
+user_cache = UserCache(users_pool)
+
+def get_events_db_connection():
+    return events_pool.connection()
+
+def event_to_dict(row):
+    # Point image at the card-sized derivative and expose the other sizes
+    event = dict(row)
+    variants = derivative_urls(event.get('image'))
+    if variants:
+        event['image_variants'] = {**variants, 'original': event['image']}
+        event['image'] = variants['card']
+    return event
 
 # LLM Integration
-def generate_event_with_llm(prompt):
-    try:
-        headers = {
-            'Content-Type': 'application/json',
-        }
-        
-        system_prompt = """You are an AI assistant that creates beach cleanup event templates. 
+EVENT_SYSTEM_PROMPT = """You are an AI assistant that creates beach cleanup event templates. 
         Based on the user's prompt, create a JSON response with the following structure:
         {
             "title": "Event title",
@@ -149,52 +211,104 @@ def generate_event_with_llm(prompt):
         }
         
         Make the events engaging, environmental-focused, and include details about what participants should bring, meeting points, and expected outcomes."""
+
+EVENT_FIELDS = {'title': str, 'description': str, 'place': str, 'date': str, 'max_participants': int}
+
+def event_messages(prompt):
+    return [
+        {"role": "system", "content": EVENT_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+def fallback_event(content):
+    return {
+        "title": "Beach Cleanup Event",
+        "description": content,
+        "place": "Local Beach",
+        "date": (datetime.datetime.now() + datetime.timedelta(days=7)).strftime("%Y-%m-%d"),
+        "max_participants": 50
+    }
+
+def generate_event_with_llm(prompt):
+    return event_flight.do(normalize_context(prompt), lambda: _generate_event(prompt))
+
+def _generate_event(prompt):
+    try:
+        content = llm_client.chat(
+            'event',
+            event_messages(prompt),
+            model=model_registry.default_model_id(),
+            temperature=0.7,
+            max_tokens=500
+        )
         
-        data = {
-            "model": "local-model",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,
-            "max_tokens": 500
-        }
-        
-        response = requests.post(CHAT_ENDPOINT, headers=headers, json=data, timeout=30)
-        
-        if response.status_code == 200:
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            
-            # Try to extract JSON from the response
-            try:
-                # Find JSON in the response
-                start_idx = content.find('{')
-                end_idx = content.rfind('}') + 1
-                json_str = content[start_idx:end_idx]
-                event_data = json.loads(json_str)
-                return event_data
-            except:
-                # Fallback if JSON parsing fails
-                return {
-                    "title": "Beach Cleanup Event",
-                    "description": content,
-                    "place": "Local Beach",
-                    "date": (datetime.datetime.now() + datetime.timedelta(days=7)).strftime("%Y-%m-%d"),
-                    "max_participants": 50
-                }
-        else:
-            return None
+        # Try to extract JSON from the response
+        try:
+            # Find JSON in the response
+            start_idx = content.find('{')
+            end_idx = content.rfind('}') + 1
+            json_str = content[start_idx:end_idx]
+            event_data = json.loads(json_str)
+            return event_data
+        except:
+            # Fallback if JSON parsing fails
+            return fallback_event(content)
     except Exception as e:
-        print(f"LLM Error: {e}")
+        logger.error(f"LLM event generation failed: {e}")
         return None
 
+def stream_event_generation(prompt, admin_id):
+    # Emits each event field as soon as the model has finished writing it
+    event_data = {}
+    content = ''
+    try:
+        scanner = JSONStreamScanner()
+        for delta in llm_client.chat_stream(
+            'event',
+            event_messages(prompt),
+            model=model_registry.default_model_id(),
+            temperature=0.7,
+            max_tokens=500
+        ):
+            content += delta
+            for name, value in scanner.feed_object_members(delta):
+                if name in EVENT_FIELDS and isinstance(value, EVENT_FIELDS[name]):
+                    event_data[name] = value
+                    yield sse_event('field', {'name': name, 'value': value})
+        
+        if not event_data:
+            event_data = fallback_event(content)
+            for name, value in event_data.items():
+                yield sse_event('field', {'name': name, 'value': value})
+    except Exception as e:
+        logger.error(f"Error streaming event generation: {e}")
+        if not event_data:
+            yield sse_event('error', {'message': 'Failed to generate event'})
+            return
+    
+    event_data['event_id'] = str(uuid.uuid4())
+    event_data['admin_id'] = admin_id
+    yield sse_event('done', {'event': event_data})
+
+def wants_event_stream():
+    return request.args.get('stream') == 'true' or 'text/event-stream' in request.headers.get('Accept', '')
+
+def event_stream_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # Helper functions
+# KDF work runs in a process pool so it doesn't hold the GIL for other requests
+password_hasher = PasswordHasher()
+
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    return password_hasher.hash(password)
 
 def verify_password(password, hash):
-    return hash_password(password) == hash
+    return password_hasher.verify(password, hash)
 
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -206,21 +320,12 @@ def validate_phone(phone):
     # Check if it's a valid Indian phone number (10 digits)
     return len(clean_phone) == 10 or (len(clean_phone) == 12 and clean_phone.startswith('91'))
 
-def send_reset_email(email, token):
-    # Configure your email settings here
-    SMTP_SERVER = "smtp.gmail.com"  # Change to your SMTP server
-    SMTP_PORT = 587
-    EMAIL_ADDRESS = "your-email@gmail.com"  # Change to your email
-    EMAIL_PASSWORD = "your-app-password"    # Change to your app password
-    
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_ADDRESS
-        msg['To'] = email
-        msg['Subject'] = "Password Reset Request"
-        
-        reset_link = f"http://localhost:3000/reset-password?token={token}"
-        body = f"""
+# Mail is written to the email_outbox table and sent by a background thread
+outbox = Outbox(users_pool)
+
+def send_reset_email(email, token, conn=None):
+    reset_link = f"http://localhost:3000/reset-password?token={token}"
+    body = f"""
         Hi,
         
         You have requested to reset your password. Click the link below to reset your password:
@@ -234,85 +339,119 @@ def send_reset_email(email, token):
         Best regards,
         Your App Team
         """
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_ADDRESS, EMAIL_PASSWORD)
-        text = msg.as_string()
-        server.sendmail(EMAIL_ADDRESS, email, text)
-        server.quit()
-        
-        return True
-    except Exception as e:
-        print(f"Email sending failed: {e}")
-        return False
+    return outbox.enqueue(email, "Password Reset Request", body, conn=conn)
+
+
+def data_version_etag(pool, scope):
+    # Read before the data: a write landing in between can only leave the tag
+    # older than the body (one extra refetch), never newer
+    with pool.connection() as conn:
+        version = read_data_version(conn)
+    # Cursor, limit, filters and format each give a different body, so they
+    # are part of the tag; sorted so reordered query strings still match
+    args = sorted(request.args.items(multi=True))
+    if not args:
+        return f'{scope}-{version}'
+    digest = hashlib.sha256(urlencode(args).encode()).hexdigest()[:16]
+    return f'{scope}-{version}-{digest}'
+
+def not_modified(etag):
+    if etag not in request.if_none_match:
+        return None
+    return with_etag(Response(status=304), etag)
 
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # Clients keep the body but must revalidate it on every use
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 # Admin Routes
 @app.route('/api/admin/dashboard', methods=['GET'])
 def admin_dashboard():
     try:
-        conn = get_db_connection()
-        
-        # Total events
-        total_events = conn.execute('SELECT COUNT(*) as count FROM events').fetchone()['count']
-        
-        # Total participants
-        total_participants = conn.execute('SELECT COUNT(*) as count FROM event_participants').fetchone()['count']
-        
-        # Total waste collected
-        total_waste = conn.execute('SELECT SUM(waste_collected) as total FROM events').fetchone()['total'] or 0
-        
-        # Upcoming events
-        upcoming_events = conn.execute(
-            'SELECT COUNT(*) as count FROM events WHERE date >= date("now")'
-        ).fetchone()['count']
-        
-        # Recent events
-        recent_events = conn.execute('''
-            SELECT e.*, u.name as admin_name 
-            FROM events e 
-            JOIN users u ON e.admin_id = u.id 
-            ORDER BY e.created_at DESC 
-            LIMIT 5
-        ''').fetchall()
-        
-        conn.close()
-        
-        return jsonify({
+        # Upcoming counts move with the calendar as well as with writes
+        etag = data_version_etag(users_pool, f'dashboard-{datetime.date.today().isoformat()}')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        with get_db_connection() as conn:
+            # Totals are maintained by triggers, see stats.py
+            stats = read_dashboard_stats(conn)
+            
+            # Recent events
+            recent_events = conn.execute('''
+                SELECT e.*, u.name as admin_name 
+                FROM events e 
+                JOIN users u ON e.admin_id = u.id 
+                ORDER BY e.created_at DESC 
+                LIMIT 5
+            ''').fetchall()
+        
+        return with_etag(jsonify({
             'status': 'success',
             'data': {
-                'total_events': total_events,
-                'total_participants': total_participants,
-                'total_waste_collected': round(total_waste, 2),
-                'upcoming_events': upcoming_events,
-                'recent_events': [dict(row) for row in recent_events]
+                **stats,
+                'recent_events': [event_to_dict(row) for row in recent_events]
             }
-        })
+        }), etag)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
-@app.route('/api/admin/events', methods=['GET'])
-def get_all_events():
+@app.route('/api/admin/dashboard/reconcile', methods=['POST'])
+def reconcile_dashboard():
     try:
-        conn = get_db_connection()
-        events = conn.execute('''
-            SELECT e.*, u.name as admin_name 
-            FROM events e 
-            JOIN users u ON e.admin_id = u.id 
-            ORDER BY e.created_at DESC
-        ''').fetchall()
-        conn.close()
+        fix = request.args.get('fix', 'true').lower() != 'false'
+        with get_db_connection() as conn:
+            drift = reconcile_stats(conn, fix=fix)
         
         return jsonify({
             'status': 'success',
-            'events': [dict(row) for row in events]
+            'drift': drift,
+            'fixed': fix and bool(drift)
         })
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+ADMIN_EVENTS_SELECT = '''
+    SELECT e.*, u.name as admin_name 
+    FROM events e 
+    JOIN users u ON e.admin_id = u.id
+'''
+
+def paginated_events_response(pool, sql, params, id_column, envelope):
+    # ?limit=/?cursor= returns one keyset page, otherwise the full listing is streamed
+    if 'limit' in request.args or 'cursor' in request.args:
+        limit = parse_limit(request.args.get('limit'))
+        with pool.connection() as conn:
+            rows, next_cursor = fetch_page(conn, sql, params, limit, id_column)
+        return jsonify({**envelope, 'events': [event_to_dict(row) for row in rows], 'next_cursor': next_cursor})
+    
+    if request.args.get('format') == 'ndjson':
+        return Response(
+            stream_with_context(stream_ndjson_rows(pool, sql, params, event_to_dict)),
+            mimetype='application/x-ndjson'
+        )
+    return Response(
+        stream_with_context(stream_json_rows(pool, sql, params, 'events', envelope, event_to_dict)),
+        mimetype='application/json'
+    )
+
+@app.route('/api/admin/events', methods=['GET'])
+def get_all_events():
+    try:
+        sql, params = build_event_listing(ADMIN_EVENTS_SELECT, 'e', 'id', request.args)
+        etag = data_version_etag(users_pool, 'events')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        return with_etag(paginated_events_response(users_pool, sql, params, 'id', {'status': 'success'}), etag)
+    except PaginationError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/api/admin/events/generate', methods=['POST'])
 def generate_event_admin():
     try:
@@ -323,6 +462,9 @@ def generate_event_admin():
         if not prompt:
             return jsonify({'status': 'error', 'message': 'Prompt is required'}), 400
         
+        if wants_event_stream():
+            return event_stream_response(stream_event_generation(prompt, admin_id))
+        
         # Generate event using LLM
         event_data = generate_event_with_llm(prompt)
         
@@ -347,72 +489,126 @@ def create_event_admin():
         
         # Generate unique event ID
         event_id = str(uuid.uuid4())
-        
-        conn = get_db_connection()
-        conn.execute('''
-            INSERT INTO events (event_id, title, description, date, place, admin_id, max_participants)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            event_id,
-            data['title'],
-            data.get('description', ''),
-            data['date'],
-            data['place'],
-            data.get('admin_id', 1),
-            data.get('max_participants', 50)
-        ))
-        conn.commit()
-        conn.close()
+        latitude, longitude = resolve_location(data)
+        
+        with get_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO events (event_id, title, description, date, place, image, admin_id, max_participants,
+                                    latitude, longitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                event_id,
+                data['title'],
+                data.get('description', ''),
+                data['date'],
+                data['place'],
+                data.get('image'),
+                data.get('admin_id', 1),
+                data.get('max_participants', 50),
+                latitude,
+                longitude
+            ))
+            conn.commit()
         
         return jsonify({
             'status': 'success',
             'message': 'Event created successfully',
-            'event_id': event_id
+            'event_id': event_id,
+            'located': latitude is not None
         })
+    except GeoError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/admin/events/import', methods=['POST'])
+def import_events_admin():
+    # Body is CSV or NDJSON (?format= or Content-Type), one event per row
+    try:
+        fmt = bulk_format(request.content_type, request.args.get('format'))
+        result = import_events(
+            users_pool,
+            read_records(request.stream, fmt),
+            atomic=request.args.get('atomic') == 'true',
+            dry_run=request.args.get('dry_run') == 'true'
+        )
+        status = 'success' if not result['failed'] else 'partial' if result['imported'] else 'error'
+        return jsonify({'status': status, **result}), 200 if result['imported'] or not result['failed'] else 400
+    except (ValueError, BulkImportError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/admin/events/export', methods=['GET'])
+def export_events_admin():
+    try:
+        fmt = bulk_format(None, request.args.get('format', 'ndjson'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(export_events(users_pool, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=events.{fmt}'}
+    )
+
 @app.route('/api/admin/events/<event_id>', methods=['PUT'])
 def update_event(event_id):
     try:
         data = request.get_json()
-        
-        conn = get_db_connection()
-        conn.execute('''
-            UPDATE events 
-            SET title = ?, description = ?, date = ?, place = ?, max_participants = ?
-            WHERE event_id = ?
-        ''', (
-            data['title'],
-            data.get('description', ''),
-            data['date'],
-            data['place'],
-            data.get('max_participants', 50),
-            event_id
-        ))
-        conn.commit()
-        conn.close()
+        latitude, longitude = resolve_location(data)
+        # Stored coordinates stay unless new ones are sent or the place changes
+        # (place on the right-hand side is the value before this update)
+        relocate = 'CASE WHEN ? = 1 OR place <> ? THEN ? ELSE {0} END'
+        
+        # One transaction, so a raised max_participants goes to the waitlist
+        # before any new join can take the seats
+        with users_pool.transaction() as conn:
+            conn.execute(f'''
+                UPDATE events 
+                SET latitude = {relocate.format('latitude')}, longitude = {relocate.format('longitude')},
+                    title = ?, description = ?, date = ?, place = ?, max_participants = ?,
+                    image = COALESCE(?, image)
+                WHERE event_id = ?
+            ''', (
+                int(has_coordinates(data)), data['place'], latitude,
+                int(has_coordinates(data)), data['place'], longitude,
+                data['title'],
+                data.get('description', ''),
+                data['date'],
+                data['place'],
+                data.get('max_participants', 50),
+                data.get('image'),
+                event_id
+            ))
+            located = conn.execute('SELECT latitude FROM events WHERE event_id = ?', (event_id,)).fetchone()
+            promoted = promote_waitlist(conn, event_id)
         
         return jsonify({
             'status': 'success',
-            'message': 'Event updated successfully'
+            'message': 'Event updated successfully',
+            'located': bool(located) and located['latitude'] is not None,
+            'promoted_user_ids': promoted
         })
+    except GeoError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/admin/events/<event_id>', methods=['DELETE'])
 def delete_event(event_id):
     try:
-        conn = get_db_connection()
-        
-        # Delete event participants first
-        conn.execute('DELETE FROM event_participants WHERE event_id = ?', (event_id,))
-        
-        # Delete event
-        conn.execute('DELETE FROM events WHERE event_id = ?', (event_id,))
-        
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            # Delete event participants first
+            conn.execute('DELETE FROM event_participants WHERE event_id = ?', (event_id,))
+            conn.execute('DELETE FROM event_waitlist WHERE event_id = ?', (event_id,))
+            
+            # Delete event
+            conn.execute('DELETE FROM events WHERE event_id = ?', (event_id,))
+            
+            conn.commit()
         
         return jsonify({
             'status': 'success',
@@ -421,6 +617,111 @@ def delete_event(event_id):
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# Volunteer sign-ups; seats are claimed atomically, see participation.py
+@app.route('/api/events/search', methods=['GET'])
+def search_events_route():
+    # ?q=beach clean&status=upcoming&limit=20&offset=0&prefix=false
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        try:
+            offset = int(request.args.get('offset', 0))
+        except ValueError:
+            return jsonify({'error': 'offset must be an integer'}), 400
+        
+        etag = data_version_etag(users_pool, 'search')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        results, next_offset = search_events(
+            users_pool,
+            request.args.get('q', ''),
+            status=request.args.get('status'),
+            limit=limit,
+            offset=offset,
+            prefix=request.args.get('prefix', 'true').lower() != 'false'
+        )
+        return with_etag(jsonify({
+            'results': [{**result, 'event': event_to_dict(result['event'])} for result in results],
+            'next_offset': next_offset
+        }), etag)
+    except (SearchError, PaginationError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events/nearby', methods=['GET'])
+def nearby_events_route():
+    # ?lat=19.07&lon=72.87&radius_km=25&limit=50&status=upcoming
+    try:
+        if request.args.get('lat') is None or request.args.get('lon') is None:
+            return jsonify({'error': 'lat and lon are required'}), 400
+        limit = parse_limit(request.args.get('limit'))
+        
+        etag = data_version_etag(users_pool, 'nearby')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        
+        events, total = nearby_events(
+            users_pool,
+            request.args['lat'],
+            request.args['lon'],
+            radius_km=request.args.get('radius_km', DEFAULT_RADIUS_KM),
+            limit=limit,
+            status=request.args.get('status')
+        )
+        return with_etag(jsonify({'events': [event_to_dict(event) for event in events], 'total': total}), etag)
+    except (GeoError, PaginationError) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def signup_user():
+    data = request.get_json(silent=True) or {}
+    if not data.get('user_id'):
+        return None, data
+    return user_cache.by_id(data['user_id']), data
+
+@app.route('/api/events/<event_id>/join', methods=['POST'])
+def join_event_route(event_id):
+    try:
+        user, data = signup_user()
+        if not user or not user['is_active']:
+            return jsonify({'error': 'A valid user_id is required'}), 400
+        
+        result = join_event(users_pool, event_id, user['id'], waitlist=bool(data.get('waitlist')))
+        return jsonify(result), 201 if result['status'] == 'joined' else 200
+    except EventNotFound:
+        return jsonify({'error': 'Event not found'}), 404
+    except EventFull as e:
+        return jsonify({'error': str(e), **event_availability(users_pool, event_id)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events/<event_id>/leave', methods=['POST'])
+def leave_event_route(event_id):
+    try:
+        user, _ = signup_user()
+        if not user:
+            return jsonify({'error': 'A valid user_id is required'}), 400
+        
+        result = leave_event(users_pool, event_id, user['id'])
+        return jsonify(result), 404 if result['status'] == 'not_joined' else 200
+    except EventNotFound:
+        return jsonify({'error': 'Event not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events/<event_id>/availability', methods=['GET'])
+def event_availability_route(event_id):
+    try:
+        return jsonify(event_availability(users_pool, event_id))
+    except EventNotFound:
+        return jsonify({'error': 'Event not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     try:
@@ -432,24 +733,69 @@ def upload_file():
             return jsonify({'status': 'error', 'message': 'No file selected'}), 400
         
         if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            # Add timestamp to avoid conflicts
-            filename = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{filename}"
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            # Stored under its content hash, so re-uploading the same image is free
+            ext = secure_filename(file.filename).rsplit('.', 1)[1].lower()
+            filename, digest, deduplicated = store_upload(file.stream, app.config['UPLOAD_FOLDER'], ext)
+            upload_size.observe(os.path.getsize(os.path.join(app.config['UPLOAD_FOLDER'], filename)), ext)
+            image_derivatives.submit(filename)
+            url = f'/uploads/{filename}'
             
             return jsonify({
                 'status': 'success',
                 'filename': filename,
-                'url': f'/uploads/{filename}'
+                'url': url,
+                'hash': digest,
+                'deduplicated': deduplicated,
+                'derivatives': derivative_urls(url) if image_derivatives.enabled else {}
             })
         else:
             return jsonify({'status': 'error', 'message': 'Invalid file type'}), 400
+    except UploadTooLarge as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 413
+    except RequestEntityTooLarge as e:
+        return request_too_large(e)
+    except UploadError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.errorhandler(413)
+def request_too_large(e):
+    limit, what = BODY_LIMITS.get(request.endpoint, (app.config['MAX_CONTENT_LENGTH'], 'Request body'))
+    message = f'{what} exceeds the {limit // (1024 * 1024)} MB limit'
+    if request.endpoint in SPEECH_ENDPOINTS:
+        return jsonify({"success": False, "error": message}), 413
+    return jsonify({'status': 'error', 'message': message}), 413
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    folder = app.config['UPLOAD_FOLDER']
+    served = resolve_upload(folder, filename)
+    path = safe_join(folder, served)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    etag = upload_etag(path, served)
+    
+    if UPLOAD_SENDFILE == 'x-accel-redirect':
+        # nginx serves the bytes (and ranges) from its internal location
+        response = Response(mimetype=mimetypes.guess_type(served)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = UPLOAD_ACCEL_PREFIX + served
+        response.set_etag(etag)
+        response.make_conditional(request)
+    else:
+        # Handles If-None-Match/If-Modified-Since (304) and Range (206)
+        response = send_from_directory(folder, served, etag=etag, max_age=UPLOAD_MAX_AGE, conditional=True)
+    
+    if served == filename:
+        response.headers['Cache-Control'] = f'public, max-age={UPLOAD_MAX_AGE}, immutable'
+    else:
+        # Original standing in for a derivative that is still being generated
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/admin/uploads/stats', methods=['GET'])
+def upload_stats():
+    return jsonify({'status': 'success', 'derivatives': image_derivatives.stats()})
 
 # Routes
 @app.route('/generate-event-template', methods=['POST'])
@@ -475,14 +821,12 @@ def create_event():
         image = data.get('image', '')
         template = data['template']
 
-        conn = sqlite3.connect('events.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO events (admin_id, date, place, image, template)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (admin_id, date, place, image, template))
-        conn.commit()
-        conn.close()
+        with get_events_db_connection() as conn:
+            conn.execute('''
+                INSERT INTO events (admin_id, date, place, image, template)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (admin_id, date, place, image, template))
+            conn.commit()
 
         return jsonify({"success": True, "message": "Event created successfully"})
     except Exception as e:
@@ -491,41 +835,177 @@ def create_event():
 @app.route('/get-events', methods=['GET'])
 def get_events():
     try:
-        conn = sqlite3.connect('events.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM events")
-        rows = cursor.fetchall()
-        conn.close()
+        sql, params = build_event_listing(
+            'SELECT * FROM events e', 'e', 'event_id', request.args, statuses=False
+        )
+        etag = data_version_etag(events_pool, 'events')
+        cached = not_modified(etag)
+        if cached:
+            return cached
+        return with_etag(paginated_events_response(events_pool, sql, params, 'event_id', {'success': True}), etag)
+    except PaginationError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        events = [
-            {
-                "event_id": row[0],
-                "admin_id": row[1],
-                "date": row[2],
-                "place": row[3],
-                "image": row[4],
-                "template": row[5],
-                "created_at": row[6],
-            }
-            for row in rows
-        ]
+# Browser-recorded audio decoded offline; workers load the model once
+transcriber = Transcriber()
+transcript_sessions = TranscriptSessions(transcriber)
+
+def request_audio():
+    # Either a multipart 'audio' field or the raw request body
+    if 'audio' in request.files:
+        audio = request.files['audio']
+        return audio.read(), audio.mimetype
+    data = request.get_data()
+    if request.content_length is None:
+        # A chunked body is cut off at the size cap, not refused; the next read raises
+        request.stream.read(1)
+    return data, request.content_type or ''
+
+def speech_error_response(e):
+    if isinstance(e, RequestEntityTooLarge):
+        return request_too_large(e)
+    if isinstance(e, SpeechUnavailable):
+        return jsonify({"success": False, "error": str(e)}), 503
+    if isinstance(e, SpeechError):
+        return jsonify({"success": False, "error": str(e)}), 400
+    return jsonify({"success": False, "error": str(e)}), 500
+
+def stream_transcription(stream, content_type):
+    # Decode a chunked PCM body window by window, emitting the transcript so far
+    window = SEGMENT_SECONDS * pcm_rate(content_type) * SAMPLE_WIDTH
+    segments = []
+    latency_ms = 0.0
+    buffer = b''
+    try:
+        while True:
+            chunk = stream.read(window - len(buffer))
+            buffer += chunk
+            if len(buffer) < window and chunk:
+                continue
+            if buffer:
+                result = transcriber.transcribe(buffer, content_type)
+                latency_ms += result['latency_ms']
+                if result['text']:
+                    segments.append(result['text'])
+                yield sse_event('partial', {**result, 'partial': ' '.join(segments)})
+                buffer = b''
+            if not chunk:
+                break
+        yield sse_event('done', {'text': ' '.join(segments), 'latency_ms': round(latency_ms, 1)})
+    except Exception as e:
+        yield sse_event('error', {'error': str(e)})
+
+@app.route('/speech-to-text', methods=['POST'])
+def transcribe_audio():
+    try:
+        if wants_event_stream():
+            content_type = request.content_type or ''
+            if not is_pcm(content_type):
+                return jsonify({"success": False, "error": f"Streaming needs audio/L16;rate={SAMPLE_RATE} PCM"}), 415
+            return event_stream_response(stream_transcription(request.stream, content_type))
+        
+        data, content_type = request_audio()
+        return jsonify({"success": True, **transcriber.transcribe(data, content_type)})
+    except Exception as e:
+        return speech_error_response(e)
 
-        return jsonify({"success": True, "events": events})
+@app.route('/speech-to-text/sessions', methods=['POST'])
+def create_transcript_session():
+    if not transcriber.available:
+        return speech_error_response(SpeechUnavailable('Offline speech model is not installed'))
+    return jsonify({"success": True, "session_id": transcript_sessions.create()})
+
+@app.route('/speech-to-text/sessions/<session_id>/chunks', methods=['POST'])
+def append_transcript_chunk(session_id):
+    try:
+        data, content_type = request_audio()
+        return jsonify({"success": True, **transcript_sessions.append(session_id, data, content_type)})
+    except KeyError:
+        return jsonify({"success": False, "error": "Unknown or expired session"}), 404
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 500
+        return speech_error_response(e)
 
-@app.route('/speech-to-text', methods=['GET'])
-def speech_to_text():
+@app.route('/speech-to-text/sessions/<session_id>/finish', methods=['POST'])
+def finish_transcript_session(session_id):
     try:
-        recognizer = sr.Recognizer()
-        with sr.Microphone() as source:
-            print("Listening...")
-            audio = recognizer.listen(source, timeout=5)
+        return jsonify({"success": True, **transcript_sessions.finish(session_id)})
+    except KeyError:
+        return jsonify({"success": False, "error": "Unknown or expired session"}), 404
+
+@app.route('/api/admin/speech/stats', methods=['GET'])
+def speech_stats():
+    return jsonify({'status': 'success', 'speech': transcriber.stats()})
 
-        text = recognizer.recognize_google(audio)
-        return jsonify({"success": True, "text": text})
+@app.route('/api/admin/email-outbox', methods=['GET'])
+def email_outbox_stats():
+    try:
+        return jsonify({'status': 'success', 'outbox': outbox.stats()})
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)})
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/admin/password-hashing', methods=['GET'])
+def password_hashing_stats():
+    return jsonify({'status': 'success', 'hashing': password_hasher.stats()})
+
+@app.route('/api/admin/db/pool', methods=['GET'])
+def db_pool_stats():
+    return jsonify({'status': 'success', 'pools': pool_stats()})
+
+@app.route('/api/admin/profiling', methods=['GET'])
+def profiling_status():
+    return jsonify({'status': 'success', 'profiling': request_profiler.stats()})
+
+@app.route('/api/admin/profiling', methods=['PUT'])
+def configure_profiling():
+    data = request.get_json(silent=True) or {}
+    try:
+        request_profiler.configure(
+            sample_rate=data.get('sample_rate'),
+            routes=data.get('routes'),
+            remaining=data.get('remaining'),
+            fmt=data.get('format'),
+        )
+    except ProfilingError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'profiling': request_profiler.stats()})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def list_profiles():
+    return jsonify({'status': 'success', 'profiles': request_profiler.store.list()})
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    path = request_profiler.store.resolve(name)
+    if path is None:
+        return jsonify({'status': 'error', 'message': 'Profile not found'}), 404
+    return send_from_directory(os.path.abspath(os.path.dirname(path)), name, as_attachment=True)
+
+@metrics_registry.collector
+def pool_and_queue_metrics():
+    pools = [(pool.name, pool.stats()) for pool in (users_pool, events_pool)]
+    jobs = job_queue.stats()
+    return [
+        ('db_pool_connections', 'gauge', 'Pooled connections by state.', [
+            ({'database': name, 'state': state}, p[state])
+            for name, p in pools for state in ('in_use', 'idle')
+        ]),
+        ('db_pool_acquired_total', 'counter', 'Connections handed out.', [
+            ({'database': name}, p['acquired']) for name, p in pools
+        ]),
+        ('db_pool_timeouts_total', 'counter', 'Acquires that timed out.', [
+            ({'database': name}, p['timeouts']) for name, p in pools
+        ]),
+        ('job_queue_depth', 'gauge', 'Generation jobs waiting for a worker.', [({}, jobs['queue_depth'])]),
+        ('job_queue_running', 'gauge', 'Generation jobs running.', [({}, jobs['running'])]),
+    ]
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if not METRICS_ENABLED:
+        abort(404)
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -558,25 +1038,25 @@ def register():
         if len(data['password']) < 6:
             return jsonify({'error': 'Password must be at least 6 characters long'}), 400
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Check if user already exists
-        cursor.execute('SELECT id FROM users WHERE email = ?', (data['email'],))
-        if cursor.fetchone():
-            conn.close()
-            return jsonify({'error': 'User with this email already exists'}), 400
-        
-        # Hash password and insert user
+        # Hashed before taking a pooled connection; scrypt can take a while under load
         password_hash = hash_password(data['password'])
-        cursor.execute('''
-            INSERT INTO users (name, email, phone, password_hash)
-            VALUES (?, ?, ?, ?)
-        ''', (data['name'], data['email'], data['phone'], password_hash))
         
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Check if user already exists
+            cursor.execute('SELECT id FROM users WHERE email = ?', (data['email'],))
+            if cursor.fetchone():
+                return jsonify({'error': 'User with this email already exists'}), 400
+            
+            cursor.execute('''
+                INSERT INTO users (name, email, phone, password_hash)
+                VALUES (?, ?, ?, ?)
+            ''', (data['name'], data['email'], data['phone'], password_hash))
+            
+            user_id = cursor.lastrowid
+            conn.commit()
+        user_cache.invalidate(user_id=user_id, email=data['email'])
         
         return jsonify({
             'message': 'User registered successfully',
@@ -600,34 +1080,39 @@ def login():
         if not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Email and password are required'}), 400
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, name, email, phone, password_hash, is_active
-            FROM users WHERE email = ?
-        ''', (data['email'],))
-        
-        user = cursor.fetchone()
-        conn.close()
+        user = user_cache.by_email(data['email'])
         
         if not user:
+            # Same scrypt cost as a wrong password, so response time doesn't reveal the email
+            password_hasher.verify_missing(data['password'])
+            return jsonify({'error': 'Invalid email or password'}), 401
+        
+        if not verify_password(data['password'], user['password_hash']):
             return jsonify({'error': 'Invalid email or password'}), 401
         
-        if not user[5]:  # is_active
+        # Only after the password checks out, or this would confirm the email exists
+        if not user['is_active']:
             return jsonify({'error': 'Account is deactivated'}), 401
         
-        if not verify_password(data['password'], user[4]):  # password_hash
-            return jsonify({'error': 'Invalid email or password'}), 401
+        # Upgrade legacy or outdated hashes now that we have the plaintext
+        if password_hasher.needs_rehash(user['password_hash']):
+            new_hash = hash_password(data['password'])
+            with get_db_connection() as conn:
+                conn.execute(
+                    'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                    (new_hash, user['id'], user['password_hash'])
+                )
+                conn.commit()
+            user_cache.invalidate(user_id=user['id'])
         
         return jsonify({
             'message': 'Login successful',
-            'user_id': user[0],
+            'user_id': user['id'],
             'user': {
-                'id': user[0],
-                'name': user[1],
-                'email': user[2],
-                'phone': user[3]
+                'id': user['id'],
+                'name': user['name'],
+                'email': user['email'],
+                'phone': user['phone']
             }
         }), 200
         
@@ -642,40 +1127,39 @@ def forgot_password():
         if not data.get('email'):
             return jsonify({'error': 'Email is required'}), 400
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute('SELECT id FROM users WHERE email = ?', (data['email'],))
-        user = cursor.fetchone()
-        
-        if not user:
-            # Don't reveal if email exists or not for security
-            return jsonify({'message': 'If the email exists, a reset link has been sent'}), 200
-        
-        # Generate reset token
-        token = secrets.token_urlsafe(32)
-        expires_at = datetime.now() + timedelta(hours=1)
-        
-        # Store token in database
-        cursor.execute('''
-            INSERT INTO password_reset_tokens (user_id, token, expires_at)
-            VALUES (?, ?, ?)
-        ''', (user[0], token, expires_at))
-        
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Check if user exists
+            cursor.execute('SELECT id FROM users WHERE email = ?', (data['email'],))
+            user = cursor.fetchone()
+            
+            if not user:
+                # Don't reveal if email exists or not for security
+                return jsonify({'message': 'If the email exists, a reset link has been sent'}), 200
+            
+            # Generate reset token
+            token = secrets.token_urlsafe(32)
+            expires_at = datetime.datetime.now() + datetime.timedelta(hours=1)
+            
+            # Store token in database
+            cursor.execute('''
+                INSERT INTO password_reset_tokens (user_id, token, expires_at)
+                VALUES (?, ?, ?)
+            ''', (user[0], token, expires_at))
+            
+            # Queued in the same transaction as the token, sent in the background
+            send_reset_email(data['email'], token, conn=conn)
+            conn.commit()
+        outbox.wake()
         
-        # Send email (uncomment when email is configured)
-        # if send_reset_email(data['email'], token):
-        #     return jsonify({'message': 'Password reset link sent to your email'}), 200
-        # else:
-        #     return jsonify({'error': 'Failed to send email'}), 500
+        if outbox.enabled:
+            return jsonify({'message': 'Password reset link sent to your email'}), 200
         
-        # For development, return the token (remove in production)
+        # No SMTP server configured (development), return the token instead
         return jsonify({
             'message': 'Password reset link sent to your email',
-            'token': token  # Remove this in production
+            'token': token
         }), 200
         
     except Exception as e:
@@ -695,32 +1179,33 @@ def reset_password():
         if len(data['password']) < 6:
             return jsonify({'error': 'Password must be at least 6 characters long'}), 400
         
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        
-        # Verify token
-        cursor.execute('''
-            SELECT user_id FROM password_reset_tokens
-            WHERE token = ? AND expires_at > ? AND used = 0
-        ''', (data['token'], datetime.now()))
-        
-        token_data = cursor.fetchone()
-        
-        if not token_data:
-            conn.close()
-            return jsonify({'error': 'Invalid or expired token'}), 400
-        
-        user_id = token_data[0]
-        
-        # Update password
+        # Hashed before taking a pooled connection; scrypt can take a while under load
         password_hash = hash_password(data['password'])
-        cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
         
-        # Mark token as used
-        cursor.execute('UPDATE password_reset_tokens SET used = 1 WHERE token = ?', (data['token'],))
-        
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Verify token
+            cursor.execute('''
+                SELECT user_id FROM password_reset_tokens
+                WHERE token = ? AND expires_at > ? AND used = 0
+            ''', (data['token'], datetime.datetime.now()))
+            
+            token_data = cursor.fetchone()
+            
+            if not token_data:
+                return jsonify({'error': 'Invalid or expired token'}), 400
+            
+            user_id = token_data[0]
+            
+            # Update password
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
+            
+            # Mark token as used
+            cursor.execute('UPDATE password_reset_tokens SET used = 1 WHERE token = ?', (data['token'],))
+            
+            conn.commit()
+        user_cache.invalidate(user_id=user_id)
         
         return jsonify({'message': 'Password reset successfully'}), 200
         
@@ -730,55 +1215,65 @@ def reset_password():
 @app.route('/api/user/<int:user_id>', methods=['GET'])
 def get_user(user_id):
     try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
+        user = user_cache.by_id(user_id)
         
-        cursor.execute('''
-            SELECT id, name, email, phone, created_at
-            FROM users WHERE id = ? AND is_active = 1
-        ''', (user_id,))
-        
-        user = cursor.fetchone()
-        conn.close()
-        
-        if not user:
+        if not user or not user['is_active']:
             return jsonify({'error': 'User not found'}), 404
         
         return jsonify({
             'user': {
-                'id': user[0],
-                'name': user[1],
-                'email': user[2],
-                'phone': user[3],
-                'created_at': user[4]
+                'id': user['id'],
+                'name': user['name'],
+                'email': user['email'],
+                'phone': user['phone'],
+                'created_at': user['created_at']
             }
         }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/users/<int:user_id>/deactivate', methods=['POST'])
+def deactivate_user(user_id):
+    try:
+        with get_db_connection() as conn:
+            updated = conn.execute('UPDATE users SET is_active = 0 WHERE id = ?', (user_id,)).rowcount
+            conn.commit()
+        user_cache.invalidate(user_id=user_id)
+        
+        if not updated:
+            return jsonify({'status': 'error', 'message': 'User not found'}), 404
+        return jsonify({'status': 'success', 'message': 'User deactivated'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/admin/user-cache', methods=['GET'])
+def user_cache_stats():
+    return jsonify({'status': 'success', 'cache': user_cache.stats()})
+
 
 def get_available_models():
-    try:
-        response = requests.get(MODELS_ENDPOINT, timeout=10)
-        if response.status_code == 200:
-            return response.json().get('data', [])
-        logger.error(f"Failed to get models: {response.status_code}")
-        return []
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error connecting to LM Studio: {e}")
-        return []
+    return model_registry.models()
 
 
 def generate_quiz_with_ai(context, num_questions=5):
     try:
-        models = get_available_models()
-        if not models:
-            raise Exception("No models available in LM Studio")
+        cached = quiz_cache.get(context, num_questions)
+        if cached:
+            logger.info(f"Quiz cache hit for: {context}")
+            return cached
+
+        return quiz_flight.do(
+            quiz_cache_key(context, num_questions),
+            lambda: _generate_and_cache_quiz(context, num_questions)
+        )
+
+    except Exception as e:
+        logger.error(f"Error in generate_quiz_with_ai: {e}")
+        return create_fallback_quiz(context)
 
-        model_id = models[0].get('id', 'local-model')
 
-        system_prompt = """You are an educational quiz generator. Create environmental quiz questions as a valid JSON array.
+QUIZ_SYSTEM_PROMPT = """You are an educational quiz generator. Create environmental quiz questions as a valid JSON array.
 
 CRITICAL: Return ONLY a JSON array, nothing else. No extra text, no markdown, no wrapper objects.
 
@@ -792,72 +1287,109 @@ Exact format required:
   }
 ]"""
 
-        user_prompt = f"Create {num_questions} quiz questions about: {context}. Focus on environmental facts, decomposition time, and recycling."
-
-        payload = {
-            "model": model_id,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            "temperature": 0.3,
-            "max_tokens": 800,
-            "stream": False
-        }
 
-        response = requests.post(
-            CHAT_ENDPOINT,
-            json=payload,
-            headers={"Content-Type": "application/json"},
-            timeout=600
-        )
+def quiz_messages(context, num_questions):
+    user_prompt = f"Create {num_questions} quiz questions about: {context}. Focus on environmental facts, decomposition time, and recycling."
+    return [
+        {"role": "system", "content": QUIZ_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ]
 
-        if response.status_code == 200:
-            result = response.json()
-            content = result['choices'][0]['message']['content'].strip()
-
-            logger.info(f"Raw AI response snippet: {content[:200]}...")
-
-            # Save raw for debugging if needed
-            with open("raw_ai_response.txt", "w", encoding="utf-8") as f:
-                f.write(content)
-
-            # Try to extract JSON array using regex
-            match = re.search(r'\[\s*{.*?}\s*]', content, re.DOTALL)
-            if not match:
-                raise ValueError("Could not extract JSON array from model response")
-
-            content = match.group(0)
-            quiz_data = json.loads(content)
-
-            if isinstance(quiz_data, list):
-                validated = []
-                for q in quiz_data:
-                    if (
-                        isinstance(q, dict)
-                        and 'question' in q
-                        and 'options' in q
-                        and 'correct' in q
-                        and 'explanation' in q
-                        and isinstance(q['options'], list)
-                        and len(q['options']) == 4
-                        and isinstance(q['correct'], int)
-                        and 0 <= q['correct'] < 4
-                    ):
-                        validated.append(q)
-
-                if validated:
-                    logger.info(f"Parsed {len(validated)} valid questions.")
-                    return validated[:num_questions]
 
-            raise ValueError("Validation failed for AI quiz data")
+def is_valid_question(q):
+    return (
+        isinstance(q, dict)
+        and 'question' in q
+        and 'options' in q
+        and 'correct' in q
+        and 'explanation' in q
+        and isinstance(q['options'], list)
+        and len(q['options']) == 4
+        and isinstance(q['correct'], int)
+        and 0 <= q['correct'] < 4
+    )
 
-        logger.error(f"LM Studio API error: {response.status_code} - {response.text}")
-        return create_fallback_quiz(context)
 
+def _generate_and_cache_quiz(context, num_questions):
+    quiz = _generate_quiz(context, num_questions)
+    quiz_cache.put(context, num_questions, quiz)
+    return quiz
+
+
+def _generate_quiz(context, num_questions):
+    # Raises on any failure so only real model output gets cached
+    if not get_available_models():
+        raise Exception("No models available in LM Studio")
+
+    content = llm_client.chat(
+        'quiz',
+        quiz_messages(context, num_questions),
+        model=model_registry.default_model_id(),
+        temperature=0.3,
+        max_tokens=800
+    ).strip()
+
+    logger.info(f"Raw AI response snippet: {content[:200]}...")
+    logger.debug(f"Raw AI response: {content}")
+
+    # Try to extract JSON array using regex
+    match = re.search(r'\[\s*{.*?}\s*]', content, re.DOTALL)
+    if not match:
+        raise ValueError("Could not extract JSON array from model response")
+
+    content = match.group(0)
+    quiz_data = json.loads(content)
+
+    if isinstance(quiz_data, list):
+        validated = [q for q in quiz_data if is_valid_question(q)]
+        if validated:
+            logger.info(f"Parsed {len(validated)} valid questions.")
+            return validated[:num_questions]
+
+    raise ValueError("Validation failed for AI quiz data")
+
+
+def replay_quiz(quiz, context, **extra):
+    for index, question in enumerate(quiz):
+        yield sse_event('question', {'index': index, 'question': question})
+    yield sse_event('done', {'quiz': quiz, 'context': context, **extra})
+
+
+def stream_quiz(context, num_questions):
+    # Emits each question as soon as it is complete and valid, then a final 'done' event
+    cached = quiz_cache.get(context, num_questions)
+    if cached:
+        yield from replay_quiz(cached, context, cached=True)
+        return
+
+    questions = []
+    try:
+        if not get_available_models():
+            raise Exception("No models available in LM Studio")
+
+        scanner = JSONStreamScanner()
+        for delta in llm_client.chat_stream(
+            'quiz',
+            quiz_messages(context, num_questions),
+            model=model_registry.default_model_id(),
+            temperature=0.3,
+            max_tokens=800
+        ):
+            for question in scanner.feed_array_items(delta):
+                if is_valid_question(question) and len(questions) < num_questions:
+                    yield sse_event('question', {'index': len(questions), 'question': question})
+                    questions.append(question)
+
+        if not questions:
+            raise ValueError("Validation failed for AI quiz data")
+        quiz_cache.put(context, num_questions, questions)
     except Exception as e:
-        logger.error(f"Error in generate_quiz_with_ai: {e}")
-        return create_fallback_quiz(context)
+        logger.error(f"Error streaming quiz: {e}")
+        if not questions:
+            yield from replay_quiz(create_fallback_quiz(context), context, cached=False)
+            return
+
+    yield sse_event('done', {'quiz': questions, 'context': context, 'cached': False})
 
 
 def create_fallback_quiz(context):
@@ -914,6 +1446,90 @@ def create_fallback_quiz(context):
     return questions[:5]
 
 
+def _event_job(prompt, admin_id=1):
+    event_data = generate_event_with_llm(prompt)
+    if not event_data:
+        raise Exception('Failed to generate event')
+    event_data['event_id'] = str(uuid.uuid4())
+    event_data['admin_id'] = admin_id
+    return event_data
+
+
+job_queue = JobQueue(users_pool, {
+    'quiz': lambda context, num_questions=5: generate_quiz_with_ai(context, num_questions),
+    'event': _event_job,
+    'event_template': generate_event_template,
+})
+
+
+def llm_is_idle():
+    jobs = job_queue.stats()
+    return llm_client.is_idle() and jobs['queue_depth'] == 0 and jobs['running'] == 0
+
+
+# Pre-generated quizzes for common topics, bypassing the cache so each one is fresh
+quiz_pool = QuizPool(_generate_quiz, llm_is_idle)
+
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    try:
+        data = request.get_json() or {}
+        kind = data.get('kind')
+        params = data.get('params') or {}
+        if kind not in job_queue.handlers:
+            return jsonify({'status': 'error', 'message': f"kind must be one of {sorted(job_queue.handlers)}"}), 400
+        
+        job_id = job_queue.submit(kind, params)
+        return jsonify({'status': 'success', 'job_id': job_id, 'url': f'/api/jobs/{job_id}'}), 202
+    except QueueFull as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        # ?wait=N long-polls for up to N seconds (capped at 60)
+        wait = min(float(request.args.get('wait', 0)), 60)
+        job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+        if not job:
+            return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+        return jsonify({'status': 'success', 'job': job})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    if not job_queue.get(job_id):
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+
+    def events():
+        last_status = None
+        while True:
+            job = job_queue.wait(job_id, 15)
+            if job is None:
+                # Pruned while the client was still listening
+                yield sse_event('error', {'message': 'Job not found'})
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield sse_event('status', job)
+            else:
+                yield ': keep-alive\n\n'
+            if job['status'] in JOB_FINISHED:
+                return
+
+    return event_stream_response(events())
+
+
+@app.route('/api/admin/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify({'status': 'success', 'jobs': job_queue.stats()})
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "healthy", "message": "Flask backend is running"})
@@ -921,7 +1537,45 @@ def health_check():
 
 @app.route('/models', methods=['GET'])
 def get_models():
-    return jsonify({"models": get_available_models()})
+    if request.args.get('refresh') == 'true':
+        model_registry.invalidate()
+        model_registry.refresh()
+    return jsonify({"models": get_available_models(), "registry": model_registry.stats()})
+
+
+@app.route('/api/admin/llm/stats', methods=['GET'])
+def llm_stats():
+    return jsonify({
+        'status': 'success',
+        'calls': llm_client.stats(),
+        'models': model_registry.stats(),
+        'coalescing': {'quiz': quiz_flight.stats(), 'event': event_flight.stats()}
+    })
+
+
+@app.route('/api/admin/quiz-pool', methods=['GET'])
+def quiz_pool_stats():
+    return jsonify({'status': 'success', 'pool': quiz_pool.stats()})
+
+
+@app.route('/api/admin/quiz-cache', methods=['GET'])
+def quiz_cache_stats():
+    return jsonify({'status': 'success', 'cache': quiz_cache.stats()})
+
+
+@app.route('/api/admin/quiz-cache', methods=['DELETE'])
+def purge_quiz_cache():
+    try:
+        data = request.get_json(silent=True) or {}
+        context = data.get('context')
+        if context is not None and not isinstance(context, str):
+            return jsonify({'status': 'error', 'message': 'context must be a string'}), 400
+        removed = quiz_cache.purge(context, data.get('num_questions'))
+        return jsonify({'status': 'success', 'removed': removed})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @app.route('/generate-quiz', methods=['POST'])
@@ -936,7 +1590,25 @@ def generate_quiz():
         if not isinstance(num_questions, int) or not (1 <= num_questions <= 10):
             num_questions = 5
 
+        pooled = quiz_pool.take(context, num_questions)
+        if pooled:
+            logger.info(f"Serving pre-generated quiz for: {context}")
+            if wants_event_stream():
+                return event_stream_response(replay_quiz(pooled, context, cached=True))
+            return jsonify({
+                "success": True,
+                "quiz": pooled,
+                "context": context
+            })
+
         logger.info(f"Generating quiz for: {context}")
+        if request.args.get('async') == 'true':
+            job_id = job_queue.submit('quiz', {'context': context, 'num_questions': num_questions})
+            return jsonify({"success": True, "job_id": job_id, "url": f"/api/jobs/{job_id}"}), 202
+
+        if wants_event_stream():
+            return event_stream_response(stream_quiz(context, num_questions))
+
         quiz_questions = generate_quiz_with_ai(context, num_questions)
 
         return jsonify({
@@ -945,13 +1617,25 @@ def generate_quiz():
             "context": context
         })
 
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         logger.error(f"Server error: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
 
 if __name__ == '__main__':
-    print("✅ Flask server running on http://localhost:5000")
-    print("🔁 Ensure LM Studio is running at http://127.0.0.1:1234")
-    init_db()
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    debug = os.environ.get('FLASK_DEBUG', '1') != '0'
+    # In debug mode the reloader runs this module twice: a watcher process and
+    # the child that serves requests (WERKZEUG_RUN_MAIN=true). Background
+    # workers only start in the serving process, so there is one of each.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        print("✅ Flask server running on http://localhost:5000")
+        print("🔁 Ensure LM Studio is running at http://127.0.0.1:1234")
+        init_db()
+        start_reconcile_job(users_pool)
+        job_queue.start()
+        job_queue.recover()
+        quiz_pool.start()
+        outbox.start()
+    app.run(debug=debug, host='0.0.0.0', port=5000)
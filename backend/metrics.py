@@ -0,0 +1,276 @@
+import bisect
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# In-process counters and histograms, rendered in the Prometheus text format
+# on GET /metrics. Each worker process keeps its own registry, so scrape every
+# process (or run one) rather than expecting a sum behind a load balancer.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+LLM_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+SIZE_BUCKETS = tuple(1024 * kb for kb in (16, 64, 256, 1024, 4096, 10240, 16384))
+
+# Statement labels are the normalised SQL text; past this many distinct ones
+# (ad-hoc queries, generated IN lists) new statements are counted as 'other'
+MAX_SQL_STATEMENTS = int(os.environ.get('METRICS_MAX_SQL_STATEMENTS', 300))
+MAX_STATEMENT_LENGTH = 200
+
+IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs += [f'{n}="{_escape(v)}"' for n, v in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram:
+    """Fixed-bucket histogram per label set.
+
+    observe() is a bisect and two additions under a lock; buckets are only
+    made cumulative when rendered.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, list(counts), total) for labels, (counts, total) in self._series.items())
+        bounds = self.buckets + (float('inf'),)
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, (('le', _number(float(bound))),))
+                yield f'{self.name}_bucket{le} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(round(total, 6))}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def collector(self, fn):
+        """Register fn() -> [(name, kind, help, [(labels dict, value), ...]), ...].
+
+        For values another subsystem already tracks (pool sizes, queue depth),
+        read at scrape time instead of being pushed on every change.
+        """
+        self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        for fn in self._collectors:
+            try:
+                families = fn()
+            except Exception:
+                logger.exception('Metrics collector %s failed', getattr(fn, '__name__', fn))
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(labels, labels.values())} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by route template, method and status.',
+    ('method', 'route', 'status'))
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'Time from request start until the response body was sent.',
+    ('method', 'route'))
+sql_latency = registry.histogram(
+    'db_statement_duration_seconds', 'Statement execution time, labelled by normalised SQL.',
+    ('database', 'statement'), SQL_BUCKETS)
+sql_errors = registry.counter(
+    'db_statement_errors_total', 'Statements that raised, labelled by normalised SQL.',
+    ('database', 'statement'))
+llm_latency = registry.histogram(
+    'llm_request_duration_seconds', 'LM Studio call time, including retries.',
+    ('operation', 'outcome'), LLM_BUCKETS)
+llm_first_token = registry.histogram(
+    'llm_first_token_seconds', 'Time to the first streamed token.', ('operation',), LLM_BUCKETS)
+llm_tokens = registry.counter(
+    'llm_tokens_total', 'Tokens reported by the model server.', ('operation', 'kind'))
+upload_size = registry.histogram(
+    'upload_size_bytes', 'Size of stored uploads.', ('type',), SIZE_BUCKETS)
+
+_statements = set()
+_statements_lock = threading.Lock()
+_local = threading.local()
+
+
+@functools.lru_cache(maxsize=2048)
+def _normalise(sql):
+    text = IN_LIST.sub('(?, ...)', ' '.join(sql.split()))
+    return text if len(text) <= MAX_STATEMENT_LENGTH else text[:MAX_STATEMENT_LENGTH - 3] + '...'
+
+
+def statement_label(sql):
+    label = _normalise(sql)
+    if label in _statements:
+        return label
+    with _statements_lock:
+        if len(_statements) >= MAX_SQL_STATEMENTS:
+            return 'other'
+        _statements.add(label)
+    return label
+
+
+def observe_sql(database, sql, seconds, ok=True):
+    label = statement_label(sql)
+    sql_latency.observe(seconds, database, label)
+    if not ok:
+        sql_errors.inc(database, label)
+
+
+def observe_request(method, route, status, seconds):
+    http_requests.inc(method, route, str(status))
+    http_latency.observe(seconds, method, route)
+
+
+def observe_llm(operation, seconds, ok, usage=None, first_token=None):
+    llm_latency.observe(seconds, operation, 'ok' if ok else 'error')
+    if first_token is not None:
+        llm_first_token.observe(first_token, operation)
+    if usage:
+        for kind in ('prompt', 'completion'):
+            tokens = usage.get(f'{kind}_tokens') or 0
+            if tokens:
+                llm_tokens.inc(operation, kind, amount=tokens)
+
+
+@contextmanager
+def untimed():
+    """Don't record statements run by this thread inside the block.
+
+    For schema setup, migrations and plan checks: they run once, and would
+    otherwise take statement labels from the request-path queries.
+    """
+    previous = getattr(_local, 'paused', False)
+    _local.paused = True
+    try:
+        yield
+    finally:
+        _local.paused = previous
+
+
+def timed(database, sql, run):
+    """Run run() and record it against sql. Used by both database backends."""
+    if getattr(_local, 'paused', False):
+        return run()
+    start = time.perf_counter()
+    try:
+        result = run()
+    except Exception:
+        observe_sql(database, sql, time.perf_counter() - start, ok=False)
+        raise
+    observe_sql(database, sql, time.perf_counter() - start)
+    return result
+
+
+def benchmark(n=200000):
+    """Per-call cost of the hot-path recorders, to keep an eye on overhead."""
+    sqls = [f'SELECT * FROM events WHERE event_id = ? AND status IN ({", ".join("?" * k)})' for k in range(1, 6)]
+    start = time.perf_counter()
+    for i in range(n):
+        observe_sql('bench.db', sqls[i % 5], 0.0001 * (i % 50))
+    sql_us = (time.perf_counter() - start) * 1e6 / n
+
+    start = time.perf_counter()
+    for i in range(n):
+        observe_request('GET', '/api/events/<int:event_id>', 200, 0.001 * (i % 100))
+    request_us = (time.perf_counter() - start) * 1e6 / n
+
+    start = time.perf_counter()
+    text = registry.render()
+    render_ms = (time.perf_counter() - start) * 1000
+    print(f'observe_sql: {sql_us:.2f} us/call ({len(_statements)} statement label(s))')
+    print(f'observe_request: {request_us:.2f} us/call')
+    print(f'render: {render_ms:.2f} ms for {len(text.splitlines())} lines')
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,422 @@
+import logging
+import os
+import sys
+
+from metrics import untimed
+from stats import STATS_SCHEMA, SERVER_STATS_SCHEMA, reconcile
+from quiz_cache import QUIZ_CACHE_SCHEMA
+from jobs import JOBS_LEASE_SCHEMA, JOBS_SCHEMA, SERVER_JOBS_LEASE_SCHEMA
+from outbox import OUTBOX_LEASE_SCHEMA, OUTBOX_SCHEMA, SERVER_OUTBOX_LEASE_SCHEMA
+from participation import PARTICIPATION_SCHEMA
+from search import SEARCH_SCHEMA, SERVER_SEARCH_SCHEMA
+from geo import GEO_SCHEMA, SERVER_GEO_SCHEMA
+from data_version import (
+    EVENTS_VERSIONED_TABLES, USERS_VERSIONED_TABLES, data_version_schema, server_data_version_schema
+)
+
+logger = logging.getLogger(__name__)
+
+# 'strict' refuses to start (or fails `python migrations.py`) when a hot query
+# loses its index, 'warn' only logs it, 'off' skips the check
+QUERY_PLAN_CHECK = os.environ.get('QUERY_PLAN_CHECK', 'strict')
+
+
+class QueryPlanRegression(Exception):
+    def __init__(self, offenders):
+        self.offenders = offenders
+        super().__init__('Hot queries not using an index: ' + '; '.join(
+            f"{name}: {' / '.join(plan)}" for name, plan in offenders.items()
+        ))
+
+MIGRATION_LOCK_ID = 7230415  # arbitrary key for pg_advisory_xact_lock
+
+
+USERS_EVENTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT UNIQUE NOT NULL,
+        title TEXT NOT NULL,
+        description TEXT,
+        date TEXT NOT NULL,
+        place TEXT NOT NULL,
+        image TEXT,
+        admin_id INTEGER NOT NULL,
+        max_participants INTEGER DEFAULT 50,
+        current_participants INTEGER DEFAULT 0,
+        waste_collected REAL DEFAULT 0.0,
+        status TEXT DEFAULT 'upcoming',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (admin_id) REFERENCES users (id)
+    )
+'''
+
+def _rebuild_legacy_events(conn):
+    # Early builds created users.db/events with the /create-event layout
+    # (integer event_id, template column). Move it aside so the admin schema applies.
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(events)')}
+    if 'title' in columns:
+        return
+    conn.execute('ALTER TABLE events RENAME TO legacy_events')
+    conn.execute(USERS_EVENTS_TABLE)
+
+
+# (version, name, steps) - a step is either an SQL statement or a callable taking the connection.
+# Never edit an applied migration, append a new one instead.
+USERS_MIGRATIONS = [
+    (1, 'initial_schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            phone TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT 1
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS password_reset_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            used BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+        USERS_EVENTS_TABLE,
+        '''
+        CREATE TABLE IF NOT EXISTS event_participants (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (event_id) REFERENCES events (event_id),
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        ''',
+    ]),
+    (2, 'rebuild_legacy_events', [_rebuild_legacy_events]),
+    (3, 'hot_query_indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_event_participants_event_user ON event_participants (event_id, user_id)',
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON events (date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_created_at ON events (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token_expires ON password_reset_tokens (token, expires_at)',
+    ]),
+    (4, 'dashboard_stats', STATS_SCHEMA + [lambda conn: reconcile(conn)]),
+    (5, 'quiz_cache', QUIZ_CACHE_SCHEMA),
+    (6, 'llm_jobs', JOBS_SCHEMA),
+    (7, 'email_outbox', OUTBOX_SCHEMA),
+    (8, 'event_signups', PARTICIPATION_SCHEMA),
+    (9, 'data_version', data_version_schema(USERS_VERSIONED_TABLES)),
+    (10, 'event_search', SEARCH_SCHEMA),
+    (11, 'event_locations', GEO_SCHEMA),
+    (12, 'email_outbox_leases', OUTBOX_LEASE_SCHEMA),
+    (13, 'llm_job_leases', JOBS_LEASE_SCHEMA),
+]
+
+EVENTS_MIGRATIONS = [
+    (1, 'initial_schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS events (
+            event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL,
+            image TEXT,
+            template TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'listing_indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_events_created_at ON events (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON events (date)',
+    ]),
+    (3, 'data_version', data_version_schema(EVENTS_VERSIONED_TABLES)),
+]
+
+# Server databases (PostgreSQL) start from the current schema in one step and
+# get their own numbering; add to both lists when the schema changes.
+# Timestamps shown to clients stay TEXT in SQLite's CURRENT_TIMESTAMP format.
+SERVER_NOW = "(to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'))"
+
+SERVER_USERS_MIGRATIONS = [
+    (1, 'initial_schema', [
+        f'''
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGSERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            phone TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            created_at TEXT DEFAULT {SERVER_NOW},
+            is_active INTEGER DEFAULT 1
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS password_reset_tokens (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            token TEXT NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            created_at TEXT DEFAULT {SERVER_NOW},
+            used INTEGER DEFAULT 0
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS events (
+            id BIGSERIAL PRIMARY KEY,
+            event_id TEXT UNIQUE NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL,
+            image TEXT,
+            admin_id BIGINT NOT NULL,
+            max_participants INTEGER DEFAULT 50,
+            current_participants INTEGER DEFAULT 0,
+            waste_collected DOUBLE PRECISION DEFAULT 0.0,
+            status TEXT DEFAULT 'upcoming',
+            created_at TEXT DEFAULT {SERVER_NOW}
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS event_participants (
+            id BIGSERIAL PRIMARY KEY,
+            event_id TEXT NOT NULL,
+            user_id BIGINT NOT NULL,
+            joined_at TEXT DEFAULT {SERVER_NOW},
+            UNIQUE (event_id, user_id)
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS event_waitlist (
+            id BIGSERIAL PRIMARY KEY,
+            event_id TEXT NOT NULL,
+            user_id BIGINT NOT NULL,
+            created_at TEXT DEFAULT {SERVER_NOW},
+            UNIQUE (event_id, user_id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_event_waitlist_event ON event_waitlist (event_id, id)',
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON events (date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_created_at ON events (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_token_expires ON password_reset_tokens (token, expires_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS quiz_cache (
+            cache_key TEXT PRIMARY KEY,
+            context TEXT NOT NULL,
+            num_questions INTEGER NOT NULL,
+            quiz TEXT NOT NULL,
+            created_at DOUBLE PRECISION NOT NULL,
+            expires_at DOUBLE PRECISION NOT NULL,
+            last_used DOUBLE PRECISION NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_quiz_cache_last_used ON quiz_cache (last_used)',
+        'CREATE INDEX IF NOT EXISTS idx_quiz_cache_expires_at ON quiz_cache (expires_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS llm_jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            result TEXT,
+            error TEXT,
+            created_at DOUBLE PRECISION NOT NULL,
+            started_at DOUBLE PRECISION,
+            finished_at DOUBLE PRECISION
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_llm_jobs_status_created ON llm_jobs (status, created_at)',
+        '''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at DOUBLE PRECISION NOT NULL,
+            next_attempt_at DOUBLE PRECISION NOT NULL,
+            sent_at DOUBLE PRECISION
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)',
+    ] + SERVER_STATS_SCHEMA),
+    (2, 'data_version', server_data_version_schema(USERS_VERSIONED_TABLES)),
+    (3, 'event_search', SERVER_SEARCH_SCHEMA),
+    (4, 'event_locations', SERVER_GEO_SCHEMA),
+    (5, 'email_outbox_leases', SERVER_OUTBOX_LEASE_SCHEMA),
+    (6, 'llm_job_leases', SERVER_JOBS_LEASE_SCHEMA),
+]
+
+SERVER_EVENTS_MIGRATIONS = [
+    (1, 'initial_schema', [
+        f'''
+        CREATE TABLE IF NOT EXISTS events (
+            event_id BIGSERIAL PRIMARY KEY,
+            admin_id BIGINT NOT NULL,
+            date TEXT NOT NULL,
+            place TEXT NOT NULL,
+            image TEXT,
+            template TEXT,
+            created_at TEXT DEFAULT {SERVER_NOW}
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_events_created_at ON events (created_at, event_id)',
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON events (date)',
+    ]),
+    (2, 'data_version', server_data_version_schema(EVENTS_VERSIONED_TABLES)),
+]
+
+
+def migrations_for(pool, migrations, server_migrations):
+    return migrations if pool.dialect == 'sqlite' else server_migrations
+
+
+# Queries on the request path that must be served by an index.
+
+USERS_HOT_QUERIES = {
+    'delete_event_participants': 'DELETE FROM event_participants WHERE event_id = ?',
+    'event_participant_lookup': 'SELECT id FROM event_participants WHERE event_id = ? AND user_id = ?',
+    'event_waitlist_head': 'SELECT id, user_id FROM event_waitlist WHERE event_id = ? ORDER BY id LIMIT 1',
+    'event_waitlist_position': 'SELECT COUNT(*) FROM event_waitlist WHERE event_id = ? AND id <= ?',
+    'recent_events': '''
+        SELECT e.*, u.name as admin_name
+        FROM events e
+        JOIN users u ON e.admin_id = u.id
+        ORDER BY e.created_at DESC
+        LIMIT 5
+    ''',
+    'upcoming_events': 'SELECT COUNT(*) as count FROM events WHERE date >= CAST(CURRENT_DATE AS TEXT)',
+    'upcoming_event_dates': '''
+        SELECT COALESCE(SUM(count), 0) as count FROM event_date_counts WHERE date >= CAST(CURRENT_DATE AS TEXT)
+    ''',
+    'reset_token_lookup': '''
+        SELECT user_id FROM password_reset_tokens
+        WHERE token = ? AND expires_at > ? AND used = 0
+    ''',
+    'reset_token_mark_used': 'UPDATE password_reset_tokens SET used = 1 WHERE token = ?',
+    'user_by_email': 'SELECT id FROM users WHERE email = ?',
+    'event_by_event_id': 'SELECT * FROM events WHERE event_id = ?',
+    'events_page': '''
+        SELECT e.*, u.name as admin_name
+        FROM events e
+        JOIN users u ON e.admin_id = u.id
+        WHERE (e.created_at, e.id) < (?, ?)
+        ORDER BY e.created_at DESC, e.id DESC
+        LIMIT ?
+    ''',
+}
+
+EVENTS_HOT_QUERIES = {
+    'events_page': '''
+        SELECT * FROM events e
+        WHERE (e.created_at, e.event_id) < (?, ?)
+        ORDER BY e.created_at DESC, e.event_id DESC
+        LIMIT ?
+    ''',
+}
+
+
+def applied_versions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+    return {row[0] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+
+def run_migrations(pool, migrations):
+    """Apply pending migrations in version order, each in its own transaction."""
+    applied = []
+    with untimed(), pool.connection() as conn:
+        done = applied_versions(conn)
+        for version, name, steps in sorted(migrations, key=lambda m: m[0]):
+            if version in done:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if pool.dialect != 'sqlite':
+                    # Several app servers may start at once; let one of them migrate
+                    conn.execute('SELECT pg_advisory_xact_lock(?)', (MIGRATION_LOCK_ID,))
+                if conn.execute('SELECT 1 FROM schema_migrations WHERE version = ?', (version,)).fetchone():
+                    conn.rollback()
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+                conn.execute(
+                    'INSERT INTO schema_migrations (version, name) VALUES (?, ?)',
+                    (version, name)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                logger.error(f"Migration {version} ({name}) failed on {pool.path}")
+                raise
+            logger.info(f"Applied migration {version} ({name}) to {pool.path}")
+            applied.append(version)
+    return applied
+
+
+def query_plan(conn, sql):
+    params = (None,) * sql.count('?')
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def find_table_scans(conn, queries):
+    """Return {name: plan} for every query whose plan contains a full table scan.
+
+    An index-ordered scan ("SCAN e USING INDEX ...") is fine, a bare
+    "SCAN <table>" or a temp b-tree sort is not.
+    """
+    offenders = {}
+    for name, sql in queries.items():
+        plan = query_plan(conn, sql)
+        for detail in plan:
+            bare_scan = detail.startswith('SCAN') and 'USING' not in detail
+            if bare_scan or 'TEMP B-TREE' in detail:
+                offenders[name] = plan
+                break
+    return offenders
+
+
+def check_query_plans(pool, queries=USERS_HOT_QUERIES, mode=QUERY_PLAN_CHECK):
+    """Raise QueryPlanRegression if a hot query would scan (mode='strict')."""
+    if pool.dialect != 'sqlite' or mode == 'off':
+        # EXPLAIN QUERY PLAN is SQLite's; server databases are checked with their own tooling
+        return {}
+    with untimed(), pool.connection() as conn:
+        offenders = find_table_scans(conn, queries)
+    for name, plan in offenders.items():
+        logger.warning(f"Hot query '{name}' is not using an index: {plan}")
+    if offenders and mode == 'strict':
+        raise QueryPlanRegression(offenders)
+    return offenders
+
+
+if __name__ == '__main__':
+    # python migrations.py - migrate both databases and fail if a hot query scans
+    from db import users_pool, events_pool
+
+    logging.basicConfig(level=logging.INFO)
+    run_migrations(users_pool, migrations_for(users_pool, USERS_MIGRATIONS, SERVER_USERS_MIGRATIONS))
+    run_migrations(events_pool, migrations_for(events_pool, EVENTS_MIGRATIONS, SERVER_EVENTS_MIGRATIONS))
+    offenders = check_query_plans(users_pool, mode='warn')
+    offenders.update(check_query_plans(events_pool, EVENTS_HOT_QUERIES, mode='warn'))
+    if offenders:
+        sys.exit(str(QueryPlanRegression(offenders)))
+    print(f'{len(USERS_HOT_QUERIES) + len(EVENTS_HOT_QUERIES)} hot queries use their indexes')
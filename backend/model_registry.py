@@ -0,0 +1,111 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MODELS_TTL = 300           # seconds before the model list is considered stale
+MODELS_BASE_BACKOFF = 5    # first retry delay after a failed refresh
+MODELS_MAX_BACKOFF = 300
+
+
+class ModelRegistry:
+    """Cached view of the models the LLM server exposes.
+
+    The first lookup loads the list synchronously. After that, a stale list is
+    still served while a background thread refreshes it, and failed refreshes
+    back off exponentially instead of hitting the server on every request.
+    """
+
+    def __init__(self, fetch, ttl=MODELS_TTL, base_backoff=MODELS_BASE_BACKOFF,
+                 max_backoff=MODELS_MAX_BACKOFF):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._models = None
+        self._fetched_at = 0.0
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._refreshing = False
+        self._last_error = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def models(self):
+        now = time.monotonic()
+        with self._lock:
+            models = self._models
+            stale = now - self._fetched_at >= self.ttl
+            can_retry = now >= self._next_attempt
+            start_background = models is not None and stale and can_retry and not self._refreshing
+            if start_background:
+                self._refreshing = True
+
+        if models is None:
+            if can_retry:
+                self.refresh()
+            with self._lock:
+                return list(self._models or [])
+
+        if start_background:
+            threading.Thread(target=self._background_refresh, name='model-registry', daemon=True).start()
+        return list(models)
+
+    def default_model_id(self, fallback='local-model'):
+        models = self.models()
+        return models[0].get('id', fallback) if models else fallback
+
+    def refresh(self):
+        """Fetch the model list now. Returns True on success."""
+        with self._refresh_lock:
+            # Another caller may have loaded it, or failed and backed off, while we waited
+            with self._lock:
+                now = time.monotonic()
+                if self._models is not None and now - self._fetched_at < self.ttl:
+                    return True
+                if now < self._next_attempt:
+                    return False
+            try:
+                models = self._fetch()
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                    delay = min(self.max_backoff, self.base_backoff * 2 ** (self._failures - 1))
+                    self._next_attempt = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                    self._last_error = str(e)
+                logger.error(f"Model list refresh failed ({self._failures} in a row): {e}")
+                return False
+            with self._lock:
+                self._models = models
+                self._fetched_at = time.monotonic()
+                self._failures = 0
+                self._next_attempt = 0.0
+                self._last_error = None
+            return True
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def invalidate(self):
+        with self._lock:
+            self._fetched_at = 0.0
+            self._next_attempt = 0.0
+
+    def stats(self):
+        with self._lock:
+            age = time.monotonic() - self._fetched_at if self._models is not None else None
+            return {
+                'models': len(self._models or []),
+                'age_seconds': round(age, 1) if age is not None else None,
+                'stale': age is None or age >= self.ttl,
+                'refreshing': self._refreshing,
+                'consecutive_failures': self._failures,
+                'retry_in_seconds': round(max(0.0, self._next_attempt - time.monotonic()), 1),
+                'last_error': self._last_error,
+            }
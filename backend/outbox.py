@@ -0,0 +1,331 @@
+import logging
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+logger = logging.getLogger(__name__)
+
+# Point these at a local stand-in (python outbox.py) to test without a real server
+SMTP_HOST = os.environ.get('SMTP_HOST', '')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USER = os.environ.get('SMTP_USER', '')
+SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') == '1'
+MAIL_FROM = os.environ.get('MAIL_FROM', SMTP_USER or 'no-reply@localhost')
+
+OUTBOX_BATCH = 50
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BASE_BACKOFF = 30         # seconds, doubled per failed attempt
+OUTBOX_MAX_BACKOFF = 3600
+OUTBOX_POLL_INTERVAL = 30        # also catches rows written by other processes
+SMTP_IDLE_TIMEOUT = 60           # close the connection after this long without mail
+SMTP_TIMEOUT = 10
+SMTP_CHECK_AFTER = 5             # NOOP a reused connection that has been quiet this long
+OUTBOX_RETENTION = 7 * 24 * 3600
+OUTBOX_LEASE = 600               # a claimed batch goes back to pending if its sender dies
+
+OUTBOX_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipient TEXT NOT NULL,
+        subject TEXT NOT NULL,
+        body TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        next_attempt_at REAL NOT NULL,
+        sent_at REAL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)',
+]
+
+# Senders claim a batch (status 'sending' plus a lease) before sending it, so
+# several sender threads or app instances never pick up the same row
+OUTBOX_LEASE_SCHEMA = [
+    'ALTER TABLE email_outbox ADD COLUMN lease_owner TEXT',
+    'ALTER TABLE email_outbox ADD COLUMN lease_until REAL',
+]
+
+SERVER_OUTBOX_LEASE_SCHEMA = [
+    'ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS lease_owner TEXT',
+    'ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS lease_until DOUBLE PRECISION',
+]
+
+
+def smtp_connect():
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    if SMTP_STARTTLS:
+        server.starttls()
+    if SMTP_USER:
+        server.login(SMTP_USER, SMTP_PASSWORD)
+    return server
+
+
+def build_message(recipient, subject, body):
+    msg = MIMEMultipart()
+    msg['From'] = MAIL_FROM
+    msg['To'] = recipient
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    return msg.as_string()
+
+
+def is_permanent(error):
+    # 5xx replies won't succeed on retry; connection problems and 4xx might
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class Outbox:
+    """Transactional email outbox drained by a background sender.
+
+    enqueue() only inserts a row, optionally on the caller's connection so the
+    mail commits with the change that caused it. The sender claims due rows in
+    batches, sends them over a single reused SMTP connection, retries transient
+    failures with exponential backoff and records the outcome on each row.
+    Claims make it safe to run a sender in every app instance.
+    """
+
+    def __init__(self, pool, connect=smtp_connect, enabled=bool(SMTP_HOST)):
+        self.pool = pool
+        self.connect = connect
+        self.enabled = enabled
+        self._server = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._metrics = {'enqueued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'connections': 0, 'batches': 0}
+
+    def enqueue(self, recipient, subject, body, conn=None):
+        now = time.time()
+        sql = '''
+            INSERT INTO email_outbox (recipient, subject, body, created_at, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        if conn is not None:
+            message_id = conn.execute(sql, (recipient, subject, body, now, now)).lastrowid
+        else:
+            with self.pool.connection() as own:
+                message_id = own.execute(sql, (recipient, subject, body, now, now)).lastrowid
+                own.commit()
+            self.wake()
+        with self._lock:
+            self._metrics['enqueued'] += 1
+        return message_id
+
+    def wake(self):
+        """Call after committing rows enqueued on a caller's connection."""
+        self._wake.set()
+
+    def _claim(self):
+        """Mark a batch of due rows as ours; returns (lease, rows).
+
+        The status check is repeated in the UPDATE itself, so a row another
+        sender claimed in the meantime is skipped rather than sent twice.
+        Rows whose sender died mid-batch come back once their lease expires.
+        """
+        lease = uuid.uuid4().hex
+        now = time.time()
+        with self.pool.transaction() as conn:
+            conn.execute('''
+                UPDATE email_outbox SET status = 'sending', lease_owner = ?, lease_until = ?
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= ?)
+                       OR (status = 'sending' AND lease_until <= ?)
+                    ORDER BY next_attempt_at LIMIT ?
+                )
+                AND (status = 'pending' OR lease_until <= ?)
+            ''', (lease, now + OUTBOX_LEASE, now, now, OUTBOX_BATCH, now))
+        with self.pool.connection() as conn:
+            rows = conn.execute('''
+                SELECT id, recipient, subject, body, attempts FROM email_outbox
+                WHERE lease_owner = ? AND status = 'sending'
+                ORDER BY next_attempt_at
+            ''', (lease,)).fetchall()
+        return lease, rows
+
+    def _record(self, lease, updates, unsent):
+        with self.pool.transaction() as conn:
+            conn.executemany('''
+                UPDATE email_outbox SET status = ?, attempts = ?, last_error = ?,
+                    next_attempt_at = ?, sent_at = ?, lease_owner = NULL, lease_until = NULL
+                WHERE id = ?
+            ''', updates)
+            if unsent:
+                # Left over after a connection failure; due again straight away
+                conn.executemany('''
+                    UPDATE email_outbox SET status = 'pending', lease_owner = NULL, lease_until = NULL
+                    WHERE id = ? AND lease_owner = ?
+                ''', [(message_id, lease) for message_id in unsent])
+
+    def _smtp(self):
+        if self._server is not None:
+            if time.monotonic() - self._last_used < SMTP_CHECK_AFTER:
+                return self._server
+            try:
+                self._server.noop()
+                return self._server
+            except smtplib.SMTPException:
+                self._close()
+        self._server = self.connect()
+        with self._lock:
+            self._metrics['connections'] += 1
+        return self._server
+
+    def _close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def send_batch(self):
+        """Send one batch of due messages; returns how many were attempted."""
+        lease, rows = self._claim()
+        if not rows:
+            return 0
+
+        updates = []
+        unsent = [row['id'] for row in rows]
+        for row in rows:
+            unsent.remove(row['id'])
+            attempts = row['attempts'] + 1
+            now = time.time()
+            try:
+                self._smtp().sendmail(
+                    MAIL_FROM, [row['recipient']], build_message(row['recipient'], row['subject'], row['body'])
+                )
+                updates.append(('sent', attempts, None, now, now, row['id']))
+                outcome = 'sent'
+                self._last_used = time.monotonic()
+            except (smtplib.SMTPException, OSError) as e:
+                if attempts >= OUTBOX_MAX_ATTEMPTS or is_permanent(e):
+                    updates.append(('failed', attempts, str(e), now, None, row['id']))
+                    outcome = 'failed'
+                    logger.error(f"Email {row['id']} to {row['recipient']} failed permanently: {e}")
+                else:
+                    backoff = min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * 2 ** (attempts - 1))
+                    backoff *= random.uniform(0.8, 1.2)
+                    updates.append(('pending', attempts, str(e), now + backoff, None, row['id']))
+                    outcome = 'retried'
+                if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)):
+                    # The connection itself is suspect; reconnect and retry the rest later
+                    self._close()
+                    with self._lock:
+                        self._metrics[outcome] += 1
+                    break
+            with self._lock:
+                self._metrics[outcome] += 1
+
+        self._record(lease, updates, unsent)
+        with self._lock:
+            self._metrics['batches'] += 1
+        return len(updates)
+
+    def purge(self):
+        with self.pool.connection() as conn:
+            conn.execute(
+                "DELETE FROM email_outbox WHERE status IN ('sent', 'failed') AND created_at < ?",
+                (time.time() - OUTBOX_RETENTION,)
+            )
+            conn.commit()
+
+    def _run(self):
+        self.purge()
+        while not self._stop.is_set():
+            try:
+                if self.send_batch() == OUTBOX_BATCH:
+                    continue
+            except Exception as e:
+                logger.error(f"Email outbox sender error: {e}")
+                self._close()
+            if self._server is not None and time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+                self._close()
+            self._wake.wait(OUTBOX_POLL_INTERVAL)
+            self._wake.clear()
+        self._close()
+
+    def start(self):
+        if self._thread or not self.enabled:
+            return
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status').fetchall())
+        with self._lock:
+            return {
+                **self._metrics,
+                'enabled': self.enabled,
+                'connected': self._server is not None,
+                'queue': {status: counts.get(status, 0) for status in ('pending', 'sending', 'sent', 'failed')},
+            }
+
+
+def run_stand_in(host='localhost', port=1025):
+    """Minimal SMTP sink that prints every message it receives."""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, line):
+            self.wfile.write(f'{line}\r\n'.encode())
+
+        def handle(self):
+            self.reply('220 outbox stand-in ready')
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                command = line.decode(errors='replace').strip().upper()
+                if command.startswith(('EHLO', 'HELO')):
+                    self.reply('250 stand-in')
+                elif command == 'DATA':
+                    self.reply('354 end with <CRLF>.<CRLF>')
+                    data = []
+                    for raw in self.rfile:
+                        if raw in (b'.\r\n', b'.\n'):
+                            break
+                        data.append(raw.decode(errors='replace'))
+                    print(''.join(data), flush=True)
+                    self.reply('250 queued')
+                elif command == 'QUIT':
+                    self.reply('221 bye')
+                    return
+                else:
+                    self.reply('250 ok')
+
+    class Server(socketserver.ThreadingTCPServer):
+        allow_reuse_address = True
+        daemon_threads = True
+
+    with Server((host, port), Handler) as server:
+        print(f'SMTP stand-in listening on {host}:{port}', flush=True)
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    # python outbox.py [port] - run with SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=0
+    import sys
+
+    run_stand_in(port=int(sys.argv[1]) if len(sys.argv) > 1 else 1025)
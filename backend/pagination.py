@@ -0,0 +1,118 @@
+import base64
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 200
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return created_at, int(row_id)
+    except Exception:
+        raise PaginationError('Invalid cursor')
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('limit must be an integer')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def build_event_listing(select_sql, alias, id_column, args, statuses=True):
+    """Build a newest-first event listing with optional filters and keyset cursor.
+
+    select_sql is everything up to (not including) WHERE, alias the events
+    table alias and id_column its unique integer key. Recognised query args:
+    status, date_from, date_to, cursor. Returns (sql, params).
+    """
+    where = []
+    params = []
+
+    if statuses and args.get('status'):
+        where.append(f'{alias}.status = ?')
+        params.append(args['status'])
+    if args.get('date_from'):
+        where.append(f'{alias}.date >= ?')
+        params.append(args['date_from'])
+    if args.get('date_to'):
+        where.append(f'{alias}.date <= ?')
+        params.append(args['date_to'])
+    if args.get('cursor'):
+        created_at, row_id = decode_cursor(args['cursor'])
+        where.append(f'({alias}.created_at, {alias}.{id_column}) < (?, ?)')
+        params.extend([created_at, row_id])
+
+    sql = select_sql
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {alias}.created_at DESC, {alias}.{id_column} DESC'
+    return sql, params
+
+
+def fetch_page(conn, sql, params, limit, id_column):
+    """Run a listing query and return (rows, next_cursor)."""
+    rows = conn.execute(f'{sql} LIMIT ?', (*params, limit + 1)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['created_at'], last[id_column])
+    return rows, next_cursor
+
+
+def stream_query(conn, sql, params=()):
+    """Execute a large read meant to be consumed with fetchmany().
+
+    SQLite already steps through the result lazily. Server connections
+    use a server-side cursor, because a plain one loads the whole result
+    into memory when the query runs.
+    """
+    stream = getattr(conn, 'stream', None)
+    return stream(sql, params) if stream else conn.execute(sql, params)
+
+
+def stream_json_rows(pool, sql, params, key, envelope, transform=dict):
+    """Yield a JSON document {**envelope, key: [rows...]} chunk by chunk.
+
+    Rows are pulled from the database in batches and written out as they arrive,
+    so the full result set is never held in memory.
+    """
+    head = json.dumps(envelope)[:-1]
+    yield f'{head}, "{key}": [' if envelope else f'{{"{key}": ['
+    with pool.connection() as conn:
+        cursor = stream_query(conn, sql, params)
+        first = True
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            chunk = ','.join(json.dumps(transform(row), default=str) for row in rows)
+            yield chunk if first else ',' + chunk
+            first = False
+    yield ']}'
+
+
+def stream_ndjson_rows(pool, sql, params, transform=dict):
+    with pool.connection() as conn:
+        cursor = stream_query(conn, sql, params)
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            yield ''.join(json.dumps(transform(row), default=str) + '\n' for row in rows)
@@ -0,0 +1,277 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+PARTICIPATION_SCHEMA = [
+    # Keep the first join of any duplicated pair so the unique index can be built
+    '''
+    DELETE FROM event_participants WHERE id NOT IN (
+        SELECT MIN(id) FROM event_participants GROUP BY event_id, user_id
+    )
+    ''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uix_event_participants_event_user ON event_participants (event_id, user_id)',
+    'DROP INDEX IF EXISTS idx_event_participants_event_user',
+    '''
+    CREATE TABLE IF NOT EXISTS event_waitlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (event_id, user_id)
+    )
+    ''',
+    # Rows for one event come back in arrival order (rowid) without a sort
+    'CREATE INDEX IF NOT EXISTS idx_event_waitlist_event ON event_waitlist (event_id)',
+    # current_participants was never written before; bring it in line with the rows
+    '''
+    UPDATE events SET current_participants = (
+        SELECT COUNT(*) FROM event_participants ep WHERE ep.event_id = events.event_id
+    )
+    ''',
+]
+
+
+class EventNotFound(Exception):
+    pass
+
+
+class EventFull(Exception):
+    pass
+
+
+def _seats(conn, event_id):
+    row = conn.execute(
+        'SELECT max_participants, current_participants FROM events WHERE event_id = ?', (event_id,)
+    ).fetchone()
+    return {'max_participants': row['max_participants'], 'current_participants': row['current_participants']}
+
+
+def _lock_event(pool, conn, event_id):
+    # SQLite's BEGIN IMMEDIATE already serialises writers; a server database
+    # needs the event row locked so joins and leaves on it queue up in order
+    sql = 'SELECT status FROM events WHERE event_id = ?'
+    if pool.dialect != 'sqlite':
+        sql += ' FOR UPDATE'
+    return conn.execute(sql, (event_id,)).fetchone()
+
+
+def waitlist_position(conn, event_id, user_id):
+    row = conn.execute(
+        'SELECT id FROM event_waitlist WHERE event_id = ? AND user_id = ?', (event_id, user_id)
+    ).fetchone()
+    if row is None:
+        return None
+    return conn.execute(
+        'SELECT COUNT(*) FROM event_waitlist WHERE event_id = ? AND id <= ?', (event_id, row['id'])
+    ).fetchone()[0]
+
+
+def promote_waitlist(conn, event_id):
+    """Move waitlisted users into the event's free seats, oldest first.
+
+    Call inside the write transaction that freed the seats (a leave, or a
+    raised max_participants), after the statement that changed the event row
+    so the row is already held. Returns the promoted user ids.
+    """
+    row = conn.execute(
+        'SELECT max_participants, current_participants FROM events WHERE event_id = ?', (event_id,)
+    ).fetchone()
+    if row is None or row['current_participants'] >= row['max_participants']:
+        return []
+    heads = conn.execute(
+        'SELECT id, user_id FROM event_waitlist WHERE event_id = ? ORDER BY id LIMIT ?',
+        (event_id, row['max_participants'] - row['current_participants'])
+    ).fetchall()
+    for head in heads:
+        conn.execute('DELETE FROM event_waitlist WHERE id = ?', (head['id'],))
+        conn.execute('INSERT INTO event_participants (event_id, user_id) VALUES (?, ?)', (event_id, head['user_id']))
+    if heads:
+        conn.execute(
+            'UPDATE events SET current_participants = current_participants + ? WHERE event_id = ?',
+            (len(heads), event_id)
+        )
+    return [head['user_id'] for head in heads]
+
+
+def join_event(pool, event_id, user_id, waitlist=False):
+    try:
+        return _join_event(pool, event_id, user_id, waitlist)
+    except pool.IntegrityError:
+        # A concurrent join by the same user won the unique index; report that one
+        return _join_event(pool, event_id, user_id, waitlist)
+
+
+def _join_event(pool, event_id, user_id, waitlist):
+    """Take a seat on an event, or a waitlist place when it is full.
+
+    Runs in one write transaction holding the event: the seat is claimed with a
+    conditional UPDATE on current_participants, so concurrent joins can never
+    push it past max_participants, and the unique (event_id, user_id) index
+    rejects a second join by the same user. Returns {'status': 'joined' |
+    'already_joined' | 'waitlisted', ...seat counts}.
+    """
+    with pool.transaction() as conn:
+        event = _lock_event(pool, conn, event_id)
+        if event is None:
+            raise EventNotFound(event_id)
+        if event['status'] in ('completed', 'cancelled'):
+            raise EventFull(f"Event is {event['status']}")
+
+        if conn.execute(
+            'SELECT 1 FROM event_participants WHERE event_id = ? AND user_id = ?', (event_id, user_id)
+        ).fetchone():
+            return {'status': 'already_joined', **_seats(conn, event_id)}
+
+        claimed = conn.execute('''
+            UPDATE events SET current_participants = current_participants + 1
+            WHERE event_id = ? AND current_participants < max_participants
+        ''', (event_id,)).rowcount
+        if claimed:
+            conn.execute('INSERT INTO event_participants (event_id, user_id) VALUES (?, ?)', (event_id, user_id))
+            conn.execute('DELETE FROM event_waitlist WHERE event_id = ? AND user_id = ?', (event_id, user_id))
+            return {'status': 'joined', **_seats(conn, event_id)}
+
+        if not waitlist:
+            raise EventFull('Event is full')
+        conn.execute(
+            'INSERT INTO event_waitlist (event_id, user_id) VALUES (?, ?) ON CONFLICT DO NOTHING', (event_id, user_id)
+        )
+        return {
+            'status': 'waitlisted',
+            'position': waitlist_position(conn, event_id, user_id),
+            **_seats(conn, event_id),
+        }
+
+
+def leave_event(pool, event_id, user_id):
+    """Give up a seat (passing it to the head of the waitlist) or a waitlist place.
+
+    Returns {'status': 'left' | 'left_waitlist' | 'not_joined', 'promoted_user_id', ...}.
+    """
+    with pool.transaction() as conn:
+        if _lock_event(pool, conn, event_id) is None:
+            raise EventNotFound(event_id)
+
+        left = conn.execute(
+            'DELETE FROM event_participants WHERE event_id = ? AND user_id = ?', (event_id, user_id)
+        ).rowcount
+        if not left:
+            dequeued = conn.execute(
+                'DELETE FROM event_waitlist WHERE event_id = ? AND user_id = ?', (event_id, user_id)
+            ).rowcount
+            return {'status': 'left_waitlist' if dequeued else 'not_joined', **_seats(conn, event_id)}
+
+        conn.execute(
+            'UPDATE events SET current_participants = current_participants - 1 WHERE event_id = ?',
+            (event_id,)
+        )
+        # The freed seat goes to the head of the waitlist, if there is one
+        promoted = promote_waitlist(conn, event_id)
+        return {'status': 'left', 'promoted_user_id': promoted[0] if promoted else None, **_seats(conn, event_id)}
+
+
+def event_availability(pool, event_id):
+    with pool.connection() as conn:
+        row = conn.execute('''
+            SELECT max_participants, current_participants,
+                   (SELECT COUNT(*) FROM event_waitlist w WHERE w.event_id = e.event_id) AS waitlisted
+            FROM events e WHERE event_id = ?
+        ''', (event_id,)).fetchone()
+    if row is None:
+        raise EventNotFound(event_id)
+    return {
+        'max_participants': row['max_participants'],
+        'current_participants': row['current_participants'],
+        'seats_left': max(0, row['max_participants'] - row['current_participants']),
+        'waitlisted': row['waitlisted'],
+    }
+
+
+def load_test(requests=2000, capacity=100, threads=32, waitlist=True, database=None):
+    """Hammer one event with concurrent joins (plus some leaves) and check the books.
+
+    Runs against a scratch SQLite file, or against `database` (any URL
+    create_pool accepts) to exercise a server backend.
+    """
+    import os
+    import random
+    import tempfile
+    import time
+    import uuid
+    from concurrent.futures import ThreadPoolExecutor
+
+    from db import create_pool
+    from migrations import SERVER_USERS_MIGRATIONS, USERS_MIGRATIONS, migrations_for, run_migrations
+
+    pool = create_pool(database or os.path.join(tempfile.mkdtemp(), 'loadtest.db'), max_size=threads)
+    run_migrations(pool, migrations_for(pool, USERS_MIGRATIONS, SERVER_USERS_MIGRATIONS))
+    event_id = str(uuid.uuid4())
+    with pool.transaction() as conn:
+        conn.execute('''
+            INSERT INTO events (event_id, title, date, place, admin_id, max_participants)
+            VALUES (?, 'Beach drive', '2030-01-01', 'Beach', 1, ?)
+        ''', (event_id, capacity))
+
+    outcomes = {'joined': 0, 'already_joined': 0, 'waitlisted': 0, 'full': 0, 'left': 0, 'errors': 0}
+    latencies = []
+
+    def volunteer(i):
+        # Some volunteers retry their join, some drop out again
+        user_id = random.randint(2, requests // 2 + 2)
+        start = time.perf_counter()
+        try:
+            if i % 10 == 0:
+                result = leave_event(pool, event_id, user_id)
+                status = 'left' if result['status'] == 'left' else None
+            else:
+                status = join_event(pool, event_id, user_id, waitlist=waitlist)['status']
+        except EventFull:
+            status = 'full'
+        except Exception as e:
+            logger.error(f"Load test request failed: {e}")
+            status = 'errors'
+        return status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for status, latency in executor.map(volunteer, range(requests)):
+            if status:
+                outcomes[status] += 1
+            latencies.append(latency)
+    elapsed = time.perf_counter() - start
+
+    with pool.connection() as conn:
+        seats = _seats(conn, event_id)
+        rows = conn.execute('SELECT COUNT(*) FROM event_participants WHERE event_id = ?', (event_id,)).fetchone()[0]
+        distinct = conn.execute(
+            'SELECT COUNT(DISTINCT user_id) FROM event_participants WHERE event_id = ?', (event_id,)
+        ).fetchone()[0]
+        waiting = conn.execute('SELECT COUNT(*) FROM event_waitlist WHERE event_id = ?', (event_id,)).fetchone()[0]
+    pool.close_all()
+
+    latencies.sort()
+    report = {
+        'requests': requests,
+        'threads': threads,
+        'capacity': capacity,
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(requests / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        'outcomes': outcomes,
+        'participants': rows,
+        'current_participants': seats['current_participants'],
+        'waitlisted': waiting,
+    }
+    assert rows <= capacity, f'overbooked: {rows} participants for {capacity} seats'
+    assert rows == distinct, 'duplicate joins recorded'
+    assert rows == seats['current_participants'], 'current_participants drifted from the participant rows'
+    return report
+
+
+if __name__ == '__main__':
+    # python participation.py [requests] [capacity] [threads] [database url]
+    import sys
+
+    args = [int(a) for a in sys.argv[1:4]]
+    print(load_test(*args, database=sys.argv[4] if len(sys.argv) > 4 else None))
@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# scrypt cost parameters; raise N as hardware allows. Memory used per hash is ~128 * N * r bytes.
+SCRYPT_N = int(os.environ.get('SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', 1))
+SCRYPT_DKLEN = 32
+SALT_BYTES = 16
+
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# The pool is started from inside a threaded server, where a plain fork can
+# copy a lock some other thread holds into the worker
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# Unknown accounts are checked against this so they cost as much as known ones
+DUMMY_SALT = bytes(SALT_BYTES)
+
+SCHEME = 'scrypt'
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def _scrypt(password, salt, n, r, p, dklen):
+    # Runs in a worker process
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=dklen, maxmem=256 * n * r + 1024 * 1024
+    )
+
+
+def is_legacy_hash(stored):
+    return len(stored) == 64 and all(c in '0123456789abcdef' for c in stored)
+
+
+class PasswordHasher:
+    """scrypt password hashing in a bounded process pool.
+
+    Hashes are stored as scrypt$n$r$p$salt$key so cost parameters can be
+    raised later; older hashes keep verifying and are flagged by
+    needs_rehash(). Bare sha256 hex digests from the first version of the
+    app are still accepted.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.workers = workers
+        self.n = n
+        self.r = r
+        self.p = p
+        self._executor = None
+        self._lock = threading.Lock()
+        # Caps work handed to the pool; callers beyond this wait for a free slot
+        self._slots = threading.BoundedSemaphore(workers * 4)
+        self._metrics = {
+            'hashes': 0, 'verifications': 0, 'legacy_verifications': 0, 'dummy_verifications': 0,
+            'kdf_seconds': 0.0,
+        }
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(START_METHOD)
+                )
+            return self._executor
+
+    def _kdf(self, password, salt, n, r, p, dklen=SCRYPT_DKLEN):
+        start = time.perf_counter()
+        with self._slots:
+            try:
+                key = self._pool().submit(_scrypt, password, salt, n, r, p, dklen).result()
+            except BrokenProcessPool:
+                logger.error("Password hash pool died, restarting it")
+                with self._lock:
+                    self._executor = None
+                key = self._pool().submit(_scrypt, password, salt, n, r, p, dklen).result()
+        with self._lock:
+            self._metrics['kdf_seconds'] += time.perf_counter() - start
+        return key
+
+    def hash(self, password):
+        salt = secrets.token_bytes(SALT_BYTES)
+        key = self._kdf(password, salt, self.n, self.r, self.p)
+        with self._lock:
+            self._metrics['hashes'] += 1
+        return f"{SCHEME}${self.n}${self.r}${self.p}${_b64(salt)}${_b64(key)}"
+
+    def verify(self, password, stored):
+        if not stored:
+            return False
+        if is_legacy_hash(stored):
+            with self._lock:
+                self._metrics['legacy_verifications'] += 1
+            return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+        try:
+            scheme, n, r, p, salt, key = stored.split('$')
+            if scheme != SCHEME:
+                return False
+            n, r, p = int(n), int(r), int(p)
+            salt, key = _unb64(salt), _unb64(key)
+        except ValueError:
+            return False
+
+        candidate = self._kdf(password, salt, n, r, p, len(key))
+        with self._lock:
+            self._metrics['verifications'] += 1
+        return hmac.compare_digest(candidate, key)
+
+    def verify_missing(self, password):
+        """Do a verify's worth of work for an account that doesn't exist, and fail.
+
+        Without it a login for an unknown email returns at once and one for a
+        known email waits on scrypt, which tells callers which emails exist.
+        """
+        self._kdf(password, DUMMY_SALT, self.n, self.r, self.p)
+        with self._lock:
+            self._metrics['dummy_verifications'] += 1
+        return False
+
+    def needs_rehash(self, stored):
+        if is_legacy_hash(stored):
+            return True
+        try:
+            scheme, n, r, p, _, _ = stored.split('$')
+        except ValueError:
+            return True
+        return scheme != SCHEME or (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+        kdf_calls = m['hashes'] + m['verifications'] + m['dummy_verifications']
+        return {
+            **m,
+            'workers': self.workers,
+            'params': {'n': self.n, 'r': self.r, 'p': self.p},
+            'avg_kdf_ms': round(m['kdf_seconds'] * 1000 / kdf_calls, 2) if kdf_calls else 0.0,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+def benchmark(logins=200, workers=HASH_WORKERS, threads=16):
+    """Measure verify() throughput the way concurrent logins would drive it."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    hasher = PasswordHasher(workers=workers)
+    stored = hasher.hash('correct horse battery staple')
+    hasher.verify('warm up', stored)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: hasher.verify('correct horse battery staple', stored), range(logins)))
+    elapsed = time.perf_counter() - start
+    hasher.shutdown()
+
+    assert all(results)
+    rate = logins / elapsed
+    return {
+        'params': {'n': hasher.n, 'r': hasher.r, 'p': hasher.p},
+        'workers': workers,
+        'logins': logins,
+        'seconds': round(elapsed, 3),
+        'logins_per_second': round(rate, 1),
+        'logins_per_second_per_core': round(rate / workers, 1),
+    }
+
+
+if __name__ == '__main__':
+    # python passwords.py [logins] - login throughput per core for the current cost parameters
+    import sys
+
+    print(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,278 @@
+import cProfile
+import hmac
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Requests are profiled when they carry `X-Profile: <PROFILE_TOKEN>`, or when
+# an admin turns on sampling for some routes. Results land in PROFILE_DIR,
+# which is pruned oldest-first to stay under both limits.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', 100 * 1024 * 1024))
+PROFILE_HEADER = 'X-Profile'
+PROFILE_FORMAT_HEADER = 'X-Profile-Format'
+
+# pstats: cProfile, exact call counts, but every call pays the hook.
+# collapsed: stacks sampled every SAMPLE_INTERVAL from a side thread, in the
+# `frame;frame;frame count` form flame graph tools read. Cheap enough to leave
+# on for a sampled fraction of traffic.
+FORMATS = {'pstats': '.pstats', 'collapsed': '.collapsed'}
+DEFAULT_FORMAT = 'collapsed'
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+MAX_STACK_DEPTH = 128
+
+PROFILE_NAME = re.compile(r'^[0-9]{8}T[0-9]{6}-[A-Z]+-[\w.-]+-[0-9a-f]{8}\.(pstats|collapsed)$')
+
+
+class ProfilingError(ValueError):
+    pass
+
+
+class ProfileStore:
+    """Bounded directory of profile files."""
+
+    def __init__(self, folder=PROFILE_DIR, max_files=PROFILE_MAX_FILES, max_bytes=PROFILE_MAX_BYTES):
+        self.folder = folder
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def new_name(self, method, route, fmt):
+        slug = re.sub(r'[^\w.-]+', '_', route.strip('/')).strip('_')[:60] or 'root'
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        return f'{stamp}-{method}-{slug}-{uuid.uuid4().hex[:8]}{FORMATS[fmt]}'
+
+    def write(self, name, write):
+        """Write a profile via write(path); written to a temp name, then renamed into place."""
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, name)
+        tmp_path = os.path.join(self.folder, f'.{name}.tmp')
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.prune()
+        return path
+
+    def list(self):
+        if not os.path.isdir(self.folder):
+            return []
+        profiles = []
+        for entry in os.scandir(self.folder):
+            if not PROFILE_NAME.match(entry.name):
+                continue
+            st = entry.stat()
+            profiles.append({
+                'name': entry.name,
+                'format': entry.name.rsplit('.', 1)[1],
+                'size': st.st_size,
+                'created_at': datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat(),
+            })
+        profiles.sort(key=lambda p: (p['created_at'], p['name']), reverse=True)
+        return profiles
+
+    def resolve(self, name):
+        """Path to a stored profile, or None; names are matched, never joined blindly."""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.folder, name)
+        return path if os.path.isfile(path) else None
+
+    def prune(self):
+        with self._lock:
+            profiles = self.list()[::-1]
+            total = sum(p['size'] for p in profiles)
+            while profiles and (len(profiles) > self.max_files or total > self.max_bytes):
+                oldest = profiles.pop(0)
+                total -= oldest['size']
+                try:
+                    os.remove(os.path.join(self.folder, oldest['name']))
+                except FileNotFoundError:
+                    pass
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a timer and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def write(self, path):
+        with open(path, 'w') as out:
+            for stack, count in self.stacks.most_common():
+                out.write(f'{stack} {count}\n')
+
+
+class ProfileSession:
+    def __init__(self, store, name, fmt):
+        self.store = store
+        self.name = name
+        self.format = fmt
+        self.started = time.perf_counter()
+        if fmt == 'pstats':
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = StackSampler(threading.get_ident())
+            self._profiler.start()
+
+    def finish(self):
+        if self.format == 'pstats':
+            self._profiler.disable()
+            write = lambda path: pstats.Stats(self._profiler).dump_stats(path)
+        else:
+            self._profiler.stop()
+            write = self._profiler.write
+        elapsed = time.perf_counter() - self.started
+        try:
+            self.store.write(self.name, write)
+        except OSError as e:
+            logger.warning(f"Could not write profile {self.name}: {e}")
+            return None
+        logger.info(f"Profiled request in {elapsed * 1000:.0f} ms -> {self.name}")
+        return self.name
+
+
+class RequestProfiler:
+    """Decides which requests to profile and runs them under a profiler.
+
+    A request is profiled if it presents the PROFILE_TOKEN header, or if
+    sampling is on and its route matches. Sampling is an admin toggle
+    (configure()) with an optional budget, so it switches itself off after
+    `remaining` profiles.
+    """
+
+    def __init__(self, store, token=PROFILE_TOKEN):
+        self.store = store
+        self.token = token
+        self._lock = threading.Lock()
+        self._active = 0
+        self._pstats_active = False
+        self._config = {'sample_rate': 0.0, 'routes': [], 'remaining': None, 'format': DEFAULT_FORMAT}
+        self._metrics = {'profiled': 0, 'by_header': 0, 'sampled': 0, 'rejected_tokens': 0, 'write_errors': 0}
+
+    def configure(self, sample_rate=None, routes=None, remaining=None, fmt=None):
+        with self._lock:
+            config = dict(self._config)
+        if sample_rate is not None:
+            try:
+                sample_rate = float(sample_rate)
+            except (TypeError, ValueError):
+                raise ProfilingError('sample_rate must be a number')
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ProfilingError('sample_rate must be between 0 and 1')
+            config['sample_rate'] = sample_rate
+        if routes is not None:
+            if not isinstance(routes, list) or not all(isinstance(r, str) for r in routes):
+                raise ProfilingError('routes must be a list of route rules or path prefixes')
+            config['routes'] = routes
+        if remaining is not None:
+            if not isinstance(remaining, int) or remaining < 0:
+                raise ProfilingError('remaining must be a non-negative integer')
+            config['remaining'] = remaining
+        if fmt is not None:
+            if fmt not in FORMATS:
+                raise ProfilingError(f"format must be one of: {', '.join(FORMATS)}")
+            config['format'] = fmt
+        with self._lock:
+            self._config = config
+        return config
+
+    def _matches(self, routes, rule, path):
+        return not routes or any(r == rule or path.startswith(r) for r in routes)
+
+    def choose(self, rule, path, header_token, header_format):
+        """Return the profile format for this request, or None to leave it alone."""
+        if header_token:
+            if self.token and hmac.compare_digest(header_token, self.token):
+                fmt = header_format if header_format in FORMATS else DEFAULT_FORMAT
+                with self._lock:
+                    self._metrics['by_header'] += 1
+                return fmt
+            with self._lock:
+                self._metrics['rejected_tokens'] += 1
+        with self._lock:
+            config = self._config
+            if config['sample_rate'] <= 0 or config['remaining'] == 0:
+                return None
+            if not self._matches(config['routes'], rule, path) or random.random() >= config['sample_rate']:
+                return None
+            if config['remaining'] is not None:
+                config['remaining'] -= 1
+            self._metrics['sampled'] += 1
+            return config['format']
+
+    def start(self, method, rule, fmt):
+        with self._lock:
+            self._active += 1
+            if fmt == 'pstats':
+                # cProfile hooks are process-wide on newer Pythons; one at a time
+                if self._pstats_active:
+                    fmt = 'collapsed'
+                else:
+                    self._pstats_active = True
+        return ProfileSession(self.store, self.store.new_name(method, rule, fmt), fmt)
+
+    def finish(self, session):
+        try:
+            name = session.finish()
+        finally:
+            with self._lock:
+                self._active -= 1
+                if session.format == 'pstats':
+                    self._pstats_active = False
+        with self._lock:
+            if name:
+                self._metrics['profiled'] += 1
+            else:
+                self._metrics['write_errors'] += 1
+        return name
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._config,
+                'header_enabled': bool(self.token),
+                'active': self._active,
+                **self._metrics,
+                'folder': self.store.folder,
+                'max_files': self.store.max_files,
+                'max_bytes': self.store.max_bytes,
+            }
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUIZ_CACHE_TTL = 7 * 24 * 3600   # seconds a generated quiz stays servable
+QUIZ_CACHE_MEMORY_ENTRIES = 256  # hot entries kept in process
+QUIZ_CACHE_MAX_ROWS = 5000       # entries kept in SQLite
+
+QUIZ_CACHE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS quiz_cache (
+        cache_key TEXT PRIMARY KEY,
+        context TEXT NOT NULL,
+        num_questions INTEGER NOT NULL,
+        quiz TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL,
+        last_used REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_quiz_cache_last_used ON quiz_cache (last_used)',
+    'CREATE INDEX IF NOT EXISTS idx_quiz_cache_expires_at ON quiz_cache (expires_at)',
+]
+
+
+def normalize_context(context):
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', context.lower())).strip()
+
+
+def quiz_cache_key(context, num_questions):
+    raw = f"{normalize_context(context)}|{num_questions}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class QuizCache:
+    """Two-tier cache of generated quizzes: an in-process LRU over a SQLite table.
+
+    Both tiers honour the same TTL. The memory tier is bounded by entry count,
+    the SQLite tier by row count (least recently used rows go first).
+    """
+
+    def __init__(self, pool, ttl=QUIZ_CACHE_TTL, memory_entries=QUIZ_CACHE_MEMORY_ENTRIES,
+                 max_rows=QUIZ_CACHE_MAX_ROWS):
+        self.pool = pool
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_rows = max_rows
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _remember(self, key, quiz, expires_at, context):
+        with self._lock:
+            self._memory[key] = (expires_at, quiz, context)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def get(self, context, num_questions):
+        key = quiz_cache_key(context, num_questions)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+
+        with self.pool.connection() as conn:
+            row = conn.execute(
+                'SELECT quiz, expires_at FROM quiz_cache WHERE cache_key = ? AND expires_at > ?',
+                (key, now)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    'UPDATE quiz_cache SET hits = hits + 1, last_used = ? WHERE cache_key = ?',
+                    (now, key)
+                )
+                conn.commit()
+
+        if not row:
+            self._count('misses')
+            return None
+
+        quiz = json.loads(row['quiz'])
+        self._remember(key, quiz, row['expires_at'], normalize_context(context))
+        self._count('db_hits')
+        return quiz
+
+    def put(self, context, num_questions, quiz):
+        key = quiz_cache_key(context, num_questions)
+        now = time.time()
+        expires_at = now + self.ttl
+
+        with self.pool.connection() as conn:
+            conn.execute('''
+                INSERT INTO quiz_cache
+                    (cache_key, context, num_questions, quiz, created_at, expires_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    quiz = excluded.quiz, created_at = excluded.created_at,
+                    expires_at = excluded.expires_at, last_used = excluded.last_used, hits = 0
+            ''', (key, normalize_context(context), num_questions, json.dumps(quiz), now, expires_at, now))
+            evicted = conn.execute('DELETE FROM quiz_cache WHERE expires_at <= ?', (now,)).rowcount
+            # By key, so exactly max_rows survive even when last_used ties;
+            # LIMIT with a huge bound is the form both SQLite and PostgreSQL take
+            evicted += conn.execute('''
+                DELETE FROM quiz_cache WHERE cache_key IN (
+                    SELECT cache_key FROM quiz_cache
+                    ORDER BY last_used DESC, cache_key LIMIT 9223372036854775807 OFFSET ?
+                )
+            ''', (self.max_rows,)).rowcount
+            conn.commit()
+
+        self._remember(key, quiz, expires_at, normalize_context(context))
+        self._count('stores')
+        if evicted:
+            self._count('evictions', evicted)
+
+    def purge(self, context=None, num_questions=None):
+        """Drop one entry (context + num_questions), every entry for a context, or everything."""
+        if context is None and num_questions is not None:
+            raise ValueError('num_questions needs a context')
+        with self.pool.connection() as conn:
+            if context is not None and num_questions is not None:
+                key = quiz_cache_key(context, num_questions)
+                removed = conn.execute('DELETE FROM quiz_cache WHERE cache_key = ?', (key,)).rowcount
+                with self._lock:
+                    self._memory.pop(key, None)
+            elif context is not None:
+                normalized = normalize_context(context)
+                removed = conn.execute('DELETE FROM quiz_cache WHERE context = ?', (normalized,)).rowcount
+                with self._lock:
+                    for key in [k for k, entry in self._memory.items() if entry[2] == normalized]:
+                        del self._memory[key]
+            else:
+                removed = conn.execute('DELETE FROM quiz_cache').rowcount
+                with self._lock:
+                    self._memory.clear()
+            conn.commit()
+        return removed
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            rows = conn.execute('SELECT COUNT(*) FROM quiz_cache').fetchone()[0]
+        with self._lock:
+            counters = dict(self._counters)
+            memory_size = len(self._memory)
+        hits = counters['memory_hits'] + counters['db_hits']
+        lookups = hits + counters['misses']
+        return {
+            **counters,
+            'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+            'memory_entries': memory_size,
+            'db_entries': rows,
+            'ttl_seconds': self.ttl,
+        }
@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from quiz_cache import normalize_context
+
+logger = logging.getLogger(__name__)
+
+QUIZ_POOL_TOPICS = [
+    t.strip() for t in os.environ.get(
+        'QUIZ_POOL_TOPICS', 'plastic bottle,cigarette butt,styrofoam,plastic bag,aluminum can'
+    ).split(',') if t.strip()
+]
+QUIZ_POOL_SIZE = int(os.environ.get('QUIZ_POOL_SIZE', 3))   # ready quizzes kept per topic
+QUIZ_POOL_QUESTIONS = 5                                     # questions per pooled quiz
+QUIZ_POOL_POLL_INTERVAL = 5.0
+QUIZ_POOL_MAX_BACKOFF = 300
+
+
+class QuizPool:
+    """Keeps a few ready-made quizzes per configured topic.
+
+    A daemon thread fills the pools while the model server is idle and
+    refills a topic as soon as one of its quizzes is handed out. take() is a
+    dict lookup plus a deque pop.
+    """
+
+    def __init__(self, generate, is_idle, topics=QUIZ_POOL_TOPICS, size=QUIZ_POOL_SIZE,
+                 num_questions=QUIZ_POOL_QUESTIONS):
+        self._generate = generate
+        self._is_idle = is_idle
+        self.size = size
+        self.num_questions = num_questions
+        self._pools = {normalize_context(t): deque() for t in topics}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self._metrics = {'hits': 0, 'misses': 0, 'generated': 0, 'failures': 0}
+
+    def take(self, context, num_questions):
+        pool = self._pools.get(normalize_context(context))
+        if pool is None or num_questions > self.num_questions:
+            return None
+        with self._lock:
+            quiz = pool.popleft() if pool else None
+            self._metrics['hits' if quiz else 'misses'] += 1
+        if quiz is None:
+            return None
+        self._wake.set()
+        return quiz[:num_questions]
+
+    def _neediest_topic(self):
+        with self._lock:
+            topic, pool = min(self._pools.items(), key=lambda item: len(item[1]), default=(None, None))
+            if pool is None or len(pool) >= self.size:
+                return None
+            return topic
+
+    def _fill_once(self):
+        topic = self._neediest_topic()
+        if topic is None or not self._is_idle():
+            return False
+        try:
+            quiz = self._generate(topic, self.num_questions)
+            if len(quiz) < self.num_questions:
+                raise ValueError(f'model returned {len(quiz)} of {self.num_questions} questions')
+        except Exception as e:
+            self._failures += 1
+            with self._lock:
+                self._metrics['failures'] += 1
+            logger.warning(f"Quiz pool refill for '{topic}' failed: {e}")
+            return False
+        self._failures = 0
+        with self._lock:
+            pool = self._pools[topic]
+            if len(pool) < self.size:
+                pool.append(quiz)
+                self._metrics['generated'] += 1
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._fill_once():
+                continue
+            backoff = min(QUIZ_POOL_MAX_BACKOFF, QUIZ_POOL_POLL_INTERVAL * 2 ** min(self._failures, 16))
+            self._wake.wait(backoff)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread or not self._pools:
+            return
+        self._thread = threading.Thread(target=self._run, name='quiz-pool', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._metrics,
+                'size_per_topic': self.size,
+                'ready': {topic: len(pool) for topic, pool in self._pools.items()},
+            }
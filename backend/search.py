@@ -0,0 +1,333 @@
+import html
+import re
+import unicodedata
+
+SEARCH_MAX_TERMS = 8
+MAX_SEARCH_OFFSET = 1000          # deeper pages should narrow the query instead
+SNIPPET_WORDS = 24
+MIN_PREFIX_LENGTH = 2             # single letters would expand to most of the vocabulary
+
+# Column weights for title, description and place
+SEARCH_WEIGHTS = (10.0, 1.0, 4.0)
+
+TERM = re.compile(r'[^\W_]+')
+
+# External-content index over users.db events: only the token index is stored,
+# the text stays in events
+SEARCH_SCHEMA = [
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+        title, description, place,
+        content='events', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_fts_insert AFTER INSERT ON events
+    BEGIN
+        INSERT INTO events_fts (rowid, title, description, place)
+        VALUES (NEW.id, NEW.title, NEW.description, NEW.place);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_fts_delete AFTER DELETE ON events
+    BEGIN
+        INSERT INTO events_fts (events_fts, rowid, title, description, place)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.place);
+    END
+    ''',
+    # Seat counts and status change far more often than the text; leave the index alone then
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_fts_update AFTER UPDATE OF title, description, place ON events
+    BEGIN
+        INSERT INTO events_fts (events_fts, rowid, title, description, place)
+        VALUES ('delete', OLD.id, OLD.title, OLD.description, OLD.place);
+        INSERT INTO events_fts (rowid, title, description, place)
+        VALUES (NEW.id, NEW.title, NEW.description, NEW.place);
+    END
+    ''',
+    "INSERT INTO events_fts (events_fts) VALUES ('rebuild')",
+]
+
+# Server databases (PostgreSQL) keep a weighted tsvector per event in a side
+# table, maintained by a trigger like events_fts. Unlike FTS5 here, accents are
+# not folded ('cafe' won't find 'café').
+SERVER_SEARCH_DOCUMENT = '''
+    setweight(to_tsvector('simple', NEW.title), 'A') ||
+    setweight(to_tsvector('simple', NEW.place), 'B') ||
+    setweight(to_tsvector('simple', COALESCE(NEW.description, '')), 'D')
+'''
+
+SERVER_SEARCH_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS events_search (
+        id BIGINT PRIMARY KEY,
+        document TSVECTOR NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_events_search_document ON events_search USING GIN (document)',
+    f'''
+    CREATE OR REPLACE FUNCTION events_search_sync() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            DELETE FROM events_search WHERE id = OLD.id;
+        ELSE
+            INSERT INTO events_search (id, document) VALUES (NEW.id, {SERVER_SEARCH_DOCUMENT})
+            ON CONFLICT (id) DO UPDATE SET document = excluded.document;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS trg_events_search ON events',
+    '''
+    CREATE TRIGGER trg_events_search
+    AFTER INSERT OR DELETE OR UPDATE OF title, description, place ON events
+    FOR EACH ROW EXECUTE FUNCTION events_search_sync()
+    ''',
+    f'''
+    INSERT INTO events_search (id, document)
+    SELECT id, {SERVER_SEARCH_DOCUMENT.replace('NEW.', '')} FROM events
+    ON CONFLICT (id) DO NOTHING
+    ''',
+]
+
+
+class SearchError(ValueError):
+    pass
+
+
+def fold(word):
+    # Case and accents are ignored, as by the unicode61 tokenizer with remove_diacritics
+    decomposed = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def search_terms(text):
+    terms = [fold(term) for term in TERM.findall(text or '')][:SEARCH_MAX_TERMS]
+    if not terms:
+        raise SearchError('Search text must contain at least one word')
+    return terms
+
+
+def _is_prefix(term, prefix):
+    return prefix and len(term) >= MIN_PREFIX_LENGTH
+
+
+def fts5_query(terms, prefix=True):
+    # Each term is quoted, so FTS5 operators typed by users are matched as plain words
+    return ' '.join(f'"{term}"*' if _is_prefix(term, prefix) else f'"{term}"' for term in terms)
+
+
+def tsquery(terms, prefix=True):
+    return ' & '.join(f"'{term}':*" if _is_prefix(term, prefix) else f"'{term}'" for term in terms)
+
+
+def highlight(text, terms, prefix=True, window=None):
+    """HTML-escape text and wrap words matching the terms in <mark>.
+
+    With window, the text is cut to that many words around the densest run
+    of matches, with an ellipsis where it was cut. Only the page of results
+    is highlighted, so this stays off the ranking path.
+    """
+    if not text:
+        return text
+    words = list(TERM.finditer(text))
+    hits = [
+        i for i, word in enumerate(words)
+        if any(fold(word.group()) == term or (_is_prefix(term, prefix) and fold(word.group()).startswith(term))
+               for term in terms)
+    ]
+
+    first, last = 0, len(words)
+    if window and len(words) > window:
+        starts = [min(max(0, hit - 2), len(words) - window) for hit in hits] or [0]
+        first = max(starts, key=lambda start: sum(start <= hit < start + window for hit in hits))
+        last = first + window
+    begin = words[first].start() if first else 0
+    end = words[last - 1].end() if last < len(words) else len(text)
+
+    out = ['…' if begin else '']
+    position = begin
+    for i in hits:
+        if first <= i < last:
+            word = words[i]
+            out.append(html.escape(text[position:word.start()]))
+            out.append(f'<mark>{html.escape(word.group())}</mark>')
+            position = word.end()
+    out.append(html.escape(text[position:end]))
+    out.append('…' if end < len(text) else '')
+    return ''.join(out)
+
+
+def _search_sql(pool, status):
+    # Rank and cut the page on ids alone, then read just those rows
+    if pool.dialect == 'sqlite':
+        weights = ', '.join(map(str, SEARCH_WEIGHTS))
+        ranked = f'''
+            SELECT f.rowid AS id, -bm25(events_fts, {weights}) AS score
+            FROM events_fts f
+            {'JOIN events s ON s.id = f.rowid' if status else ''}
+            WHERE events_fts MATCH ?{' AND s.status = ?' if status else ''}
+            ORDER BY score DESC
+            LIMIT ? OFFSET ?
+        '''
+    else:
+        ranked = f'''
+            SELECT f.id, ts_rank(f.document, to_tsquery('simple', ?)) AS score
+            FROM events_search f
+            {'JOIN events s ON s.id = f.id' if status else ''}
+            WHERE f.document @@ to_tsquery('simple', ?){' AND s.status = ?' if status else ''}
+            ORDER BY score DESC, f.id
+            LIMIT ? OFFSET ?
+        '''
+    return f'''
+        SELECT e.*, u.name AS admin_name, page.score
+        FROM ({ranked}) page
+        JOIN events e ON e.id = page.id
+        LEFT JOIN users u ON u.id = e.admin_id
+        ORDER BY page.score DESC, e.id
+    '''
+
+
+def search_events(pool, text, status=None, limit=20, offset=0, prefix=True):
+    """Ranked full-text search over event title, description and place.
+
+    Title matches weigh most, then place, then description. With prefix=True
+    every term of two or more letters also matches longer words, for search
+    as you type. Returns (results, next_offset); each result is
+    {'event': row, 'highlight': {...}, 'score'}.
+    """
+    terms = search_terms(text)
+    if offset < 0 or offset > MAX_SEARCH_OFFSET:
+        raise SearchError(f'offset must be between 0 and {MAX_SEARCH_OFFSET}')
+
+    if pool.dialect == 'sqlite':
+        query = (fts5_query(terms, prefix),)
+    else:
+        query = (tsquery(terms, prefix),) * 2
+    params = (*query, *([status] if status else []), limit + 1, offset)
+    with pool.connection() as conn:
+        rows = conn.execute(_search_sql(pool, status), params).fetchall()
+
+    next_offset = offset + limit if len(rows) > limit and offset + limit <= MAX_SEARCH_OFFSET else None
+    results = []
+    for row in rows[:limit]:
+        event = dict(row)
+        score = event.pop('score')
+        results.append({
+            'event': event,
+            'highlight': {
+                'title': highlight(event['title'], terms, prefix),
+                'description': highlight(event['description'], terms, prefix, window=SNIPPET_WORDS),
+                'place': highlight(event['place'], terms, prefix),
+            },
+            'score': round(score, 4),
+        })
+    return results, next_offset
+
+
+def benchmark(rows=1_000_000, queries=50, database=None):
+    """Seed a scratch database with synthetic events and time searches against it.
+
+    Reports the seeding rate (index maintained by the triggers), the p50/p99
+    latency of each query shape, and a LIKE scan over the same rows - roughly
+    what filtering the full listing costs without the index.
+    """
+    import itertools
+    import os
+    import random
+    import tempfile
+    import time
+    import uuid
+
+    from db import create_pool
+    from migrations import SERVER_USERS_MIGRATIONS, USERS_MIGRATIONS, migrations_for, run_migrations
+
+    rng = random.Random(42)
+    places = [
+        'Juhu Beach', 'Versova Beach', 'Dadar Chowpatty', 'Girgaon Chowpatty', 'Aksa Beach',
+        'Marine Drive', 'Mahim Beach', 'Gorai Beach', 'Madh Island', 'Uttan Beach',
+        'Alibaug', 'Kashid Beach', 'Bandra Bandstand', 'Worli Seaface', 'Carter Road',
+    ]
+    themed = [
+        'cleanup', 'beach', 'plastic', 'drive', 'volunteers', 'mangrove', 'shoreline', 'waste',
+        'recycling', 'sunrise', 'weekend', 'community', 'ocean', 'turtle', 'nets', 'segregation',
+        'gloves', 'awareness', 'students', 'monsoon', 'coastal', 'microplastics', 'bottles', 'litter',
+    ]
+    # Zipf-ish filler vocabulary so some terms are common and most are rare
+    filler = [''.join(rng.choice('abcdefghiklmnoprstuvy') for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(filler))))
+
+    def words(n):
+        return rng.sample(themed, min(n, 3)) + rng.choices(filler, cum_weights=cum_weights, k=max(0, n - 3))
+
+    pool = create_pool(database or os.path.join(tempfile.mkdtemp(), 'search.db'))
+    run_migrations(pool, migrations_for(pool, USERS_MIGRATIONS, SERVER_USERS_MIGRATIONS))
+
+    start = time.perf_counter()
+    batch = 10_000
+    for first in range(0, rows, batch):
+        seeded = []
+        for _ in range(min(batch, rows - first)):
+            place = rng.choice(places)
+            title = ' '.join(words(rng.randint(3, 6))).capitalize() + f' at {place}'
+            seeded.append((
+                str(uuid.uuid4()), title, ' '.join(words(rng.randint(15, 40))) + '.',
+                f'2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}', place, 1,
+                rng.choice(('upcoming', 'upcoming', 'completed')),
+            ))
+        with pool.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO events (event_id, title, description, date, place, admin_id, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', seeded)
+    seed_seconds = time.perf_counter() - start
+
+    rare = rng.sample(filler[2000:], queries)
+    shapes = {
+        'common_term': lambda i: dict(text='cleanup'),
+        'rare_term': lambda i: dict(text=rare[i]),
+        'place_phrase': lambda i: dict(text=rng.choice(places)),
+        'prefix': lambda i: dict(text=rng.choice(themed)[:3]),
+        'multi_term': lambda i: dict(text=f'{rng.choice(themed)} {rng.choice(themed)} {rare[i]}'),
+        'status_filter': lambda i: dict(text=rng.choice(themed), status='completed'),
+        'deep_page': lambda i: dict(text=rng.choice(themed), offset=MAX_SEARCH_OFFSET - 20),
+    }
+
+    def timed(fn, n=queries):
+        latencies = []
+        for i in range(n):
+            t = time.perf_counter()
+            fn(i)
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        return {
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+        }
+
+    report = {'rows': rows, 'backend': pool.dialect, 'seed_rows_per_second': round(rows / seed_seconds)}
+    for name, args in shapes.items():
+        report[name] = timed(lambda i: search_events(pool, **args(i)))
+
+    def like_scan(i):
+        with pool.connection() as conn:
+            pattern = f'%{rare[i]}%'
+            conn.execute(
+                'SELECT * FROM events WHERE title LIKE ? OR description LIKE ? OR place LIKE ?',
+                (pattern, pattern, pattern)
+            ).fetchall()
+
+    report['like_scan_rare_term'] = timed(like_scan, min(queries, 5))
+    pool.close_all()
+    return report
+
+
+if __name__ == '__main__':
+    # python search.py [rows] [queries per shape] [database url]
+    import sys
+
+    args = [int(a) for a in sys.argv[1:3]]
+    print(benchmark(*args, database=sys.argv[3] if len(sys.argv) > 3 else None))
@@ -0,0 +1,278 @@
+import functools
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    from sqlalchemy import create_engine
+    from sqlalchemy.exc import TimeoutError as SATimeoutError
+except ImportError:  # only needed when DATABASE_URL points at a server database
+    create_engine = None
+
+from db import POOL_SIZE, POOL_TIMEOUT, PoolTimeout
+from metrics import METRICS_ENABLED, timed
+
+logger = logging.getLogger(__name__)
+
+SERVER_POOL_OVERFLOW = 4      # extra connections allowed past max_size under bursts
+SERVER_POOL_RECYCLE = 1800    # seconds; drop connections before server/proxy idle timeouts
+STREAM_ITERSIZE = 1000        # rows per round trip when iterating a server-side cursor
+
+
+@functools.lru_cache(maxsize=1024)
+def to_pyformat(sql):
+    """Rewrite qmark placeholders to %s, leaving quoted literals alone."""
+    out = []
+    quote = None
+    for ch in sql:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == '?':
+            out.append('%s')
+            continue
+        elif ch == '%':
+            out.append('%%')
+            continue
+        out.append(ch)
+    return ''.join(out)
+
+
+class Row:
+    """Row addressable by column name or position, like sqlite3.Row."""
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def keys(self):
+        return list(self._index)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f'Row({dict(zip(self._index, self._values))!r})'
+
+
+class ServerCursor:
+    def __init__(self, conn, name=None):
+        self._conn = conn
+        if name:
+            # Server-side (named) cursor: rows are fetched in batches as they
+            # are read instead of the whole result landing in client memory
+            self._cursor = conn.raw.cursor(name=name)
+            if hasattr(self._cursor, 'itersize'):
+                self._cursor.itersize = STREAM_ITERSIZE
+        else:
+            self._cursor = conn.raw.cursor()
+        self._index = None
+        self._insert = False
+
+    def execute(self, sql, params=()):
+        self._insert = sql.lstrip()[:6].upper() == 'INSERT'
+        self._index = None
+        self._conn.run(self._cursor, sql, params)
+        return self
+
+    def _columns(self):
+        # A named cursor only has a description once the first rows are fetched
+        if self._index is None and self._cursor.description:
+            self._index = {column[0]: i for i, column in enumerate(self._cursor.description)}
+        return self._index
+
+    def executemany(self, sql, seq_of_params):
+        self._conn.in_transaction = True
+        params = list(seq_of_params)
+        if METRICS_ENABLED:
+            timed(self._conn.label, sql, lambda: self._cursor.executemany(to_pyformat(sql), params))
+        else:
+            self._cursor.executemany(to_pyformat(sql), params)
+        return self
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return Row(self._columns(), row) if row is not None else None
+
+    def fetchmany(self, size):
+        rows = self._cursor.fetchmany(size)
+        index = self._columns()
+        return [Row(index, row) for row in rows]
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        index = self._columns()
+        return [Row(index, row) for row in rows]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        # Serial ids come from the sequence the INSERT just advanced
+        if not self._insert:
+            return None
+        cursor = self._conn.raw.cursor()
+        cursor.execute('SELECT lastval()')
+        return cursor.fetchone()[0]
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+
+class ServerConnection:
+    """DB-API connection wrapper that accepts the same SQL as the SQLite pool."""
+
+    def __init__(self, raw, label=''):
+        self.raw = raw
+        self.label = label
+        self.in_transaction = False
+
+    def run(self, cursor, sql, params):
+        if sql.strip().upper() in ('BEGIN', 'BEGIN IMMEDIATE'):
+            # The driver opens a transaction on the next statement anyway
+            self.in_transaction = True
+            return
+        self.in_transaction = True
+        if METRICS_ENABLED:
+            timed(self.label, sql, lambda: self._run(cursor, sql, params))
+        else:
+            self._run(cursor, sql, params)
+
+    def _run(self, cursor, sql, params):
+        if params:
+            cursor.execute(to_pyformat(sql), tuple(params))
+        else:
+            cursor.execute(sql)
+
+    def execute(self, sql, params=()):
+        return ServerCursor(self).execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return ServerCursor(self).executemany(sql, seq_of_params)
+
+    def cursor(self):
+        return ServerCursor(self)
+
+    def stream(self, sql, params=()):
+        """Run a read whose result is consumed with fetchmany() batches."""
+        return ServerCursor(self, name=f'stream_{uuid.uuid4().hex}').execute(sql, params)
+
+    def commit(self):
+        self.raw.commit()
+        self.in_transaction = False
+
+    def rollback(self):
+        self.raw.rollback()
+        self.in_transaction = False
+
+
+class ServerPool:
+    """Pooled connections to a server database (PostgreSQL) via SQLAlchemy.
+
+    Exposes the same connection()/transaction()/stats() interface as the
+    SQLite ConnectionPool, so callers don't know which backend they're on.
+    Queries are written in the subset of SQL both accept; qmark placeholders
+    are rewritten for the driver.
+    """
+
+    dialect = 'postgresql'
+
+    def __init__(self, url, max_size=POOL_SIZE, timeout=POOL_TIMEOUT, max_overflow=SERVER_POOL_OVERFLOW):
+        if create_engine is None:
+            raise RuntimeError('SQLAlchemy and a database driver are required for DATABASE_URL')
+        self.engine = create_engine(
+            url,
+            pool_size=max_size,
+            max_overflow=max_overflow,
+            pool_timeout=timeout,
+            pool_pre_ping=True,
+            pool_recycle=SERVER_POOL_RECYCLE,
+        )
+        self.IntegrityError = self.engine.dialect.loaded_dbapi.IntegrityError
+        self.path = self.engine.url.render_as_string(hide_password=True)
+        self.name = self.engine.url.database or self.engine.url.host or 'server'
+        self.max_size = max_size
+        self.max_overflow = max_overflow
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        try:
+            raw = self.engine.raw_connection()
+        except SATimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"Timed out waiting for a connection to {self.path}")
+        with self._lock:
+            self._acquired += 1
+            self._wait_time += time.perf_counter() - start
+        return ServerConnection(raw, self.name)
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        finally:
+            # Returns the connection to SQLAlchemy's pool (or discards it if broken)
+            conn.raw.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Connection wrapped in a write transaction, committed on success."""
+        with self.connection() as conn:
+            conn.in_transaction = True
+            try:
+                yield conn
+            except Exception:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def stats(self):
+        pool = self.engine.pool
+        with self._lock:
+            return {
+                'database': self.path,
+                'max_size': self.max_size,
+                'max_overflow': self.max_overflow,
+                'in_use': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(0, pool.overflow()),
+                'acquired': self._acquired,
+                'timeouts': self._timeouts,
+                'avg_acquire_ms': round(self._wait_time * 1000 / self._acquired, 3) if self._acquired else 0.0,
+            }
+
+    def close_all(self):
+        self.engine.dispose()
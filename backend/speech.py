@@ -0,0 +1,273 @@
+import io
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import speech_recognition as sr
+
+try:
+    import vosk
+except ImportError:  # offline decoding is reported as unavailable
+    vosk = None
+
+logger = logging.getLogger(__name__)
+
+VOSK_MODEL_PATH = os.environ.get('VOSK_MODEL_PATH', 'models/vosk-model-small-en-us-0.15')
+SPEECH_WORKERS = int(os.environ.get('SPEECH_WORKERS', 2))
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+MAX_AUDIO_SECONDS = 120           # per blob or chunk
+MAX_AUDIO_BYTES = 32 * 1024 * 1024  # request body cap; 120 s of 48 kHz stereo WAV is ~23 MB
+SEGMENT_SECONDS = 4               # window size when decoding a streamed request body
+SESSION_TTL = 600                 # chunked sessions idle longer than this are dropped
+MAX_SESSIONS = 200
+
+PCM_TYPES = ('audio/l16', 'audio/pcm', 'audio/x-raw')
+# Containers speech_recognition reads itself (WAV, AIFF, FLAC). Anything else,
+# such as the WebM/Ogg Opus browsers' MediaRecorder produces, goes through
+# ffmpeg. Sniffed from the bytes: recorders often mislabel the blob type.
+NATIVE_SIGNATURES = (b'RIFF', b'FORM', b'fLaC')
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', 'ffmpeg')
+FFMPEG_TIMEOUT = 60
+
+_model = None
+
+
+class SpeechError(Exception):
+    pass
+
+
+class SpeechUnavailable(SpeechError):
+    pass
+
+
+def pcm_rate(content_type):
+    # audio/L16;rate=48000 -> 48000
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'rate' and value.isdigit():
+            return int(value)
+    return SAMPLE_RATE
+
+
+def is_pcm(content_type):
+    return content_type.split(';')[0].strip().lower() in PCM_TYPES
+
+
+def ffmpeg_to_pcm(data):
+    """Decode any container/codec ffmpeg knows (WebM, Ogg, MP4, MP3) to 16 kHz mono PCM."""
+    ffmpeg = shutil.which(FFMPEG_PATH)
+    if ffmpeg is None:
+        raise SpeechUnavailable('ffmpeg is needed to decode WebM/Ogg/MP4 audio; send WAV, FLAC or audio/L16 PCM')
+    # A file rather than a pipe: MP4 from Safari keeps its index at the end
+    with tempfile.NamedTemporaryFile(suffix='.audio') as source:
+        source.write(data)
+        source.flush()
+        try:
+            result = subprocess.run(
+                [ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', '-i', source.name,
+                 # Stop just past the limit; _decode then rejects it as too long
+                 '-t', str(MAX_AUDIO_SECONDS + 1), '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE),
+                 '-f', 's16le', 'pipe:1'],
+                capture_output=True, timeout=FFMPEG_TIMEOUT,
+            )
+        except subprocess.TimeoutExpired:
+            raise SpeechError('Timed out decoding audio')
+    if result.returncode != 0:
+        raise SpeechError('Unsupported or corrupt audio, send WAV, FLAC, WebM/Ogg Opus or audio/L16 PCM')
+    return result.stdout
+
+
+def to_pcm(data, content_type):
+    """Convert an audio blob or raw 16-bit PCM to 16 kHz mono PCM."""
+    if is_pcm(content_type):
+        audio = sr.AudioData(data, pcm_rate(content_type), SAMPLE_WIDTH)
+    elif not data.startswith(NATIVE_SIGNATURES):
+        return ffmpeg_to_pcm(data)
+    else:
+        try:
+            with sr.AudioFile(io.BytesIO(data)) as source:
+                audio = sr.Recognizer().record(source)
+        except ValueError:
+            raise SpeechError('Unsupported audio format, send WAV, AIFF, FLAC, WebM/Ogg Opus or audio/L16 PCM')
+    return audio.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=SAMPLE_WIDTH)
+
+
+def _load_model(path):
+    # Worker initializer: the model is loaded once per process, not per request
+    global _model
+    vosk.SetLogLevel(-1)
+    _model = vosk.Model(path)
+
+
+def _decode(data, content_type):
+    # Runs in a worker process
+    pcm = to_pcm(data, content_type)
+    seconds = len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+    if seconds > MAX_AUDIO_SECONDS:
+        raise SpeechError(f'Audio longer than {MAX_AUDIO_SECONDS} seconds')
+    start = time.perf_counter()
+    recognizer = vosk.KaldiRecognizer(_model, SAMPLE_RATE)
+    step = SAMPLE_RATE * SAMPLE_WIDTH // 2
+    for offset in range(0, len(pcm), step):
+        recognizer.AcceptWaveform(pcm[offset:offset + step])
+    text = json.loads(recognizer.FinalResult()).get('text', '')
+    return text, seconds, time.perf_counter() - start
+
+
+class Transcriber:
+    """Offline speech recognition (Vosk) in a bounded process pool.
+
+    Each worker loads the model once. Callers beyond the pool's backlog wait
+    for a free slot instead of piling up unbounded work.
+    """
+
+    def __init__(self, model_path=VOSK_MODEL_PATH, workers=SPEECH_WORKERS):
+        self.model_path = model_path
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._metrics = {
+            'requests': 0, 'failures': 0, 'audio_seconds': 0.0,
+            'decode_seconds': 0.0, 'latency_seconds': 0.0, 'max_latency_ms': 0.0,
+        }
+
+    @property
+    def available(self):
+        return vosk is not None and os.path.isdir(self.model_path)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=_load_model, initargs=(self.model_path,)
+                )
+            return self._executor
+
+    def transcribe(self, data, content_type):
+        """Returns {'text', 'audio_seconds', 'decode_ms', 'latency_ms'}."""
+        if not self.available:
+            raise SpeechUnavailable(f'Offline speech model not installed at {self.model_path}')
+        if not data:
+            raise SpeechError('No audio provided')
+
+        start = time.perf_counter()
+        try:
+            with self._slots:
+                try:
+                    text, seconds, decode = self._pool().submit(_decode, data, content_type).result()
+                except BrokenProcessPool:
+                    logger.error("Speech worker pool died, restarting it")
+                    with self._lock:
+                        self._executor = None
+                    text, seconds, decode = self._pool().submit(_decode, data, content_type).result()
+        except Exception:
+            with self._lock:
+                self._metrics['failures'] += 1
+            raise
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            m = self._metrics
+            m['requests'] += 1
+            m['audio_seconds'] += seconds
+            m['decode_seconds'] += decode
+            m['latency_seconds'] += latency
+            m['max_latency_ms'] = max(m['max_latency_ms'], round(latency * 1000, 1))
+        return {
+            'text': text,
+            'audio_seconds': round(seconds, 2),
+            'decode_ms': round(decode * 1000, 1),
+            'latency_ms': round(latency * 1000, 1),
+        }
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+        return {
+            'requests': m['requests'],
+            'failures': m['failures'],
+            'available': self.available,
+            'workers': self.workers,
+            'audio_seconds': round(m['audio_seconds'], 2),
+            'avg_latency_ms': round(m['latency_seconds'] * 1000 / m['requests'], 1) if m['requests'] else 0.0,
+            'max_latency_ms': m['max_latency_ms'],
+            # < 1.0 means audio is decoded faster than it was spoken
+            'real_time_factor': round(m['decode_seconds'] / m['audio_seconds'], 3) if m['audio_seconds'] else 0.0,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+class TranscriptSessions:
+    """Partial transcripts for audio uploaded in chunks.
+
+    Each chunk is decoded on its own and appended, so clients should cut
+    chunks at pauses (e.g. on silence detection) to avoid splitting words.
+    """
+
+    def __init__(self, transcriber, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.transcriber = transcriber
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session['touched'] + self.ttl > now and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def create(self):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[session_id] = {'segments': [], 'chunks': 0, 'latency_ms': 0.0, 'touched': time.monotonic()}
+            self._expire()
+        return session_id
+
+    def _get(self, session_id):
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        session['touched'] = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def append(self, session_id, data, content_type):
+        with self._lock:
+            self._get(session_id)
+        result = self.transcriber.transcribe(data, content_type)
+        with self._lock:
+            session = self._get(session_id)
+            if result['text']:
+                session['segments'].append(result['text'])
+            session['chunks'] += 1
+            session['latency_ms'] += result['latency_ms']
+            return {**result, 'partial': ' '.join(session['segments']), 'chunks': session['chunks']}
+
+    def finish(self, session_id):
+        with self._lock:
+            session = self._get(session_id)
+            del self._sessions[session_id]
+        return {
+            'text': ' '.join(session['segments']),
+            'chunks': session['chunks'],
+            'latency_ms': round(session['latency_ms'], 1),
+        }
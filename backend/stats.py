@@ -0,0 +1,253 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_INTERVAL = 3600  # seconds between background drift checks
+
+# Counters are kept in step by triggers on events/event_participants (migration 4),
+# so every write path updates them inside its own transaction.
+STATS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS dashboard_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_events INTEGER NOT NULL DEFAULT 0,
+        total_participants INTEGER NOT NULL DEFAULT 0,
+        total_waste_collected REAL NOT NULL DEFAULT 0.0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # Events per date, so the upcoming count only touches distinct future dates
+    '''
+    CREATE TABLE IF NOT EXISTS event_date_counts (
+        date TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    'INSERT OR IGNORE INTO dashboard_stats (id) VALUES (1)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_stats_insert AFTER INSERT ON events
+    BEGIN
+        UPDATE dashboard_stats
+        SET total_events = total_events + 1,
+            total_waste_collected = total_waste_collected + COALESCE(NEW.waste_collected, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1;
+        INSERT INTO event_date_counts (date, count) VALUES (NEW.date, 1)
+        ON CONFLICT (date) DO UPDATE SET count = count + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_stats_delete AFTER DELETE ON events
+    BEGIN
+        UPDATE dashboard_stats
+        SET total_events = total_events - 1,
+            total_waste_collected = total_waste_collected - COALESCE(OLD.waste_collected, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1;
+        UPDATE event_date_counts SET count = count - 1 WHERE date = OLD.date;
+        DELETE FROM event_date_counts WHERE date = OLD.date AND count <= 0;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_stats_waste AFTER UPDATE OF waste_collected ON events
+    BEGIN
+        UPDATE dashboard_stats
+        SET total_waste_collected = total_waste_collected
+                - COALESCE(OLD.waste_collected, 0) + COALESCE(NEW.waste_collected, 0),
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_events_stats_date AFTER UPDATE OF date ON events
+    WHEN OLD.date IS NOT NEW.date
+    BEGIN
+        UPDATE event_date_counts SET count = count - 1 WHERE date = OLD.date;
+        DELETE FROM event_date_counts WHERE date = OLD.date AND count <= 0;
+        INSERT INTO event_date_counts (date, count) VALUES (NEW.date, 1)
+        ON CONFLICT (date) DO UPDATE SET count = count + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_participants_stats_insert AFTER INSERT ON event_participants
+    BEGIN
+        UPDATE dashboard_stats
+        SET total_participants = total_participants + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_participants_stats_delete AFTER DELETE ON event_participants
+    BEGIN
+        UPDATE dashboard_stats
+        SET total_participants = total_participants - 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1;
+    END
+    ''',
+]
+
+
+# Same counters on a server database (PostgreSQL), maintained by trigger functions
+SERVER_STATS_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS dashboard_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        total_events BIGINT NOT NULL DEFAULT 0,
+        total_participants BIGINT NOT NULL DEFAULT 0,
+        total_waste_collected DOUBLE PRECISION NOT NULL DEFAULT 0.0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS event_date_counts (
+        date TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    'INSERT INTO dashboard_stats (id) VALUES (1) ON CONFLICT DO NOTHING',
+    '''
+    CREATE OR REPLACE FUNCTION events_stats() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            UPDATE dashboard_stats
+            SET total_events = total_events - CASE WHEN TG_OP = 'DELETE' THEN 1 ELSE 0 END,
+                total_waste_collected = total_waste_collected - COALESCE(OLD.waste_collected, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1;
+            UPDATE event_date_counts SET count = count - 1 WHERE date = OLD.date;
+            DELETE FROM event_date_counts WHERE date = OLD.date AND count <= 0;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            UPDATE dashboard_stats
+            SET total_events = total_events + CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE 0 END,
+                total_waste_collected = total_waste_collected + COALESCE(NEW.waste_collected, 0),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = 1;
+            INSERT INTO event_date_counts (date, count) VALUES (NEW.date, 1)
+            ON CONFLICT (date) DO UPDATE SET count = event_date_counts.count + 1;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS trg_events_stats ON events',
+    '''
+    CREATE TRIGGER trg_events_stats
+    AFTER INSERT OR DELETE OR UPDATE OF waste_collected, date ON events
+    FOR EACH ROW EXECUTE FUNCTION events_stats()
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION participants_stats() RETURNS trigger AS $$
+    BEGIN
+        UPDATE dashboard_stats
+        SET total_participants = total_participants + CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS trg_participants_stats ON event_participants',
+    '''
+    CREATE TRIGGER trg_participants_stats
+    AFTER INSERT OR DELETE ON event_participants
+    FOR EACH ROW EXECUTE FUNCTION participants_stats()
+    ''',
+]
+
+
+def read_dashboard_stats(conn):
+    stats = conn.execute('''
+        SELECT total_events, total_participants, total_waste_collected
+        FROM dashboard_stats WHERE id = 1
+    ''').fetchone()
+    upcoming = conn.execute(
+        'SELECT COALESCE(SUM(count), 0) as count FROM event_date_counts WHERE date >= CAST(CURRENT_DATE AS TEXT)'
+    ).fetchone()['count']
+    return {
+        'total_events': stats['total_events'],
+        'total_participants': stats['total_participants'],
+        'total_waste_collected': round(stats['total_waste_collected'], 2),
+        'upcoming_events': upcoming,
+    }
+
+
+def reconcile(conn, fix=True):
+    """Recompute the counters from the base tables and report any drift.
+
+    Returns {counter: {'stored': x, 'actual': y}} for each counter that was off.
+    With fix=True the stored values are overwritten in the same transaction.
+    Runs inside the caller's transaction if one is already open.
+    """
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute('BEGIN IMMEDIATE')
+    try:
+        stored = conn.execute('''
+            SELECT total_events, total_participants, total_waste_collected
+            FROM dashboard_stats WHERE id = 1
+        ''').fetchone()
+        actual = {
+            'total_events': conn.execute('SELECT COUNT(*) FROM events').fetchone()[0],
+            'total_participants': conn.execute('SELECT COUNT(*) FROM event_participants').fetchone()[0],
+            'total_waste_collected': conn.execute(
+                'SELECT COALESCE(SUM(waste_collected), 0.0) FROM events'
+            ).fetchone()[0],
+        }
+        drift = {}
+        for key, value in actual.items():
+            current = stored[key] if stored else None
+            if current is None or abs(current - value) > 1e-6:
+                drift[key] = {'stored': current, 'actual': value}
+
+        stored_dates = dict(conn.execute('SELECT date, count FROM event_date_counts').fetchall())
+        actual_dates = dict(conn.execute('SELECT date, COUNT(*) FROM events GROUP BY date').fetchall())
+        if stored_dates != actual_dates:
+            drift['event_date_counts'] = {
+                'stored': sum(stored_dates.values()),
+                'actual': sum(actual_dates.values()),
+            }
+
+        if fix and drift:
+            conn.execute('''
+                INSERT INTO dashboard_stats
+                    (id, total_events, total_participants, total_waste_collected, updated_at)
+                VALUES (1, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT (id) DO UPDATE SET
+                    total_events = excluded.total_events,
+                    total_participants = excluded.total_participants,
+                    total_waste_collected = excluded.total_waste_collected,
+                    updated_at = excluded.updated_at
+            ''', (actual['total_events'], actual['total_participants'], actual['total_waste_collected']))
+            conn.execute('DELETE FROM event_date_counts')
+            conn.executemany(
+                'INSERT INTO event_date_counts (date, count) VALUES (?, ?)',
+                actual_dates.items()
+            )
+        if owns_transaction:
+            conn.commit()
+    except Exception:
+        if owns_transaction:
+            conn.rollback()
+        raise
+
+    if drift:
+        logger.warning(f"Dashboard stats drift{' (fixed)' if fix else ''}: {drift}")
+    return drift
+
+
+def start_reconcile_job(pool, interval=RECONCILE_INTERVAL):
+    """Re-check the counters every `interval` seconds on a daemon thread."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                with pool.connection() as conn:
+                    reconcile(conn)
+            except Exception as e:
+                logger.error(f"Stats reconciliation failed: {e}")
+
+    threading.Thread(target=run, name='stats-reconcile', daemon=True).start()
+    return stop
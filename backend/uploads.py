@@ -0,0 +1,208 @@
+import glob
+import hashlib
+import logging
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # derivatives are skipped, originals are still stored and served
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 2))
+
+# Stored files never change under a given name, so clients may keep them for a year
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+# '' serves bytes from Flask, 'x-sendfile' (Apache/lighttpd) or 'x-accel-redirect' (nginx)
+# hands the file to the front proxy; nginx needs an internal location at UPLOAD_ACCEL_PREFIX
+UPLOAD_SENDFILE = os.environ.get('UPLOAD_SENDFILE', '').lower()
+UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX', '/protected-uploads/')
+
+# variant -> bounding box; every variant is re-encoded as progressive JPEG
+DERIVATIVES = {
+    'thumb': (320, 320),
+    'card': (800, 600),
+    'full': (1920, 1920),
+}
+DERIVATIVE_QUALITY = 82
+
+MAGIC_BYTES = {
+    'png': (b'\x89PNG\r\n\x1a\n',),
+    'jpg': (b'\xff\xd8\xff',),
+    'jpeg': (b'\xff\xd8\xff',),
+    'gif': (b'GIF87a', b'GIF89a'),
+}
+
+CONTENT_NAME = re.compile(r'^([0-9a-f]{64})(?:_([a-z]+))?\.([a-z]+)$')
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+def store_upload(stream, folder, ext, max_bytes=MAX_UPLOAD_BYTES):
+    """Stream an upload to disk under its content hash.
+
+    Returns (filename, digest, deduplicated). The body is hashed while it is
+    written to a temp file, so nothing larger than one chunk is held in memory.
+    """
+    ext = ext.lower()
+    tmp_path = os.path.join(folder, f'.upload-{uuid.uuid4().hex}')
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            first = True
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if first:
+                    if not chunk.startswith(MAGIC_BYTES.get(ext, (b'',))):
+                        raise UploadError('File content does not match its extension')
+                    first = False
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f'File exceeds the {max_bytes // (1024 * 1024)} MB limit')
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UploadError('Empty file')
+
+        digest = digest.hexdigest()
+        filename = f'{digest}.{ext}'
+        final_path = os.path.join(folder, filename)
+        if os.path.exists(final_path):
+            os.remove(tmp_path)
+            return filename, digest, True
+        os.replace(tmp_path, final_path)
+        return filename, digest, False
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def derivative_name(digest, variant):
+    return f'{digest}_{variant}.jpg'
+
+
+def derivative_urls(image_url):
+    """Map an /uploads/<hash>.<ext> reference to its per-view variant URLs."""
+    if not image_url or not image_url.startswith('/uploads/'):
+        return None
+    match = CONTENT_NAME.match(image_url[len('/uploads/'):])
+    if not match or match.group(2):
+        return None
+    digest = match.group(1)
+    return {variant: f'/uploads/{derivative_name(digest, variant)}' for variant in DERIVATIVES}
+
+
+def resolve_upload(folder, filename):
+    """Serve the original while a requested derivative is still being generated."""
+    match = CONTENT_NAME.match(filename)
+    if not match or not match.group(2) or os.path.exists(os.path.join(folder, filename)):
+        return filename
+    originals = glob.glob(os.path.join(folder, match.group(1) + '.*'))
+    return os.path.basename(originals[0]) if originals else filename
+
+
+def upload_etag(path, filename):
+    """Strong validator: the content hash for hashed names, mtime and size otherwise."""
+    if CONTENT_NAME.match(filename):
+        return filename.rsplit('.', 1)[0]
+    st = os.stat(path)
+    return f'{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+def make_derivatives(folder, filename):
+    # Runs in a worker process
+    digest = CONTENT_NAME.match(filename).group(1)
+    created = []
+    with Image.open(os.path.join(folder, filename)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode in ('RGBA', 'LA', 'P'):
+            source = source.convert('RGBA')
+            background = Image.new('RGB', source.size, (255, 255, 255))
+            background.paste(source, mask=source.getchannel('A'))
+            source = background
+        else:
+            source = source.convert('RGB')
+
+        for variant, size in DERIVATIVES.items():
+            name = derivative_name(digest, variant)
+            path = os.path.join(folder, name)
+            if os.path.exists(path):
+                continue
+            image = source.copy()
+            image.thumbnail(size, Image.LANCZOS)
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            image.save(tmp_path, 'JPEG', quality=DERIVATIVE_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, path)
+            created.append(name)
+    return created
+
+
+class DerivativeWorker:
+    """Generates resized derivatives in a background process pool."""
+
+    def __init__(self, folder, workers=UPLOAD_WORKERS):
+        self.folder = folder
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._metrics = {'submitted': 0, 'completed': 0, 'failed': 0, 'skipped': 0}
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def submit(self, filename):
+        if not self.enabled:
+            return False
+        digest = CONTENT_NAME.match(filename).group(1)
+        done = all(
+            os.path.exists(os.path.join(self.folder, derivative_name(digest, v))) for v in DERIVATIVES
+        )
+        with self._lock:
+            if done or filename in self._pending:
+                self._metrics['skipped'] += 1
+                return False
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pending.add(filename)
+            self._metrics['submitted'] += 1
+            future = self._executor.submit(make_derivatives, self.folder, filename)
+        future.add_done_callback(lambda f: self._done(filename, f))
+        return True
+
+    def _done(self, filename, future):
+        with self._lock:
+            self._pending.discard(filename)
+            if future.exception():
+                self._metrics['failed'] += 1
+                logger.error(f"Derivative generation for {filename} failed: {future.exception()}")
+            else:
+                self._metrics['completed'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {**self._metrics, 'pending': len(self._pending), 'enabled': self.enabled}
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+USER_CACHE_ENTRIES = 4096
+USER_CACHE_TTL = 300  # seconds; also bounds staleness across processes
+
+USER_COLUMNS = 'id, name, email, phone, password_hash, created_at, is_active'
+
+
+class UserCache:
+    """Read-through LRU cache of user rows, addressable by id and by email.
+
+    Writers must call invalidate() after touching the users table. A load
+    that races with an invalidation is not stored, so a stale row can't be
+    put back after the write that replaced it.
+    """
+
+    def __init__(self, pool, max_entries=USER_CACHE_ENTRIES, ttl=USER_CACHE_TTL):
+        self.pool = pool
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._by_id = OrderedDict()
+        self._email_to_id = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._metrics = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def _lookup(self, user_id):
+        entry = self._by_id.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            self._drop(user_id)
+            return None
+        self._by_id.move_to_end(user_id)
+        return user
+
+    def _drop(self, user_id):
+        entry = self._by_id.pop(user_id, None)
+        if entry:
+            self._email_to_id.pop(entry[1]['email'].lower(), None)
+
+    def _store(self, user, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._drop(user['id'])
+            self._by_id[user['id']] = (time.monotonic() + self.ttl, user)
+            self._email_to_id[user['email'].lower()] = user['id']
+            while len(self._by_id) > self.max_entries:
+                oldest, _ = next(iter(self._by_id.items()))
+                self._drop(oldest)
+                self._metrics['evictions'] += 1
+
+    def _load(self, column, value):
+        with self._lock:
+            generation = self._generation
+        with self.pool.connection() as conn:
+            row = conn.execute(f'SELECT {USER_COLUMNS} FROM users WHERE {column} = ?', (value,)).fetchone()
+        if row is None:
+            return None
+        user = dict(row)
+        self._store(user, generation)
+        return user
+
+    def by_id(self, user_id):
+        with self._lock:
+            user = self._lookup(user_id)
+            self._metrics['hits' if user else 'misses'] += 1
+        return user if user else self._load('id', user_id)
+
+    def by_email(self, email):
+        with self._lock:
+            user_id = self._email_to_id.get(email.lower())
+            user = self._lookup(user_id) if user_id is not None else None
+            # Emails are matched case-sensitively in SQL, keep that behaviour
+            if user and user['email'] != email:
+                user = None
+            self._metrics['hits' if user else 'misses'] += 1
+        return user if user else self._load('email', email)
+
+    def invalidate(self, user_id=None, email=None):
+        with self._lock:
+            self._generation += 1
+            self._metrics['invalidations'] += 1
+            if email is not None:
+                cached_id = self._email_to_id.get(email.lower())
+                if cached_id is not None:
+                    self._drop(cached_id)
+            if user_id is not None:
+                self._drop(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._by_id.clear()
+            self._email_to_id.clear()
+
+    def stats(self):
+        with self._lock:
+            m = dict(self._metrics)
+            size = len(self._by_id)
+        lookups = m['hits'] + m['misses']
+        return {
+            **m,
+            'entries': size,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'hit_ratio': round(m['hits'] / lookups, 4) if lookups else 0.0,
+        }